@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный бенчмарк ИИ-обработки отчетов.
+Прогоняет ReportHandler._process_report_async от N одновременных
+пользователей через настоящий OllamaService и выводит пропускную
+способность и перцентили задержек. По умолчанию поднимает локальную
+заглушку Ollama (ollama_stub_server.py), Telegram заменяется mock-объектом.
+
+Запуск:
+    python ai_load_benchmark.py --users 20 --reports 100 --mean 6 --parallel 2
+    python ai_load_benchmark.py --stubs 3 --users 30 --reports 150 --error-rate 0.1
+    python ai_load_benchmark.py --url http://localhost:11434 --users 4 --reports 8
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Минимальная конфигурация для импорта настроек бота без .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("GROUP_CHAT_ID", "0")
+
+# Добавляем путь к модулям
+sys.path.append(str(Path(__file__).parent / 'src'))
+
+from loguru import logger
+
+from models.report import WeeklyReport
+from services.ollama_service import OllamaService
+from handlers.report_handler import ReportHandler
+from ollama_stub_server import add_stub_arguments, start_stub_server, stub_config_from_args
+
+SAMPLE_TASKS = [
+    "Провел входной контроль партии комплектующих, оформил акты.",
+    "Подготовил техническую документацию по изделию, согласовал с ОГК.",
+    "Выполнил ремонт оборудования на участке сборки.",
+    "Сформировал заявки на закупку материалов на следующий месяц."
+]
+SAMPLE_PROBLEMS = [
+    "Задержка поставки комплектующих от поставщика.",
+    "Не хватает измерительного инструмента на участке.",
+    "Проблем нет."
+]
+
+
+class MockTelegramService:
+    """Mock-версия TelegramService с задержкой отправки"""
+
+    def __init__(self, delay: float = 0.2):
+        self.delay = delay
+        self.sent = 0
+
+    async def send_report_to_group(self, report):
+        await asyncio.sleep(self.delay)
+        self.sent += 1
+        return True
+
+    async def send_message_safe(self, chat_id, text, **kwargs):
+        return True
+
+
+def make_report(user_id: int) -> WeeklyReport:
+    """Генерация правдоподобного отчета"""
+    week_start = datetime.now() - timedelta(days=datetime.now().weekday())
+    return WeeklyReport(
+        user_id=user_id,
+        username=f"user{user_id}",
+        full_name=f"Сотрудник {user_id}",
+        department="ОТК",
+        position="Инженер",
+        week_start=week_start,
+        week_end=week_start + timedelta(days=6),
+        completed_tasks="\n".join(random.sample(SAMPLE_TASKS, 3)),
+        achievements="Все плановые задачи выполнены в срок.",
+        problems=random.choice(SAMPLE_PROBLEMS),
+        next_week_plans="Продолжить работу по текущим задачам отдела."
+    )
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    stub_runners = []
+    urls = [url.strip() for url in (args.url or "").split(",") if url.strip()]
+    if not urls:
+        # Несколько заглушек на соседних портах имитируют пул серверов Ollama
+        for index in range(args.stubs):
+            port = args.stub_port + index
+            stub_runners.append(await start_stub_server(stub_config_from_args(args), port=port))
+            urls.append(f"http://127.0.0.1:{port}")
+
+    ollama_service = OllamaService(urls=urls)
+    telegram_service = MockTelegramService(delay=args.telegram_delay)
+    handler = ReportHandler(
+        report_processor=None,
+        ollama_service=ollama_service,
+        telegram_service=telegram_service,
+        task_manager=None,
+        db_manager=None
+    )
+
+    if args.warm_up:
+        await ollama_service.warm_up()
+
+    latencies = []
+    outcomes = {"processed": 0, "unprocessed": 0, "errors": 0}
+    counter = iter(range(args.reports))
+
+    async def user_loop(user_index: int):
+        for _ in counter:
+            report = make_report(1000 + user_index)
+            started = time.monotonic()
+            try:
+                await handler._process_report_async(report, report.user_id)
+                outcomes["processed" if report.is_processed else "unprocessed"] += 1
+            except Exception as e:
+                outcomes["errors"] += 1
+                logger.warning(f"Ошибка обработки: {e}")
+            latencies.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    await asyncio.gather(*(user_loop(index) for index in range(args.users)))
+    elapsed = time.monotonic() - started
+
+    for runner in stub_runners:
+        await runner.cleanup()
+
+    return {
+        "elapsed": elapsed,
+        "latencies": latencies,
+        "outcomes": outcomes,
+        "ollama": ollama_service.get_metrics()
+    }
+
+
+def print_results(args: argparse.Namespace, results: dict) -> None:
+    latencies = results["latencies"]
+    elapsed = results["elapsed"]
+    outcomes = results["outcomes"]
+    ollama = results["ollama"]
+
+    print("\nРЕЗУЛЬТАТЫ БЕНЧМАРКА ИИ-ОБРАБОТКИ")
+    print("=" * 50)
+    print(f"Пользователей одновременно: {args.users}")
+    print(f"Отчетов обработано: {len(latencies)} за {elapsed:.1f} с")
+    print(f"Пропускная способность: {len(latencies) / max(elapsed, 1e-9) * 60:.1f} отчетов/мин")
+    print(f"С ИИ-анализом: {outcomes['processed']}, без анализа: {outcomes['unprocessed']}, "
+          f"ошибок: {outcomes['errors']}")
+    print("\nЗадержка обработки отчета, с:")
+    for label, q in (("p50", 0.5), ("p90", 0.9), ("p95", 0.95), ("p99", 0.99)):
+        print(f"  {label}: {percentile(latencies, q):.2f}")
+    print(f"  max: {max(latencies) if latencies else 0:.2f}")
+    print("\nЗапросы к Ollama:")
+    for kind, title in (("warm", "прогретая модель"), ("cold", "холодный старт")):
+        summary = ollama[kind]
+        if summary["count"]:
+            print(f"  {title}: {summary['count']} шт., среднее {summary['avg']:.2f} с, p95 {summary['p95']:.2f} с")
+        else:
+            print(f"  {title}: нет данных")
+    print("\nСерверы Ollama:")
+    for endpoint in ollama["endpoints"]:
+        print(f"  {endpoint['url']}: запросов {endpoint['requests']}, ошибок {endpoint['failures']}, "
+              f"состояние {endpoint['state']}")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк ИИ-обработки отчетов")
+    parser.add_argument("--users", type=int, default=10, help="число одновременных пользователей")
+    parser.add_argument("--reports", type=int, default=50, help="общее число отчетов")
+    parser.add_argument("--url", default=None,
+                        help="адреса Ollama через запятую (по умолчанию - встроенные заглушки)")
+    parser.add_argument("--stubs", type=int, default=1, help="число встроенных заглушек Ollama")
+    parser.add_argument("--stub-port", type=int, default=11435, help="порт первой заглушки")
+    parser.add_argument("--telegram-delay", type=float, default=0.2, help="задержка отправки в группу, с")
+    parser.add_argument("--warm-up", action="store_true", help="прогреть модель перед замером")
+    parser.add_argument("--verbose", action="store_true", help="выводить логи бота")
+    add_stub_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if not args.verbose:
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+
+    results = asyncio.run(run_benchmark(args))
+    print_results(args, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Локальная заглушка Ollama API для нагрузочного тестирования.
+Имитирует /api/generate, /api/tags, /api/embeddings и /api/ps
+с настраиваемым распределением задержек, потоковой выдачей,
+холодной загрузкой модели и внедрением ошибок.
+
+Запуск:
+    python ollama_stub_server.py --port 11435 --latency lognormal --mean 8 --error-rate 0.05
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+from aiohttp import web
+
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal")
+
+STUB_RESPONSE = (
+    "1. Оценка продуктивности: средняя.\n"
+    "2. Ключевые достижения: задачи недели выполнены в срок.\n"
+    "3. Проблемы и рекомендации: согласовать сроки поставок заранее.\n"
+    "4. Планы реалистичны.\n"
+    "5. Рекомендации: продолжать работу в том же темпе."
+)
+
+
+@dataclass
+class StubConfig:
+    """Параметры поведения заглушки"""
+    model: str = "gemma3:4b"
+    latency: str = "lognormal"
+    mean: float = 5.0
+    stddev: float = 2.0
+    load_time: float = 10.0
+    keep_alive: float = 300.0
+    parallel: int = 1
+    error_rate: float = 0.0
+    timeout_rate: float = 0.0
+    hang_time: float = 300.0
+    embedding_dim: int = 768
+    embedding_latency: float = 0.05
+    seed: Optional[int] = None
+
+
+class OllamaStub:
+    """Эмуляция сервера Ollama"""
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        # Ollama обрабатывает ограниченное число запросов одновременно (OLLAMA_NUM_PARALLEL)
+        self.slots = asyncio.Semaphore(config.parallel)
+        self.loaded_until = 0.0
+        self._load_lock = asyncio.Lock()
+        self.stats = {"requests": 0, "errors": 0, "timeouts": 0, "cold_loads": 0}
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/api/generate", self.generate)
+        app.router.add_post("/api/embeddings", self.embeddings)
+        app.router.add_get("/api/tags", self.tags)
+        app.router.add_get("/api/ps", self.ps)
+        app.router.add_get("/stub/stats", self.stub_stats)
+        return app
+
+    def _sample_latency(self) -> float:
+        """Время генерации по выбранному распределению"""
+        config = self.config
+        if config.latency == "fixed":
+            value = config.mean
+        elif config.latency == "uniform":
+            value = self.random.uniform(config.mean - config.stddev, config.mean + config.stddev)
+        elif config.latency == "normal":
+            value = self.random.gauss(config.mean, config.stddev)
+        else:
+            # Логнормальное распределение с заданными средним и отклонением
+            variance = (config.stddev / config.mean) ** 2 if config.mean > 0 else 0
+            sigma = math.sqrt(math.log(1 + variance)) if variance > 0 else 0.0
+            mu = math.log(config.mean) - sigma ** 2 / 2 if config.mean > 0 else 0.0
+            value = self.random.lognormvariate(mu, sigma)
+        return max(value, 0.0)
+
+    @staticmethod
+    def _parse_keep_alive(value, default: float) -> float:
+        """keep_alive из запроса в секундах"""
+        if value is None:
+            return default
+        if isinstance(value, (int, float)):
+            return float("inf") if value < 0 else float(value)
+        text = str(value).strip()
+        multiplier = {"s": 1, "m": 60, "h": 3600}.get(text[-1:], None)
+        try:
+            if multiplier:
+                return float(text[:-1]) * multiplier
+            return float(text)
+        except ValueError:
+            return default
+
+    async def _ensure_loaded(self, keep_alive) -> float:
+        """Имитация загрузки модели; возвращает время загрузки в секундах"""
+        load_seconds = 0.0
+        async with self._load_lock:
+            if time.monotonic() >= self.loaded_until:
+                self.stats["cold_loads"] += 1
+                load_seconds = self.config.load_time
+                await asyncio.sleep(load_seconds)
+        self.loaded_until = time.monotonic() + self._parse_keep_alive(keep_alive, self.config.keep_alive)
+        return load_seconds
+
+    async def _inject_failure(self) -> Optional[web.Response]:
+        """Внедрение ошибок и зависаний"""
+        roll = self.random.random()
+        if roll < self.config.error_rate:
+            self.stats["errors"] += 1
+            return web.json_response({"error": "stub: injected failure"}, status=500)
+        if roll < self.config.error_rate + self.config.timeout_rate:
+            self.stats["timeouts"] += 1
+            await asyncio.sleep(self.config.hang_time)
+        return None
+
+    async def generate(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        self.stats["requests"] += 1
+
+        failure = await self._inject_failure()
+        if failure is not None:
+            return failure
+
+        prompt = payload.get("prompt") or ""
+        stream = payload.get("stream", True)
+        num_predict = (payload.get("options") or {}).get("num_predict", 128)
+
+        async with self.slots:
+            started = time.monotonic()
+            load_seconds = await self._ensure_loaded(payload.get("keep_alive"))
+
+            # Запрос без промпта только загружает модель
+            if not prompt:
+                return web.json_response(self._final_chunk("", load_seconds, started, 0, 0, "load"))
+
+            latency = self._sample_latency()
+            words = STUB_RESPONSE.split(" ")
+            eval_count = min(len(words) * 2, num_predict)
+
+            if not stream:
+                await asyncio.sleep(latency)
+                body = self._final_chunk(STUB_RESPONSE, load_seconds, started, len(prompt) // 3, eval_count)
+                return web.json_response(body)
+
+            response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+            await response.prepare(request)
+            step = latency / max(len(words), 1)
+            for word in words:
+                await asyncio.sleep(step)
+                chunk = {"model": self.config.model, "created_at": self._now(), "response": word + " ", "done": False}
+                await response.write((json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8"))
+            final = self._final_chunk("", load_seconds, started, len(prompt) // 3, eval_count)
+            await response.write((json.dumps(final) + "\n").encode("utf-8"))
+            await response.write_eof()
+            return response
+
+    def _final_chunk(self, text: str, load_seconds: float, started: float,
+                     prompt_eval_count: int, eval_count: int, done_reason: str = "stop") -> dict:
+        total = time.monotonic() - started
+        return {
+            "model": self.config.model,
+            "created_at": self._now(),
+            "response": text,
+            "done": True,
+            "done_reason": done_reason,
+            "total_duration": int(total * 1e9),
+            "load_duration": int(load_seconds * 1e9),
+            "prompt_eval_count": prompt_eval_count,
+            "eval_count": eval_count,
+            "eval_duration": int(max(total - load_seconds, 0) * 1e9)
+        }
+
+    async def embeddings(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        self.stats["requests"] += 1
+
+        failure = await self._inject_failure()
+        if failure is not None:
+            return failure
+
+        await asyncio.sleep(self.config.embedding_latency)
+
+        # Детерминированный вектор: одинаковые тексты дают одинаковые эмбеддинги
+        text = payload.get("prompt") or ""
+        vector = [0.0] * self.config.embedding_dim
+        for word in text.lower().split():
+            digest = int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16)
+            vector[digest % self.config.embedding_dim] += 1.0
+        return web.json_response({"embedding": vector})
+
+    async def tags(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "models": [{"name": self.config.model, "model": self.config.model, "size": 3_338_801_804}]
+        })
+
+    async def ps(self, request: web.Request) -> web.Response:
+        models = []
+        if time.monotonic() < self.loaded_until:
+            models.append({"name": self.config.model, "model": self.config.model})
+        return web.json_response({"models": models})
+
+    async def stub_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+
+async def start_stub_server(config: StubConfig, host: str = "127.0.0.1", port: int = 11435) -> web.AppRunner:
+    """Запуск заглушки в текущем цикле событий (для бенчмарков)"""
+    runner = web.AppRunner(OllamaStub(config).create_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Заглушка Ollama API для нагрузочного тестирования")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    add_stub_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser) -> None:
+    """Параметры поведения заглушки (общие с бенчмарком)"""
+    parser.add_argument("--model", default="gemma3:4b")
+    parser.add_argument("--latency", choices=LATENCY_DISTRIBUTIONS, default="lognormal",
+                        help="распределение времени генерации")
+    parser.add_argument("--mean", type=float, default=5.0, help="среднее время генерации, с")
+    parser.add_argument("--stddev", type=float, default=2.0, help="разброс времени генерации, с")
+    parser.add_argument("--load-time", type=float, default=10.0, help="время холодной загрузки модели, с")
+    parser.add_argument("--keep-alive", type=float, default=300.0, help="keep_alive по умолчанию, с")
+    parser.add_argument("--parallel", type=int, default=1, help="число одновременных генераций")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов HTTP 500")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="доля зависающих запросов")
+    parser.add_argument("--hang-time", type=float, default=300.0, help="длительность зависания, с")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def stub_config_from_args(args: argparse.Namespace) -> StubConfig:
+    return StubConfig(
+        model=args.model,
+        latency=args.latency,
+        mean=args.mean,
+        stddev=args.stddev,
+        load_time=args.load_time,
+        keep_alive=args.keep_alive,
+        parallel=args.parallel,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        hang_time=args.hang_time,
+        seed=args.seed
+    )
+
+
+def main():
+    args = parse_args()
+    config = stub_config_from_args(args)
+    print(f"🧪 Заглушка Ollama: http://{args.host}:{args.port} "
+          f"(модель {config.model}, {config.latency} {config.mean}±{config.stddev} с, "
+          f"параллельно {config.parallel}, ошибки {config.error_rate:.0%})")
+    web.run_app(OllamaStub(config).create_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
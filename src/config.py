@@ -25,10 +25,86 @@ class Settings(BaseSettings):
         else:
             self.thread_id = None
     
+    # Telegram Rate Limits (массовые рассылки)
+    telegram_rate_limit_per_second: float = float(os.getenv("TELEGRAM_RATE_LIMIT_PER_SECOND", "28"))
+    telegram_bulk_concurrency: int = int(os.getenv("TELEGRAM_BULK_CONCURRENCY", "30"))
+    telegram_send_max_attempts: int = int(os.getenv("TELEGRAM_SEND_MAX_ATTEMPTS", "3"))
+    telegram_edit_interval_seconds: float = float(os.getenv("TELEGRAM_EDIT_INTERVAL_SECONDS", "2.0"))
+    
+    # Group Digest Settings (отчеты публикуются в группе сводными сообщениями)
+    group_digest_enabled: bool = os.getenv("GROUP_DIGEST_ENABLED", "False").lower() == "true"
+    group_digest_window_seconds: int = int(os.getenv("GROUP_DIGEST_WINDOW_SECONDS", "900"))
+    group_digest_flush_seconds: float = float(os.getenv("GROUP_DIGEST_FLUSH_SECONDS", "30"))
+    group_digest_max_reports: int = int(os.getenv("GROUP_DIGEST_MAX_REPORTS", "40"))
+    
+    # Task Pool Settings (фоновая обработка отчетов ограниченным числом обработчиков)
+    task_pool_enabled: bool = os.getenv("TASK_POOL_ENABLED", "False").lower() == "true"
+    task_pool_workers: int = int(os.getenv("TASK_POOL_WORKERS", "3"))
+    task_queue_max_size: int = int(os.getenv("TASK_QUEUE_MAX_SIZE", "50"))
+    task_journal_enabled: bool = os.getenv("TASK_JOURNAL_ENABLED", "True").lower() == "true"
+    task_retention_hours: float = float(os.getenv("TASK_RETENTION_HOURS", "24"))
+    task_result_retention_minutes: float = float(os.getenv("TASK_RESULT_RETENTION_MINUTES", "30"))
+    
+    # CPU Pool Settings (выгрузки и аналитика в отдельных процессах)
+    cpu_pool_enabled: bool = os.getenv("CPU_POOL_ENABLED", "False").lower() == "true"
+    cpu_pool_workers: int = int(os.getenv("CPU_POOL_WORKERS", "2"))
+    cpu_pool_max_tasks_per_child: int = int(os.getenv("CPU_POOL_MAX_TASKS_PER_CHILD", "50"))
+    
+    # Metrics Settings (эндпоинт /metrics в формате Prometheus)
+    metrics_enabled: bool = os.getenv("METRICS_ENABLED", "False").lower() == "true"
+    metrics_listen: str = os.getenv("METRICS_LISTEN", "127.0.0.1")
+    metrics_port: int = int(os.getenv("METRICS_PORT", "9108"))
+    
+    # Outbox Settings (долговременная очередь исходящих сообщений)
+    outbox_enabled: bool = os.getenv("OUTBOX_ENABLED", "True").lower() == "true"
+    outbox_max_attempts: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+    
+    # Webhook Settings (прием обновлений через встроенный aiohttp-сервер вместо polling)
+    webhook_enabled: bool = os.getenv("WEBHOOK_ENABLED", "False").lower() == "true"
+    webhook_url: str = os.getenv("WEBHOOK_URL", "")
+    webhook_listen: str = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+    webhook_port: int = int(os.getenv("WEBHOOK_PORT", "8443"))
+    webhook_path: str = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+    webhook_secret_token: str = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+    webhook_cert_path: str = os.getenv("WEBHOOK_CERT_PATH", "")
+    webhook_key_path: str = os.getenv("WEBHOOK_KEY_PATH", "")
+    
     # Ollama Configuration
     ollama_url: str = os.getenv("OLLAMA_URL", "http://localhost:11434")
+    # Несколько серверов через запятую; если не задано, используется OLLAMA_URL
+    ollama_urls: str = os.getenv("OLLAMA_URLS", "")
+    ollama_circuit_failure_threshold: int = int(os.getenv("OLLAMA_CIRCUIT_FAILURE_THRESHOLD", "3"))
+    ollama_circuit_recovery_seconds: float = float(os.getenv("OLLAMA_CIRCUIT_RECOVERY_SECONDS", "30"))
     ollama_model: str = os.getenv("OLLAMA_MODEL", "gemma3:4b")
-    
+    ollama_num_ctx: int = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+    ollama_prompt_reserve_tokens: int = int(os.getenv("OLLAMA_PROMPT_RESERVE_TOKENS", "256"))
+    ollama_keep_alive: str = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+    
+    # Model Warm-up Settings (прогрев модели перед дедлайнами)
+    ollama_warmup_enabled: bool = os.getenv("OLLAMA_WARMUP_ENABLED", "True").lower() == "true"
+    ollama_warmup_lead_minutes: int = int(os.getenv("OLLAMA_WARMUP_LEAD_MINUTES", "60"))
+    ollama_warmup_window_minutes: int = int(os.getenv("OLLAMA_WARMUP_WINDOW_MINUTES", "120"))
+    
+    # Model Routing Settings (быстрая модель для коротких и низкоприоритетных запросов)
+    ollama_fast_model: str = os.getenv("OLLAMA_FAST_MODEL", "")
+    ai_fast_model_max_prompt_tokens: int = int(os.getenv("AI_FAST_MODEL_MAX_PROMPT_TOKENS", "400"))
+    ai_downgrade_queue_depth: int = int(os.getenv("AI_DOWNGRADE_QUEUE_DEPTH", "10"))
+    ai_downgrade_latency_seconds: float = float(os.getenv("AI_DOWNGRADE_LATENCY_SECONDS", "60"))
+    
+    # Speculative Processing (анализ начинается до подтверждения отчета)
+    ai_speculative_enabled: bool = os.getenv("AI_SPECULATIVE_ENABLED", "True").lower() == "true"
+    
+    # AI Queue Settings (отложенная обработка отчетов)
+    ai_deferred_mode: bool = os.getenv("AI_DEFERRED_MODE", "False").lower() == "true"
+    ai_queue_workers: int = int(os.getenv("AI_QUEUE_WORKERS", "2"))
+    ai_queue_rate_per_minute: float = float(os.getenv("AI_QUEUE_RATE_PER_MINUTE", "6"))
+    ai_queue_max_attempts: int = int(os.getenv("AI_QUEUE_MAX_ATTEMPTS", "3"))
+    
+    # Embedding Index Settings (поиск повторов и похожих отчетов)
+    embedding_index_enabled: bool = os.getenv("EMBEDDING_INDEX_ENABLED", "False").lower() == "true"
+    ollama_embedding_model: str = os.getenv("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text")
+    embedding_duplicate_threshold: float = float(os.getenv("EMBEDDING_DUPLICATE_THRESHOLD", "0.95"))
+
     # Application Settings
     debug: bool = os.getenv("DEBUG", "False").lower() == "true"
     log_level: str = os.getenv("LOG_LEVEL", "INFO")
@@ -45,6 +121,20 @@ class Settings(BaseSettings):
     
     # Report Settings
     report_deadline: str = os.getenv("REPORT_DEADLINE", "Friday 18:00")
+    # За сколько часов до дедлайна отдела напоминать тем, кто не сдал отчет (0 - не напоминать)
+    reminder_deadline_lead_hours: int = int(os.getenv("REMINDER_DEADLINE_LEAD_HOURS", "2"))
+    # Рассылка напоминаний волнами по отделам (сглаживание пика отчетов и ИИ-анализа)
+    reminder_waves_enabled: bool = os.getenv("REMINDER_WAVES_ENABLED", "False").lower() == "true"
+    reminder_wave_window_minutes: int = int(os.getenv("REMINDER_WAVE_WINDOW_MINUTES", "60"))
+    reminder_wave_max_users: int = int(os.getenv("REMINDER_WAVE_MAX_USERS", "20"))
+    reminder_wave_max_ai_load: int = int(os.getenv("REMINDER_WAVE_MAX_AI_LOAD", "10"))
+    # Журнал отправленных напоминаний (однократная отправка при перезапусках и нескольких экземплярах)
+    reminder_ledger_enabled: bool = os.getenv("REMINDER_LEDGER_ENABLED", "True").lower() == "true"
+    
+    # Conversation Persistence (состояние диалогов и черновики отчетов в SQLite)
+    persistence_enabled: bool = os.getenv("PERSISTENCE_ENABLED", "True").lower() == "true"
+    persistence_flush_interval: float = float(os.getenv("PERSISTENCE_FLUSH_INTERVAL", "10"))
+    report_draft_ttl_hours: float = float(os.getenv("REPORT_DRAFT_TTL_HOURS", "24"))
     
     # Database
     database_url: str = os.getenv("DATABASE_URL", "sqlite:///reports.db")
@@ -55,6 +145,11 @@ class Settings(BaseSettings):
             return []
         return [int(x.strip()) for x in self.admin_user_ids.split(',') if x.strip().isdigit()]
     
+    def get_ollama_urls(self) -> List[str]:
+        """Получить список серверов Ollama"""
+        urls = [url.strip() for url in self.ollama_urls.split(',') if url.strip()]
+        return urls or [self.ollama_url]
+    
     def get_timezone(self) -> pytz.BaseTzInfo:
         """Получить объект временной зоны"""
         try:
@@ -84,7 +179,7 @@ settings = Settings()
 
 # Константы для бота
 COMPANY_NAME = "АО ЭМЗ ФИРМА СЭЛМА"
-REPORT_DEADLINE_DAY = 5  # Пятница
+REPORT_DEADLINE_DAY = 5  # Пятница (1=понедельник ... 7=воскресенье, см. deadline_weekday)
 REPORT_DEADLINE_HOUR = 18  # 18:00
 
 # Список отделов компании
@@ -116,6 +211,8 @@ MESSAGES = {
             "💡 Отчеты необходимо отправлять каждую пятницу до 18:00",
     
     "report_created": "✅ Отчет успешно создан и отправлен!",
+    "report_queued": "✅ Отчет принят и опубликован!\n\n"
+                     "🤖 ИИ анализ поставлен в очередь и будет добавлен к отчету в группе автоматически.",
     "report_exists": "ℹ️ Вы уже отправили отчет на эту неделю.",
     "report_deadline_passed": "⚠️ Срок подачи отчета истек.",
     
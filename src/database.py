@@ -10,6 +10,7 @@ from loguru import logger
 from models.department import Department, Employee
 from models.report import WeeklyReport
 from config import settings
+from utils.date_utils import deadline_weekday
 
 class DatabaseManager:
     """Менеджер базы данных SQLite"""
@@ -94,11 +95,21 @@ class DatabaseManager:
                         position TEXT,
                         submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         is_late BOOLEAN DEFAULT FALSE,
+                        summary TEXT,
+                        analysis TEXT,
                         FOREIGN KEY (user_id) REFERENCES employees (user_id),
                         UNIQUE(user_id, week_start)
                     )
                 """)
                 
+                # Добавляем поля результатов ИИ-анализа если их нет (для существующих баз)
+                cursor.execute("PRAGMA table_info(reports)")
+                report_columns = [row[1] for row in cursor.fetchall()]
+                for column in ('summary', 'analysis'):
+                    if column not in report_columns:
+                        cursor.execute(f"ALTER TABLE reports ADD COLUMN {column} TEXT")
+                        logger.info(f"Добавлено поле {column} в таблицу reports")
+                
                 # Создание таблицы настроек напоминаний
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS reminder_settings (
@@ -111,6 +122,15 @@ class DatabaseManager:
                     )
                 """)
                 
+                # Создание таблицы недоступных пользователей (заблокировали бота, чат не найден)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS delivery_status (
+                        user_id INTEGER PRIMARY KEY,
+                        reason TEXT NOT NULL,
+                        failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                
                 # Добавляем настройки по умолчанию если таблица пустая
                 cursor.execute("SELECT COUNT(*) FROM reminder_settings")
                 if cursor.fetchone()[0] == 0:
@@ -502,7 +522,7 @@ class DatabaseManager:
                     if dept and dept.report_required:
                         # Логика определения опоздания (упрощенная)
                         current_time = datetime.now()
-                        deadline_day = dept.report_deadline_day
+                        deadline_day = deadline_weekday(dept.report_deadline_day)
                         deadline_hour = dept.report_deadline_hour
                         # Здесь можно добавить более сложную логику
                         is_late = current_time.weekday() > deadline_day or \
@@ -527,6 +547,22 @@ class DatabaseManager:
             logger.error(f"Ошибка сохранения отчета: {e}")
             return False
     
+    async def update_report_analysis(self, user_id: int, week_start: date,
+                                     summary: Optional[str], analysis: Optional[str]) -> bool:
+        """Сохранение результатов ИИ-анализа отчета"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE reports SET summary = ?, analysis = ?
+                    WHERE user_id = ? AND week_start = ?
+                """, (summary, analysis, user_id, week_start))
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Ошибка сохранения ИИ-анализа отчета пользователя {user_id}: {e}")
+            return False
+    
     async def get_reports_by_week(self, week_start: date, week_end: date) -> List[WeeklyReport]:
         """Получение отчетов за неделю"""
         try:
@@ -645,8 +681,11 @@ class DatabaseManager:
             logger.error(f"Ошибка получения статистики отдела {department_code}: {e}")
             return {}
     
-    async def get_missing_reports_users(self, week_start: date) -> List[Employee]:
-        """Получение списка сотрудников, не сдавших отчет"""
+    async def get_missing_reports_users(self, week_start: date, include_unreachable: bool = False) -> List[Employee]:
+        """Получение списка сотрудников, не сдавших отчет.
+        
+        Пользователи, до которых не доходят сообщения бота, по умолчанию исключаются.
+        """
         try:
             with sqlite3.connect(self.db_path) as conn:
                 conn.row_factory = sqlite3.Row
@@ -660,8 +699,9 @@ class DatabaseManager:
                       AND e.is_blocked = FALSE 
                       AND d.report_required = TRUE 
                       AND r.id IS NULL
+                      AND (? OR e.user_id NOT IN (SELECT user_id FROM delivery_status))
                     ORDER BY e.department_code, e.full_name
-                """, (week_start,))
+                """, (week_start, include_unreachable))
                 rows = cursor.fetchall()
                 
                 employees = []
@@ -674,6 +714,95 @@ class DatabaseManager:
             logger.error(f"Ошибка получения списка не сдавших отчет: {e}")
             return []
     
+    async def mark_user_unreachable(self, user_id: int, reason: str) -> bool:
+        """Отметка пользователя, до которого не доходят сообщения бота"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO delivery_status (user_id, reason, failed_at)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET reason = excluded.reason
+                """, (user_id, reason, datetime.now()))
+                conn.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Ошибка отметки недоступного пользователя {user_id}: {e}")
+            return False
+    
+    async def mark_user_reachable(self, user_id: int) -> bool:
+        """Снятие отметки о недоступности пользователя"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM delivery_status WHERE user_id = ?", (user_id,))
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Ошибка снятия отметки недоступности пользователя {user_id}: {e}")
+            return False
+    
+    async def get_unreachable_users(self) -> List[Dict[str, Any]]:
+        """Пользователи, до которых не доходят сообщения бота"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT ds.user_id, ds.reason, ds.failed_at, e.full_name, e.department_code
+                    FROM delivery_status ds
+                    LEFT JOIN employees e ON e.user_id = ds.user_id
+                    ORDER BY ds.failed_at DESC
+                """)
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Ошибка получения недоступных пользователей: {e}")
+            return []
+    
+    async def get_all_reports_for_export(self) -> List[Dict[str, Any]]:
+        """Все отчеты в виде простых словарей (для выгрузки в файл)"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT id, user_id, username, full_name, department, position,
+                           week_start, week_end, completed_tasks, achievements, problems,
+                           next_week_plans, submitted_at, is_late
+                    FROM reports
+                    ORDER BY week_start DESC, full_name
+                """)
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Ошибка получения отчетов для экспорта: {e}")
+            return []
+    
+    async def get_all_users_for_export(self) -> List[Dict[str, Any]]:
+        """Все сотрудники с названием отдела и датой последнего отчета (для выгрузки в файл)"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT e.user_id, e.username, e.full_name,
+                           COALESCE(d.name, e.department_code) AS department,
+                           e.position, e.email, e.phone, e.is_active, e.is_blocked, e.is_admin,
+                           (SELECT MAX(r.submitted_at) FROM reports r WHERE r.user_id = e.user_id) AS last_activity
+                    FROM employees e
+                    LEFT JOIN departments d ON d.code = e.department_code
+                    ORDER BY e.full_name
+                """)
+                users = [dict(row) for row in cursor.fetchall()]
+            # SQLite хранит флаги как 0/1, в выгрузке они выводятся как да/нет
+            for user in users:
+                for flag in ('is_active', 'is_blocked', 'is_admin'):
+                    if user[flag] is not None:
+                        user[flag] = bool(user[flag])
+            return users
+        except Exception as e:
+            logger.error(f"Ошибка получения сотрудников для экспорта: {e}")
+            return []
+    
     async def clear_employees(self) -> bool:
         """Очистка таблицы сотрудников"""
         try:
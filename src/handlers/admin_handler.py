@@ -7,6 +7,8 @@
 соответствующим обработчикам.
 """
 
+import os
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from loguru import logger
@@ -14,18 +16,30 @@ from datetime import datetime
 
 from .states import AdminStates
 from database import DatabaseManager
+from utils.text_utils import escape_html, truncate_text
+from services.metrics import format_metrics_summary
 from .admin.user_management import UserManagementHandler
 from .admin.department_management import DepartmentManagementHandler
 
 class AdminHandler:
     """Основной обработчик для админ-панели."""
 
-    def __init__(self, report_processor, db_manager, telegram_service, user_management_handler, department_management_handler):
+    def __init__(self, report_processor, db_manager, telegram_service, user_management_handler, department_management_handler, embedding_index=None):
         self.report_processor = report_processor
         self.db_manager = db_manager
         self.telegram_service = telegram_service
         self.user_management_handler = user_management_handler
         self.department_management_handler = department_management_handler
+        self.embedding_index = embedding_index
+        # Сервис напоминаний назначается в main после создания
+        self.reminder_service = None
+
+    async def _save_reminder_settings(self, reminder_settings: dict) -> bool:
+        """Сохранение настроек напоминаний и пересчет расписания рассылок"""
+        success = await self.db_manager.update_reminder_settings(reminder_settings)
+        if success and self.reminder_service:
+            self.reminder_service.reschedule()
+        return success
 
     async def admin_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Handles the /admin command."""
@@ -137,7 +151,7 @@ class AdminHandler:
                 reminder_settings['reminder_time'] = time_value
                 
                 # Сохраняем в базу
-                await self.db_manager.update_reminder_settings(reminder_settings)
+                await self._save_reminder_settings(reminder_settings)
                 
                 # Возвращаемся к настройкам с обновленным временем
                 auto_enabled = reminder_settings.get('auto_enabled', False)
@@ -180,8 +194,8 @@ class AdminHandler:
             days_mapping = {
                 'days_mon_wed_fri': 'Пн,Ср,Пт',
                 'days_tue_thu': 'Вт,Чт', 
-                'days_everyday': 'Каждый день',
-                'days_friday_only': 'Только пятница'
+                'days_everyday': 'Пн,Вт,Ср,Чт,Пт,Сб,Вс',
+                'days_friday_only': 'Пт'
             }
             
             selected_days = days_mapping.get(data, 'Пн,Ср,Пт')
@@ -192,7 +206,7 @@ class AdminHandler:
                 reminder_settings['reminder_days'] = selected_days
                 
                 # Сохраняем в базу
-                await self.db_manager.update_reminder_settings(reminder_settings)
+                await self._save_reminder_settings(reminder_settings)
                 
                 # Возвращаемся к настройкам с обновленными днями
                 auto_enabled = reminder_settings.get('auto_enabled', False)
@@ -295,7 +309,7 @@ class AdminHandler:
             # Сохраняем настройки
             try:
                 reminder_settings = await self.db_manager.get_reminder_settings()
-                await self.db_manager.update_reminder_settings(reminder_settings)
+                await self._save_reminder_settings(reminder_settings)
                 
                 await query.edit_message_text(
                     "💾 <b>Настройки сохранены</b>\n\n"
@@ -434,6 +448,15 @@ class AdminHandler:
                 f"   • Средний отчетов на пользователя: {(total_reports/total_users):.1f} (если есть пользователи)"
             )
             
+            unreachable = await self.db_manager.get_unreachable_users()
+            if unreachable:
+                stats_message += (
+                    f"\n\n🚫 <b>Недоступны для бота:</b> {len(unreachable)} "
+                    f"(исключены из рассылок, список: /unreachable)"
+                )
+            
+            stats_message += self._format_ai_latency_stats()
+            
             await update.message.reply_text(stats_message, parse_mode='HTML')
             
         except Exception as e:
@@ -443,6 +466,144 @@ class AdminHandler:
                 parse_mode='HTML'
             )
     
+    def _format_ai_latency_stats(self) -> str:
+        """Блок статистики задержек ИИ (холодная и прогретая модель)"""
+        ollama_service = getattr(self.report_processor, 'ollama_service', None)
+        if not ollama_service or not hasattr(ollama_service, 'get_metrics'):
+            return ""
+        
+        metrics = ollama_service.get_metrics()
+        
+        def describe(summary):
+            if not summary['count']:
+                return "нет данных"
+            return f"{summary['count']} шт., среднее {summary['avg']:.1f} с, p95 {summary['p95']:.1f} с"
+        
+        last_warmup = metrics['last_warmup_at']
+        text = (
+            f"\n\n🤖 <b>Задержки ИИ:</b>\n"
+            f"   • Прогретая модель: {describe(metrics['warm'])}\n"
+            f"   • Холодный старт: {describe(metrics['cold'])}\n"
+            f"   • Загрузка модели: {describe(metrics['load'])}\n"
+            f"   • keep_alive: {metrics['keep_alive']}, прогревов: {metrics['warmup_count']}"
+            + (f" (последний {last_warmup.strftime('%d.%m %H:%M')})" if last_warmup else "")
+        )
+        
+        routing = metrics.get('routing')
+        if routing and routing['enabled']:
+            requests = ", ".join(f"{escape_html(model)}: {count}" for model, count in routing['requests'].items())
+            text += (
+                f"\n   • Модели: {requests or 'запросов не было'}\n"
+                f"   • Режим: {'⚠️ перегрузка, все запросы на ' + escape_html(routing['fast_model']) if routing['degraded'] else 'обычный'}"
+                f" (переключений: {routing['downgrade_count']})"
+            )
+        
+        endpoints = metrics.get('endpoints', [])
+        if len(endpoints) > 1:
+            state_emoji = {"closed": "🟢", "half_open": "🟡", "open": "🔴"}
+            text += "\n\n🖥 <b>Серверы Ollama:</b>"
+            for endpoint in endpoints:
+                text += (
+                    f"\n   {state_emoji.get(endpoint['state'], '⚪')} {escape_html(endpoint['url'])}: "
+                    f"в работе {endpoint['outstanding']}, запросов {endpoint['requests']}, "
+                    f"ошибок {endpoint['failures']}"
+                )
+        return text
+    
+    async def unreachable_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Обрабатывает команду /unreachable: пользователи, заблокировавшие бота."""
+        user_id = update.effective_user.id
+        if not await self.db_manager.is_admin(user_id):
+            await update.message.reply_text("У вас нет прав для просмотра этого списка.")
+            return
+        
+        try:
+            unreachable = await self.db_manager.get_unreachable_users()
+            if not unreachable:
+                await update.message.reply_text("✅ Все пользователи получают сообщения бота.")
+                return
+            
+            lines = [
+                f"🚫 <b>Недоступны для бота</b> ({len(unreachable)})\n",
+                "<i>Исключены из рассылок напоминаний до следующего обращения к боту.</i>\n"
+            ]
+            for entry in unreachable[:50]:
+                failed_at = str(entry['failed_at'] or '')[:16]
+                lines.append(
+                    f"• {escape_html(entry['full_name'] or 'Неизвестный пользователь')} "
+                    f"(<code>{entry['user_id']}</code>, {escape_html(entry['department_code'] or '—')}) — "
+                    f"{escape_html(truncate_text(entry['reason'], 60))}, {failed_at}"
+                )
+            if len(unreachable) > 50:
+                lines.append(f"\n... и еще {len(unreachable) - 50}")
+            
+            await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+        
+        except Exception as e:
+            logger.error(f"Ошибка при получении списка недоступных пользователей: {e}")
+            await update.message.reply_text("❌ Произошла ошибка. Попробуйте позже.")
+    
+    async def metrics_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Обрабатывает команду /metrics: сводка задержек обработки."""
+        user_id = update.effective_user.id
+        if not await self.db_manager.is_admin(user_id):
+            await update.message.reply_text("У вас нет прав для просмотра метрик.")
+            return
+        
+        await update.message.reply_text(format_metrics_summary(), parse_mode='HTML')
+    
+    async def similar_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Обрабатывает команду /similar для поиска похожих проблем в отчетах."""
+        user_id = update.effective_user.id
+        if not await self.db_manager.is_admin(user_id):
+            await update.message.reply_text("У вас нет прав для поиска по отчетам.")
+            return
+        
+        if not self.embedding_index:
+            await update.message.reply_text(
+                "🔍 Поиск похожих отчетов отключен.\n\n"
+                "Включите EMBEDDING_INDEX_ENABLED в настройках бота."
+            )
+            return
+        
+        query_text = " ".join(context.args or []).strip()
+        if not query_text:
+            await update.message.reply_text(
+                "🔍 <b>Поиск похожих проблем</b>\n\n"
+                "Использование: <code>/similar описание проблемы</code>\n\n"
+                "Например: <code>/similar задержка поставки комплектующих</code>",
+                parse_mode='HTML'
+            )
+            return
+        
+        try:
+            results = await self.embedding_index.search(query_text, field_name="problems", top_k=10)
+            
+            if not results:
+                await update.message.reply_text("🔍 Похожих проблем в отчетах не найдено.")
+                return
+            
+            departments = {entry.department or 'Не указан' for entry in results}
+            lines = [
+                f"🔍 <b>Похожие проблемы</b> ({len(results)} шт., отделов: {len(departments)})\n"
+            ]
+            for entry in results:
+                lines.append(
+                    f"• <b>{escape_html(entry.department or 'Не указан')}</b> — "
+                    f"{escape_html(entry.full_name)}, неделя {entry.week_start.strftime('%d.%m.%Y')} "
+                    f"({entry.similarity * 100:.0f}%)\n"
+                    f"  <i>{escape_html(truncate_text(entry.text, 200))}</i>"
+                )
+            
+            await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+            
+        except Exception as e:
+            logger.error(f"Ошибка при поиске похожих проблем: {e}")
+            await update.message.reply_text(
+                "❌ Произошла ошибка при поиске. Попробуйте позже.",
+                parse_mode='HTML'
+            )
+    
     async def handle_reminder_action(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Обрабатывает действия с напоминаниями."""
         query = update.callback_query
@@ -585,7 +746,7 @@ class AdminHandler:
                 new_settings['auto_enabled'] = not current_auto
                 
                 # Сохраняем в базу
-                await self.db_manager.update_reminder_settings(new_settings)
+                await self._save_reminder_settings(new_settings)
                 
                 # Обновляем интерфейс
                 auto_enabled = new_settings.get('auto_enabled', False)
@@ -726,7 +887,7 @@ class AdminHandler:
                 reminder_settings = await self.db_manager.get_reminder_settings()
                 
                 # Принудительно сохраняем настройки
-                success = await self.db_manager.update_reminder_settings(reminder_settings)
+                success = await self._save_reminder_settings(reminder_settings)
                 
                 if success:
                     auto_enabled = reminder_settings.get('auto_enabled', False)
@@ -793,7 +954,7 @@ class AdminHandler:
                 reminder_settings['reminder_time'] = selected_time
                 
                 # Сохраняем в базу
-                await self.db_manager.update_reminder_settings(reminder_settings)
+                await self._save_reminder_settings(reminder_settings)
                 
                 # Возвращаемся к настройкам с обновленным временем
                 auto_enabled = reminder_settings.get('auto_enabled', False)
@@ -851,7 +1012,7 @@ class AdminHandler:
                 reminder_settings['reminder_days'] = selected_days
                 
                 # Сохраняем в базу
-                await self.db_manager.update_reminder_settings(reminder_settings)
+                await self._save_reminder_settings(reminder_settings)
                 
                 # Возвращаемся к настройкам с обновленными днями
                 auto_enabled = reminder_settings.get('auto_enabled', False)
@@ -1112,13 +1273,11 @@ class AdminHandler:
                         )
                         
                         # Отправляем файл
-                        with open(excel_file, 'rb') as file:
-                            await context.bot.send_document(
-                                chat_id=query.message.chat_id,
-                                document=file,
-                                filename=f"all_reports_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                                caption="📊 Экспорт всех отчетов"
-                            )
+                        await self._send_export_file(
+                            context, query.message.chat_id, excel_file,
+                            f"all_reports_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                            "📊 Экспорт всех отчетов"
+                        )
                     else:
                         await query.edit_message_text(
                             "📤 <b>Экспорт отчетов</b>\n\n"
@@ -1165,6 +1324,23 @@ class AdminHandler:
         
         return AdminStates.MAIN_MENU
     
+    async def _send_export_file(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int,
+                                path: str, filename: str, caption: str) -> None:
+        """Отправка файла выгрузки с удалением временного файла после отправки"""
+        try:
+            with open(path, 'rb') as file:
+                await context.bot.send_document(
+                    chat_id=chat_id,
+                    document=file,
+                    filename=filename,
+                    caption=caption
+                )
+        finally:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Не удалось удалить файл выгрузки {path}: {e}")
+    
     async def handle_export_action(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Обрабатывает действия экспорта."""
         query = update.callback_query
@@ -1196,13 +1372,11 @@ class AdminHandler:
                         )
                         
                         # Отправляем файл
-                        with open(excel_file, 'rb') as file:
-                            await context.bot.send_document(
-                                chat_id=query.message.chat_id,
-                                document=file,
-                                filename=f"reports_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                                caption="📊 Экспорт отчетов в формате Excel"
-                            )
+                        await self._send_export_file(
+                            context, query.message.chat_id, excel_file,
+                            f"reports_export_excel_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                            "📊 Экспорт отчетов в формате Excel"
+                        )
                     else:
                         await query.edit_message_text(
                             "📄 <b>Экспорт в Excel</b>\n\n"
@@ -1247,13 +1421,11 @@ class AdminHandler:
                         )
                         
                         # Отправляем файл
-                        with open(csv_file, 'rb') as file:
-                            await context.bot.send_document(
-                                chat_id=query.message.chat_id,
-                                document=file,
-                                filename=f"reports_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                                caption="📊 Экспорт отчетов в формате CSV"
-                            )
+                        await self._send_export_file(
+                            context, query.message.chat_id, csv_file,
+                            f"reports_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                            "📊 Экспорт отчетов в формате CSV"
+                        )
                     else:
                         await query.edit_message_text(
                             "📋 <b>Экспорт в CSV</b>\n\n"
@@ -1372,13 +1544,11 @@ class AdminHandler:
                     await query.edit_message_text(users_text[:4000], parse_mode='HTML')  # Telegram limit
                     
                     if users_file:
-                        with open(users_file, 'rb') as file:
-                            await context.bot.send_document(
-                                chat_id=query.message.chat_id,
-                                document=file,
-                                filename=f"users_list_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                                caption="👥 Полный список пользователей"
-                            )
+                        await self._send_export_file(
+                            context, query.message.chat_id, users_file,
+                            f"users_list_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                            "👥 Полный список пользователей"
+                        )
                 else:
                     await query.edit_message_text(
                         "👥 <b>Список пользователей</b>\n\n"
@@ -1,6 +1,7 @@
 import asyncio
+import json
 from datetime import datetime, timedelta
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -17,22 +18,41 @@ from config import settings, MESSAGES
 from services.report_processor import ReportProcessor
 from services.ollama_service import OllamaService
 from services.telegram_service import TelegramService
-from services import TaskManager, TaskStatus
+from services import TaskManager, TaskStatus, TaskPriority, TaskQueueFullError
+from services.ai_queue import AIProcessingQueue
+from services.embedding_index import EmbeddingIndex
+from services.speculative_processor import SpeculativeProcessor
+from services.report_drafts import ReportDraftStore
+from services.metrics import REPORT_STAGE
 from models.report import WeeklyReport
 from utils.date_utils import get_current_week_range, is_deadline_passed
 from .states import ReportStates, get_report_confirmation_keyboard, get_cancel_keyboard
 from database import DatabaseManager
 
+# Сообщение пользователю на время фоновой обработки отчета
+PROCESSING_MESSAGE = "⏳ Обрабатываю отчет... Это может занять несколько минут."
+
+# Тип задачи обработки отчета в журнале задач
+REPORT_TASK_KIND = "report"
+
 class ReportHandler:
     """Обработчик команд для создания и отправки отчетов"""
     
-    def __init__(self, report_processor: ReportProcessor, ollama_service: OllamaService, telegram_service: TelegramService, task_manager: TaskManager, db_manager: DatabaseManager):
+    def __init__(self, report_processor: ReportProcessor, ollama_service: OllamaService, telegram_service: TelegramService, task_manager: TaskManager, db_manager: DatabaseManager, ai_queue: Optional[AIProcessingQueue] = None, embedding_index: Optional[EmbeddingIndex] = None, speculative_processor: Optional[SpeculativeProcessor] = None):
         self.report_processor = report_processor
         self.ollama_service = ollama_service
         self.telegram_service = telegram_service
         self.task_manager = task_manager
         self.db_manager = db_manager
-        self.user_reports: Dict[int, WeeklyReport] = {}
+        self.ai_queue = ai_queue
+        self.embedding_index = embedding_index
+        self.speculative_processor = speculative_processor
+        # Черновики отчетов; удаляются после REPORT_DRAFT_TTL_HOURS без изменений
+        self.user_reports = ReportDraftStore()
+        
+        # Обработка отчетов, прерванная перезапуском бота, возобновляется из журнала задач
+        if self.task_manager:
+            self.task_manager.register_resumer(REPORT_TASK_KIND, self._resume_report_task)
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработчик команды /start"""
@@ -150,6 +170,7 @@ class ReportHandler:
         )
         
         self.user_reports[user.id] = report
+        self._discard_speculation(user.id)
         
         from .states import get_departments_keyboard
         
@@ -244,6 +265,7 @@ class ReportHandler:
         
         self.user_reports[user_id].completed_tasks = tasks_text
         logger.info(f"Пользователь {user_id} добавил задачи в отчет")
+        self._on_field_received(user_id, tasks_text)
         
         await update.message.reply_text(
             "Отлично! Теперь расскажите о ваших достижениях и успехах за неделю:\n\n"
@@ -273,6 +295,7 @@ class ReportHandler:
         
         self.user_reports[user_id].achievements = achievements_text
         logger.info(f"Пользователь {user_id} добавил достижения в отчет")
+        self._on_field_received(user_id, achievements_text)
         
         await update.message.reply_text(
             "Хорошо! Теперь опишите проблемы или трудности, с которыми вы столкнулись:\n\n"
@@ -302,6 +325,7 @@ class ReportHandler:
         
         self.user_reports[user_id].problems = problems_text
         logger.info(f"Пользователь {user_id} добавил проблемы в отчет")
+        self._on_field_received(user_id, problems_text)
         
         await update.message.reply_text(
             "Почти готово! Расскажите о ваших планах на следующую неделю:",
@@ -330,6 +354,11 @@ class ReportHandler:
         
         self.user_reports[user_id].next_week_plans = plans_text
         logger.info(f"Пользователь {user_id} добавил планы в отчет")
+        self._on_field_received(user_id, plans_text)
+        
+        # Отчет заполнен: анализ начинается, пока пользователь проверяет предпросмотр
+        if self.speculative_processor:
+            self.speculative_processor.schedule(user_id, self.user_reports[user_id])
         
         # Показываем предварительный просмотр отчета
         report = self.user_reports[user_id]
@@ -358,44 +387,60 @@ class ReportHandler:
             
             report = self.user_reports[user_id]
             
+            # В отложенном режиме отчет публикуется сразу, а ИИ анализ идет через очередь
+            if settings.ai_deferred_mode and self.ai_queue:
+                await self._submit_report_deferred(query, report, user_id)
+                del self.user_reports[user_id]
+                return ConversationHandler.END
+            
             # Проверяем, есть ли уже активная задача для пользователя
             existing_task = self.task_manager.get_user_task(user_id)
             if existing_task and existing_task.status in [TaskStatus.PENDING, TaskStatus.RUNNING]:
                 await query.edit_message_text("⚠️ У вас уже есть обрабатывающийся отчет. Пожалуйста, дождитесь завершения.")
                 return ConversationHandler.END
             
-            # Создаем callback для обновления прогресса
-            async def progress_callback(task_info):
-                try:
-                    if task_info.status == TaskStatus.COMPLETED:
-                        if task_info.result:
-                            await query.edit_message_text(MESSAGES["report_created"])
-                            logger.info(f"Отчет пользователя {user_id} успешно отправлен")
-                        else:
-                            await query.edit_message_text(MESSAGES["error_general"])
-                            logger.error(f"Ошибка отправки отчета пользователя {user_id}")
-                    elif task_info.status == TaskStatus.FAILED:
-                        await query.edit_message_text(MESSAGES["error_general"])
-                        logger.error(f"Ошибка при обработке отчета пользователя {user_id}: {task_info.error}")
-                    elif task_info.status == TaskStatus.CANCELLED:
-                        await query.edit_message_text("Обработка отчета была отменена.")
-                except Exception as e:
-                    logger.error(f"Ошибка в progress_callback: {e}")
+            chat_id = query.message.chat_id
+            message_id = query.message.message_id
             
-            # Создаем асинхронную задачу для обработки отчета
-            task_id = self.task_manager.create_task(
-                user_id=user_id,
-                coro=self._process_report_async(report, user_id),
-                progress_callback=progress_callback
-            )
+            # Создаем асинхронную задачу для обработки отчета (отчеты администраторов - вне очереди)
+            priority = TaskPriority.HIGH if user_id in settings.get_admin_ids() else TaskPriority.NORMAL
+            try:
+                task_id = self.task_manager.create_task(
+                    user_id=user_id,
+                    coro=self._process_report_async(report, user_id),
+                    progress_callback=self._make_progress_callback(user_id, chat_id, message_id),
+                    priority=priority,
+                    kind=REPORT_TASK_KIND,
+                    payload=json.dumps({
+                        "chat_id": chat_id,
+                        "message_id": message_id,
+                        "report": report.model_dump(mode="json")
+                    }, ensure_ascii=False)
+                )
+            except TaskQueueFullError:
+                # Отчет сохраняется: пользователь может отправить его позже той же кнопкой
+                await query.edit_message_text(
+                    "⚠️ Сейчас обрабатывается слишком много отчетов. "
+                    "Попробуйте отправить отчет через несколько минут.",
+                    reply_markup=get_report_confirmation_keyboard()
+                )
+                return ReportStates.WAITING_CONFIRMATION
             
-            await query.edit_message_text("⏳ Обрабатываю отчет... Это может занять несколько минут.")
+            position = self.task_manager.get_queue_position(task_id)
+            if position:
+                await query.edit_message_text(
+                    f"{PROCESSING_MESSAGE}\n\n👥 Позиция в очереди: {position}. "
+                    f"Проверить статус: /task_status"
+                )
+            else:
+                await query.edit_message_text(PROCESSING_MESSAGE)
             logger.info(f"Создана задача {task_id} для обработки отчета пользователя {user_id}")
             
             # Очищаем временный отчет
             del self.user_reports[user_id]
                 
         elif query.data == "edit_report":
+            self._discard_speculation(user_id)
             await query.edit_message_text(
                 "Какую часть отчета вы хотите изменить?\n\n"
                 "Начните заново с команды /report"
@@ -404,6 +449,7 @@ class ReportHandler:
         elif query.data == "cancel_report":
             if user_id in self.user_reports:
                 del self.user_reports[user_id]
+            self._discard_speculation(user_id)
             await query.edit_message_text("Создание отчета отменено.")
         
         return ConversationHandler.END
@@ -414,6 +460,7 @@ class ReportHandler:
         
         if user_id in self.user_reports:
             del self.user_reports[user_id]
+        self._discard_speculation(user_id)
         
         if update.callback_query:
             await update.callback_query.edit_message_text("Создание отчета отменено.")
@@ -421,16 +468,156 @@ class ReportHandler:
             await update.message.reply_text("Создание отчета отменено.")
         return ConversationHandler.END
     
+    def _on_field_received(self, user_id: int, text: str) -> None:
+        """Фоновая подготовка по мере заполнения полей отчета"""
+        if not self.speculative_processor:
+            return
+        
+        # Эмбеддинг поля для проверки на повтор готов заранее
+        self.speculative_processor.prefetch_field(text)
+    
+    def _discard_speculation(self, user_id: int) -> None:
+        """Отмена упреждающего анализа черновика"""
+        if self.speculative_processor:
+            self.speculative_processor.discard(user_id)
+    
+    async def _check_duplicate(self, report: WeeklyReport, user_id: int) -> None:
+        """Индексация отчета и пометка почти дословного повтора прошлого отчета"""
+        if not self.embedding_index:
+            return
+        
+        try:
+            duplicate = await self.embedding_index.index_report(report)
+        except Exception as e:
+            logger.error(f"Ошибка проверки отчета пользователя {user_id} на повтор: {e}")
+            return
+        
+        if duplicate:
+            week_start, similarity = duplicate
+            report.mark_as_duplicate(week_start, similarity)
+            await self.telegram_service.send_message_safe(
+                user_id,
+                f"🔁 Ваш отчет почти совпадает с отчетом за неделю {week_start.strftime('%d.%m.%Y')} "
+                f"(сходство {similarity * 100:.0f}%).\n\n"
+                "Отчет принят, но руководитель увидит отметку о повторе."
+            )
+    
+    async def _submit_report_deferred(self, query, report: WeeklyReport, user_id: int) -> None:
+        """Мгновенное подтверждение отчета с постановкой ИИ анализа в очередь"""
+        try:
+            # Готовый упреждающий анализ публикуется сразу, без очереди
+            analysis_ready = bool(self.speculative_processor and self.speculative_processor.take_ready(user_id, report))
+            self._discard_speculation(user_id)
+            
+            with REPORT_STAGE.time(stage="db_save"):
+                await self.db_manager.save_report(report)
+                if analysis_ready:
+                    await self.db_manager.update_report_analysis(
+                        report.user_id, report.week_start.date(), report.summary, report.analysis
+                    )
+                self.report_processor.save_report(report)
+            with REPORT_STAGE.time(stage="duplicate_check"):
+                await self._check_duplicate(report, user_id)
+            
+            # Пока анализ в очереди, в группе видна автоматическая выжимка
+            if not analysis_ready:
+                report.summary = self.ollama_service.build_fallback_summary(report)
+            
+            with REPORT_STAGE.time(stage="group_post"):
+                group_message_id = await self.telegram_service.post_report_to_group(
+                    report, analysis_pending=not analysis_ready
+                )
+            if group_message_id is None:
+                logger.error(f"Ошибка отправки отчета пользователя {user_id}")
+                await query.edit_message_text(MESSAGES["error_general"])
+                return
+            
+            if analysis_ready:
+                await query.edit_message_text(MESSAGES["report_created"])
+                logger.info(f"Отчет пользователя {user_id} опубликован с упреждающим анализом")
+                return
+            
+            self.ai_queue.enqueue(report, group_message_id)
+            await query.edit_message_text(MESSAGES["report_queued"])
+            logger.info(f"Отчет пользователя {user_id} принят в отложенном режиме")
+            
+        except Exception as e:
+            logger.error(f"Ошибка при отложенной обработке отчета пользователя {user_id}: {e}")
+            await query.edit_message_text(MESSAGES["error_general"])
+    
+    def _make_progress_callback(self, user_id: int, chat_id: int, message_id: int):
+        """Callback обновления прогресса: правки объединяются,
+        поэтому частые этапы обработки не упираются в лимиты Telegram"""
+        async def progress_callback(task_info):
+            try:
+                if task_info.status == TaskStatus.RUNNING:
+                    if task_info.progress_message:
+                        await self.telegram_service.edit_message_coalesced(
+                            chat_id, message_id,
+                            f"{PROCESSING_MESSAGE}\n\n📝 {task_info.progress_message}"
+                        )
+                    return
+                
+                if task_info.status == TaskStatus.COMPLETED:
+                    if task_info.result:
+                        text = MESSAGES["report_created"]
+                        logger.info(f"Отчет пользователя {user_id} успешно отправлен")
+                    else:
+                        text = MESSAGES["error_general"]
+                        logger.error(f"Ошибка отправки отчета пользователя {user_id}")
+                elif task_info.status == TaskStatus.FAILED:
+                    text = MESSAGES["error_general"]
+                    logger.error(f"Ошибка при обработке отчета пользователя {user_id}: {task_info.error}")
+                elif task_info.status == TaskStatus.CANCELLED:
+                    text = "Обработка отчета была отменена."
+                else:
+                    return
+                # Финальный статус заменяет еще не показанный прогресс
+                await self.telegram_service.edit_message_coalesced(chat_id, message_id, text, wait=True)
+            except Exception as e:
+                logger.error(f"Ошибка в progress_callback: {e}")
+        
+        return progress_callback
+    
+    def _resume_report_task(self, payload: Dict[str, Any]):
+        """Воссоздание задачи обработки отчета по данным из журнала"""
+        report = WeeklyReport.model_validate(payload["report"])
+        return (
+            self._process_report_async(report, report.user_id),
+            self._make_progress_callback(report.user_id, payload["chat_id"], payload["message_id"])
+        )
+    
+    async def _report_progress(self, user_id: int, message: str) -> None:
+        """Обновление этапа обработки в текущей задаче пользователя"""
+        # Без менеджера задач (например, в ai_load_benchmark.py) прогресс не отображается
+        if not self.task_manager:
+            return
+        task_info = self.task_manager.get_user_task(user_id)
+        if task_info:
+            await self.task_manager.update_progress(task_info.task_id, message)
+    
     async def _process_report_async(self, report: WeeklyReport, user_id: int) -> bool:
         """Асинхронная обработка отчета"""
         try:
             logger.info(f"Начинаем асинхронную обработку отчета пользователя {user_id}")
             
-            # Обработка отчета через Ollama
-            processed_report = await self.ollama_service.process_report(report)
+            # Проверка на повтор прошлого отчета
+            await self._report_progress(user_id, "Проверка отчета")
+            with REPORT_STAGE.time(stage="duplicate_check"):
+                await self._check_duplicate(report, user_id)
+            
+            # Обработка отчета через Ollama (или использование упреждающего анализа)
+            if self.speculative_processor and await self.speculative_processor.take(user_id, report):
+                processed_report = report
+            else:
+                await self._report_progress(user_id, "ИИ-анализ отчета")
+                with REPORT_STAGE.time(stage="ai_processing"):
+                    processed_report = await self.ollama_service.process_report(report)
             
             # Отправка в группу
-            success = await self.telegram_service.send_report_to_group(processed_report)
+            await self._report_progress(user_id, "Публикация в группе")
+            with REPORT_STAGE.time(stage="group_post"):
+                success = await self.telegram_service.send_report_to_group(processed_report)
             
             if success:
                 logger.info(f"Отчет пользователя {user_id} успешно обработан и отправлен")
@@ -472,6 +659,10 @@ class ReportHandler:
         message = f"{status_emoji[task_info.status]} <b>Статус задачи:</b> {status_text[task_info.status]}\n\n"
         message += f"📅 Создана: {task_info.created_at.strftime('%d.%m.%Y %H:%M')}\n"
         
+        position = self.task_manager.get_queue_position(task_info.task_id)
+        if position:
+            message += f"👥 Позиция в очереди: {position} из {self.task_manager.queue_size}\n"
+        
         if task_info.started_at:
             message += f"🚀 Запущена: {task_info.started_at.strftime('%d.%m.%Y %H:%M')}\n"
         
@@ -535,6 +726,7 @@ class ReportHandler:
         # Очищаем текущий отчет
         if user_id in self.user_reports:
             del self.user_reports[user_id]
+        self._discard_speculation(user_id)
         
         return ConversationHandler.END
     
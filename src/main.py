@@ -23,6 +23,7 @@ from telegram.ext import (
     MessageHandler,
     CallbackQueryHandler,
     ConversationHandler,
+    TypeHandler,
     ContextTypes,
     filters
 )
@@ -53,6 +54,18 @@ from services import (
     TaskManager
 )
 from services.reminder_service import ReminderService
+from services.reminder_ledger import ReminderLedger
+from services.sqlite_persistence import SQLitePersistence
+from services.ai_queue import AIProcessingQueue
+from services.embedding_index import EmbeddingIndex
+from services.model_warmup import ModelWarmupService
+from services.speculative_processor import SpeculativeProcessor
+from services.outbox import MessageOutbox
+from services.group_digest import GroupDigest
+from services.delivery_tracker import DeliveryTracker
+from services.webhook_server import WebhookServer
+from services.task_journal import TaskJournal
+from services.metrics import MetricsServer, InstrumentedApplication, InstrumentedRequest
 from database import DatabaseManager
 from utils import get_timezone
 
@@ -68,6 +81,16 @@ class TelegramReportBot:
         self.report_handler: Optional[ReportHandler] = None
         self.admin_handler: Optional[AdminHandler] = None
         self.menu_handler: Optional[MenuHandler] = None
+        self.ai_queue: Optional[AIProcessingQueue] = None
+        self.embedding_index: Optional[EmbeddingIndex] = None
+        self.model_warmup: Optional[ModelWarmupService] = None
+        self.speculative_processor: Optional[SpeculativeProcessor] = None
+        self.outbox: Optional[MessageOutbox] = None
+        self.group_digest: Optional[GroupDigest] = None
+        self.delivery_tracker: Optional[DeliveryTracker] = None
+        self.webhook_server: Optional[WebhookServer] = None
+        self.metrics_server: Optional[MetricsServer] = None
+        self.persistence: Optional[SQLitePersistence] = None
         self._shutdown_event = asyncio.Event()
     
     async def initialize_services(self) -> bool:
@@ -91,17 +114,64 @@ class TelegramReportBot:
             
             # Инициализация Telegram сервиса
             from telegram import Bot
-            bot = Bot(token=settings.telegram_bot_token)
+            bot = Bot(token=settings.telegram_bot_token, request=InstrumentedRequest())
             self.telegram_service = TelegramService(bot=bot)
             
+            # Учет пользователей, заблокировавших бота
+            self.delivery_tracker = DeliveryTracker(db_manager)
+            await self.delivery_tracker.load()
+            self.telegram_service.delivery_tracker = self.delivery_tracker
+            
+            # Инициализация очереди исходящих сообщений
+            if settings.outbox_enabled:
+                self.outbox = MessageOutbox(
+                    db_path=db_manager.db_path,
+                    telegram_service=self.telegram_service
+                )
+                self.telegram_service.outbox = self.outbox
+            
+            # Инициализация сводных публикаций отчетов в группе
+            if settings.group_digest_enabled:
+                self.group_digest = GroupDigest(telegram_service=self.telegram_service)
+                self.telegram_service.group_digest = self.group_digest
+            
             # Инициализация менеджера задач
             self.task_manager = TaskManager()
+            if settings.task_journal_enabled:
+                self.task_manager.journal = TaskJournal(db_manager.db_path)
             
             # Инициализация процессора отчетов
             self.report_processor = ReportProcessor(
                 ollama_service=self.ollama_service,
                 telegram_service=self.telegram_service
             )
+            self.report_processor.task_manager = self.task_manager
+            
+            # Инициализация очереди отложенной ИИ-обработки
+            if settings.ai_deferred_mode:
+                self.ai_queue = AIProcessingQueue(
+                    db_path=db_manager.db_path,
+                    ollama_service=self.ollama_service,
+                    telegram_service=self.telegram_service
+                )
+                self.ai_queue.db_manager = db_manager
+            
+            # Глубина очереди ИИ для перехода на быструю модель при перегрузке
+            self.ollama_service.router.queue_depth_provider = self._get_ai_queue_depth
+            
+            # Инициализация индекса эмбеддингов для поиска повторов
+            if settings.embedding_index_enabled:
+                self.embedding_index = EmbeddingIndex(
+                    db_path=db_manager.db_path,
+                    ollama_service=self.ollama_service
+                )
+            
+            # Инициализация упреждающего анализа черновиков
+            if settings.ai_speculative_enabled:
+                self.speculative_processor = SpeculativeProcessor(
+                    ollama_service=self.ollama_service,
+                    embedding_index=self.embedding_index
+                )
             
             # Инициализация обработчиков
             self.report_handler = ReportHandler(
@@ -109,9 +179,17 @@ class TelegramReportBot:
                 ollama_service=self.ollama_service,
                 telegram_service=self.telegram_service,
                 task_manager=self.task_manager,
-                db_manager=db_manager
+                db_manager=db_manager,
+                ai_queue=self.ai_queue,
+                embedding_index=self.embedding_index,
+                speculative_processor=self.speculative_processor
             )
             
+            # Состояние диалогов и черновики отчетов переживают перезапуск бота
+            if settings.persistence_enabled:
+                self.persistence = SQLitePersistence(db_manager.db_path)
+                self.report_handler.user_reports.load(self.persistence)
+            
             user_management_handler = UserManagementHandler(db_manager=db_manager)
             department_management_handler = DepartmentManagementHandler(db_manager=db_manager)
 
@@ -120,7 +198,8 @@ class TelegramReportBot:
                 db_manager=db_manager,
                 telegram_service=self.telegram_service,
                 user_management_handler=user_management_handler,
-                department_management_handler=department_management_handler
+                department_management_handler=department_management_handler,
+                embedding_index=self.embedding_index
             )
             
             self.user_handler = UserHandler(db_manager)
@@ -136,6 +215,17 @@ class TelegramReportBot:
                 db_manager=db_manager,
                 telegram_service=self.telegram_service
             )
+            self.admin_handler.reminder_service = self.reminder_service
+            self.reminder_service.load_provider = self._get_ai_queue_depth
+            if settings.reminder_ledger_enabled:
+                self.reminder_service.ledger = ReminderLedger(db_manager.db_path)
+            
+            # Инициализация прогрева модели перед дедлайнами
+            if settings.ollama_warmup_enabled:
+                self.model_warmup = ModelWarmupService(
+                    ollama_service=self.ollama_service,
+                    db_manager=db_manager
+                )
             
             logger.success("Все сервисы успешно инициализированы")
             return True
@@ -144,6 +234,14 @@ class TelegramReportBot:
             logger.opt(exception=True).error(f"Подробная ошибка при инициализации сервисов: {e}")
             return False
     
+    def _get_ai_queue_depth(self) -> int:
+        """Количество отчетов, ожидающих ИИ-обработки"""
+        stats = self.task_manager.get_stats()
+        depth = stats['pending'] + stats['running']
+        if self.ai_queue:
+            depth += self.ai_queue.get_depth()
+        return depth
+    
     def setup_handlers(self):
         """Настройка обработчиков команд и сообщений"""
         logger.info("Настройка обработчиков...")
@@ -169,7 +267,7 @@ class TelegramReportBot:
                 CallbackQueryHandler(self.menu_handler.cancel_menu, pattern='^cancel$')
             ],
             name="menu_conversation",
-            persistent=False,
+            persistent=self.persistence is not None,
             per_message=False
         )
         
@@ -215,7 +313,7 @@ class TelegramReportBot:
                 CallbackQueryHandler(self.report_handler.cancel_report, pattern='^cancel$')
             ],
             name="report_conversation",
-            persistent=False,
+            persistent=self.persistence is not None,
             per_message=False
         )
         
@@ -301,10 +399,13 @@ class TelegramReportBot:
                 CommandHandler('cancel', self.admin_handler.cancel_admin_conversation)
             ],
             name="admin_conversation",
-            persistent=False,
+            persistent=self.persistence is not None,
             per_message=False
         )
         
+        # Снятие отметки о недоступности при любом обращении пользователя (отдельная группа)
+        self.application.add_handler(TypeHandler(Update, self.delivery_tracker.handle_update), group=-1)
+        
         # Добавляем обработчики в приложение (порядок важен!)
         self.application.add_handler(report_conv_handler)  # Отчеты - первый приоритет для menu_report
         self.application.add_handler(admin_conv_handler)
@@ -318,6 +419,9 @@ class TelegramReportBot:
         self.application.add_handler(CommandHandler('status', self.user_handler.status_command))
         self.application.add_handler(CommandHandler('task_status', self.report_handler.task_status_command))
         self.application.add_handler(CommandHandler('stats', self.admin_handler.stats_command))
+        self.application.add_handler(CommandHandler('similar', self.admin_handler.similar_command))
+        self.application.add_handler(CommandHandler('unreachable', self.admin_handler.unreachable_command))
+        self.application.add_handler(CommandHandler('metrics', self.admin_handler.metrics_command))
         self.application.add_handler(MessageHandler(filters.Regex('^🏠 Меню$'), self.menu_handler.handle_menu_button))
         
         # Обработчик отмены задач
@@ -404,20 +508,23 @@ class TelegramReportBot:
             logger.info("Настройка Telegram приложения...")
             
             # Создание приложения с увеличенными таймаутами
-            from telegram.request import HTTPXRequest
-            request = HTTPXRequest(
+            # (длительность обработчиков и вызовов Telegram API учитывается в метриках)
+            request = InstrumentedRequest(
                 connection_pool_size=8,
                 connect_timeout=settings.connect_timeout,
                 read_timeout=settings.read_timeout,
                 write_timeout=settings.write_timeout
             )
             
-            self.application = (
+            builder = (
                 Application.builder()
+                .application_class(InstrumentedApplication)
                 .token(settings.telegram_bot_token)
                 .request(request)
-                .build()
             )
+            if self.persistence:
+                builder = builder.persistence(self.persistence)
+            self.application = builder.build()
             
             # Настраиваем обработчики
             self.setup_handlers()
@@ -433,6 +540,9 @@ class TelegramReportBot:
                 BotCommand("task_status", "Статус обработки отчета"),
                 BotCommand("admin", "Панель администратора"),
                 BotCommand("stats", "Статистика (админ)"),
+                BotCommand("similar", "Поиск похожих проблем (админ)"),
+                BotCommand("unreachable", "Заблокировавшие бота (админ)"),
+                BotCommand("metrics", "Задержки обработки (админ)"),
                 BotCommand("cancel", "Отменить текущую операцию")
             ])
             
@@ -478,20 +588,33 @@ class TelegramReportBot:
             logger.info(f"Компания: {COMPANY_NAME}")
             logger.info(f"Администраторы: {settings.admin_user_ids}")
             
-            # Уведомляем администраторов о запуске
+            # Запускаем очередь исходящих сообщений (и досылку неотправленного)
+            if self.outbox:
+                await self.outbox.start()
+            
+            # Уведомляем администраторов о запуске (в фоне, не задерживая polling)
             if self.telegram_service:
-                await self.telegram_service.send_admin_notification(
+                self.telegram_service.notify_admins(
                     settings.get_admin_ids(),
                     "🚀 Бот запущен и готов к работе!"
                 )
             
-            # Запускаем polling
+            # Запускаем прием обновлений: webhook или polling
             await self.application.initialize()
             await self.application.start()
-            await self.application.updater.start_polling(
-                allowed_updates=Update.ALL_TYPES,
-                drop_pending_updates=True
-            )
+            if settings.webhook_enabled:
+                self.webhook_server = WebhookServer(self.application)
+                await self.webhook_server.start()
+            else:
+                await self.application.updater.start_polling(
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=True
+                )
+            
+            # Локальный эндпоинт метрик для Prometheus
+            if settings.metrics_enabled:
+                self.metrics_server = MetricsServer()
+                await self.metrics_server.start()
             
             # Запускаем периодическую очистку задач
             cleanup_task = asyncio.create_task(self._periodic_cleanup())
@@ -500,6 +623,18 @@ class TelegramReportBot:
             if self.reminder_service:
                 await self.reminder_service.start()
             
+            # Запускаем обработчики пула задач (в режиме пула) и возобновляем прерванные задачи
+            await self.task_manager.start()
+            await self.task_manager.resume()
+            
+            # Запускаем очередь отложенной ИИ-обработки
+            if self.ai_queue:
+                await self.ai_queue.start()
+            
+            # Запускаем прогрев модели
+            if self.model_warmup:
+                await self.model_warmup.start()
+            
             # Ждем сигнала завершения
             await self._shutdown_event.wait()
             
@@ -525,16 +660,44 @@ class TelegramReportBot:
             if hasattr(self, 'reminder_service') and self.reminder_service:
                 await self.reminder_service.stop()
             
-            # Уведомляем администраторов о завершении работы
+            # Останавливаем очередь ИИ-обработки (незавершенные задачи продолжатся после перезапуска)
+            if self.ai_queue:
+                await self.ai_queue.stop()
+            
+            # Останавливаем задачи (незавершенные возобновятся после перезапуска)
+            if self.task_manager:
+                await self.task_manager.stop()
+            
+            # Останавливаем прогрев модели
+            if self.model_warmup:
+                await self.model_warmup.stop()
+            
+            # Уведомляем администраторов о завершении работы (ожидание ограничено)
             if self.telegram_service:
-                await self.telegram_service.send_admin_notification(
+                self.telegram_service.notify_admins(
                     admin_ids=settings.get_admin_ids(),
                     message="🛑 Бот завершает работу"
                 )
-            
-            # Останавливаем приложение
+                await self.telegram_service.drain_background(timeout=5.0)
+                # Применяем отложенные правки сообщений с прогрессом
+                await self.telegram_service.edit_coalescer.close()
+            
+            # Публикуем накопленные сводки отчетов
+            if self.group_digest:
+                await self.group_digest.close()
+            
+            # Останавливаем очередь исходящих сообщений (неотправленное будет отправлено после перезапуска)
+            if self.outbox:
+                await self.outbox.stop()
+            
+            # Останавливаем прием обновлений и приложение
+            if self.webhook_server:
+                await self.webhook_server.stop()
+            if self.metrics_server:
+                await self.metrics_server.stop()
             if self.application:
-                await self.application.updater.stop()
+                if self.application.updater and self.application.updater.running:
+                    await self.application.updater.stop()
                 await self.application.stop()
                 await self.application.shutdown()
             
@@ -553,9 +716,21 @@ class TelegramReportBot:
             try:
                 await asyncio.sleep(3600)  # Очистка каждый час
                 if self.task_manager:
-                    self.task_manager.cleanup_completed_tasks(max_age_hours=24)
+                    self.task_manager.cleanup_completed_tasks()
                     stats = self.task_manager.get_stats()
                     logger.info(f"Статистика задач: {stats}")
+                if self.speculative_processor:
+                    self.speculative_processor.cleanup(max_age_minutes=60)
+                    logger.info(f"Статистика упреждающего анализа: {self.speculative_processor.stats}")
+                if self.outbox:
+                    self.outbox.cleanup(max_age_days=7)
+                    logger.info(f"Статистика очереди сообщений: {self.outbox.get_stats()}")
+                if self.task_manager and self.task_manager.journal:
+                    self.task_manager.journal.cleanup(max_age_days=7)
+                if getattr(self, 'reminder_service', None) and self.reminder_service.ledger:
+                    self.reminder_service.ledger.cleanup(max_age_days=30)
+                if self.report_handler:
+                    self.report_handler.user_reports.evict_expired()
             except asyncio.CancelledError:
                 logger.info("Периодическая очистка задач остановлена")
                 break
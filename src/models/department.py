@@ -13,7 +13,7 @@ class Department(BaseModel):
     head_name: Optional[str] = Field(None, description="ФИО руководителя")
     is_active: bool = Field(True, description="Активен ли отдел")
     report_required: bool = Field(True, description="Требуется ли отчет от отдела")
-    report_deadline_day: int = Field(5, description="День недели дедлайна (0-6, где 0=понедельник)")
+    report_deadline_day: int = Field(5, description="День недели дедлайна (1-7, где 1=понедельник, 5=пятница)")
     report_deadline_hour: int = Field(18, description="Час дедлайна (0-23)")
     created_at: Optional[datetime] = Field(None, description="Дата создания")
     updated_at: Optional[datetime] = Field(None, description="Дата обновления")
@@ -1,3 +1,4 @@
+import hashlib
 from datetime import datetime
 from typing import Optional
 from pydantic import BaseModel, Field
@@ -32,6 +33,10 @@ class WeeklyReport(BaseModel):
     analysis: Optional[str] = Field(None, description="Анализ отчета")
     is_processed: bool = Field(False, description="Обработан ли отчет ИИ")
     
+    # Поиск повторов
+    duplicate_of_week: Optional[datetime] = Field(None, description="Неделя отчета, который почти дословно повторяется")
+    duplicate_similarity: Optional[float] = Field(None, description="Косинусное сходство с повторяемым отчетом")
+    
     def mark_as_processed(self, summary: str, analysis: str):
         """Отметить отчет как обработанный ИИ"""
         self.summary = summary
@@ -39,6 +44,21 @@ class WeeklyReport(BaseModel):
         self.is_processed = True
         self.status = "processed"
     
+    def mark_as_duplicate(self, week_start: datetime, similarity: float):
+        """Отметить отчет как почти дословный повтор ранее сданного"""
+        self.duplicate_of_week = week_start
+        self.duplicate_similarity = similarity
+    
+    def content_fingerprint(self) -> str:
+        """Отпечаток содержимого, от которого зависит ИИ-анализ отчета"""
+        parts = [
+            self.full_name, self.department, self.position,
+            self.week_start.isoformat(), self.week_end.isoformat(),
+            self.completed_tasks, self.achievements, self.problems, self.next_week_plans
+        ]
+        content = "\x1f".join(part or "" for part in parts)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+    
     class Config:
         json_encoders = {
             datetime: lambda v: v.isoformat()
@@ -3,7 +3,7 @@
 from .ollama_service import OllamaService
 from .telegram_service import TelegramService
 from .report_processor import ReportProcessor
-from .task_manager import TaskManager, TaskStatus, TaskInfo
+from .task_manager import TaskManager, TaskStatus, TaskInfo, TaskPriority, TaskQueueFullError
 
 __all__ = [
     'OllamaService',
@@ -11,5 +11,7 @@ __all__ = [
     'ReportProcessor',
     'TaskManager',
     'TaskStatus',
-    'TaskInfo'
+    'TaskInfo',
+    'TaskPriority',
+    'TaskQueueFullError'
 ]
\ No newline at end of file
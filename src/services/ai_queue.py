@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Очередь отложенной ИИ-обработки отчетов.
+В пиковые часы перед дедлайном отчет сохраняется и публикуется сразу,
+а анализ через Ollama ставится в очередь (таблица ai_jobs в SQLite)
+и выполняется фоновыми обработчиками с ограниченной скоростью.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import asyncio
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional, List, Dict, Any
+
+from loguru import logger
+
+from config import settings
+from models.report import WeeklyReport
+from .ollama_service import OllamaService
+from .telegram_service import TelegramService
+
+
+class AIJobStatus:
+    """Статусы задач ИИ-обработки"""
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class AIProcessingQueue:
+    """Долговременная очередь ИИ-анализа отчетов"""
+
+    def __init__(self, db_path: Path, ollama_service: OllamaService, telegram_service: TelegramService,
+                 workers: Optional[int] = None, rate_per_minute: Optional[float] = None,
+                 max_attempts: Optional[int] = None):
+        self.db_path = Path(db_path)
+        self.ollama_service = ollama_service
+        self.telegram_service = telegram_service
+        self.workers = workers or settings.ai_queue_workers
+        self.rate_per_minute = rate_per_minute or settings.ai_queue_rate_per_minute
+        self.max_attempts = max_attempts or settings.ai_queue_max_attempts
+        self.poll_interval = 30
+        # Сохранение результатов анализа в отчет (DatabaseManager), подключается в main.py
+        self.db_manager = None
+
+        self.is_running = False
+        self._worker_tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._rate_lock = asyncio.Lock()
+        self._last_start = 0.0
+
+        self._init_table()
+
+    def _init_table(self):
+        """Создание таблицы задач"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS ai_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    week_start DATE NOT NULL,
+                    payload TEXT NOT NULL,
+                    group_message_id INTEGER,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_error TEXT,
+                    summary TEXT,
+                    analysis TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_ai_jobs_status ON ai_jobs (status, next_attempt_at)")
+            conn.commit()
+
+    async def start(self):
+        """Запуск фоновых обработчиков очереди"""
+        if self.is_running:
+            logger.warning("Очередь ИИ-обработки уже запущена")
+            return
+
+        # Задачи, прерванные остановкой бота, возвращаются в очередь
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE ai_jobs SET status = ? WHERE status = ?",
+                (AIJobStatus.PENDING, AIJobStatus.RUNNING)
+            )
+            if cursor.rowcount:
+                logger.info(f"Возобновлено {cursor.rowcount} прерванных задач ИИ-обработки")
+            conn.commit()
+
+        self.is_running = True
+        self._worker_tasks = [
+            asyncio.create_task(self._worker_loop(index)) for index in range(self.workers)
+        ]
+        logger.info(
+            f"Очередь ИИ-обработки запущена: {self.workers} обработчиков, "
+            f"не более {self.rate_per_minute} задач в минуту"
+        )
+
+    async def stop(self):
+        """Остановка обработчиков очереди"""
+        self.is_running = False
+        for task in self._worker_tasks:
+            task.cancel()
+        for task in self._worker_tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._worker_tasks = []
+        logger.info("Очередь ИИ-обработки остановлена")
+
+    def enqueue(self, report: WeeklyReport, group_message_id: Optional[int] = None) -> int:
+        """Постановка отчета в очередь ИИ-анализа"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO ai_jobs (user_id, week_start, payload, group_message_id, next_attempt_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (
+                report.user_id,
+                report.week_start.date(),
+                report.model_dump_json(),
+                group_message_id,
+                datetime.now()
+            ))
+            conn.commit()
+            job_id = cursor.lastrowid
+
+        self._wakeup.set()
+        logger.info(f"Отчет пользователя {report.user_id} поставлен в очередь ИИ-обработки (задача {job_id})")
+        return job_id
+
+    def get_depth(self) -> int:
+        """Количество задач, ожидающих обработки"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COUNT(*) FROM ai_jobs WHERE status IN (?, ?)",
+                (AIJobStatus.PENDING, AIJobStatus.RUNNING)
+            )
+            return cursor.fetchone()[0]
+
+    def get_stats(self) -> Dict[str, int]:
+        """Статистика очереди по статусам"""
+        stats = {
+            AIJobStatus.PENDING: 0,
+            AIJobStatus.RUNNING: 0,
+            AIJobStatus.DONE: 0,
+            AIJobStatus.FAILED: 0
+        }
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT status, COUNT(*) FROM ai_jobs GROUP BY status")
+            for status, count in cursor.fetchall():
+                stats[status] = count
+        return stats
+
+    def _claim_next_job(self) -> Optional[Dict[str, Any]]:
+        """Атомарный захват следующей готовой задачи"""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT * FROM ai_jobs
+                WHERE status = ? AND next_attempt_at <= ?
+                ORDER BY next_attempt_at, id
+                LIMIT 1
+            """, (AIJobStatus.PENDING, datetime.now()))
+            row = cursor.fetchone()
+            if not row:
+                return None
+
+            cursor.execute("""
+                UPDATE ai_jobs SET status = ?, attempts = attempts + 1, updated_at = ?
+                WHERE id = ? AND status = ?
+            """, (AIJobStatus.RUNNING, datetime.now(), row['id'], AIJobStatus.PENDING))
+            conn.commit()
+
+            if cursor.rowcount == 0:
+                # Задачу перехватил другой обработчик
+                return None
+
+            job = dict(row)
+            job['attempts'] += 1
+            return job
+
+    def _finish_job(self, job_id: int, status: str, error: Optional[str] = None,
+                    summary: Optional[str] = None, analysis: Optional[str] = None,
+                    retry_at: Optional[datetime] = None):
+        """Фиксация результата обработки задачи"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE ai_jobs
+                SET status = ?, last_error = ?, summary = ?, analysis = ?,
+                    next_attempt_at = COALESCE(?, next_attempt_at), updated_at = ?
+                WHERE id = ?
+            """, (status, error, summary, analysis, retry_at, datetime.now(), job_id))
+            conn.commit()
+
+    async def _wait_rate_slot(self):
+        """Ограничение скорости запуска задач (общее для всех обработчиков)"""
+        interval = 60.0 / self.rate_per_minute
+        async with self._rate_lock:
+            delay = self._last_start + interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._last_start = time.monotonic()
+
+    async def _worker_loop(self, index: int):
+        """Цикл фонового обработчика"""
+        while self.is_running:
+            try:
+                job = self._claim_next_job()
+
+                if not job:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                await self._wait_rate_slot()
+                await self._process_job(job)
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике очереди ИИ #{index}: {e}")
+                await asyncio.sleep(5)
+
+    async def _process_job(self, job: Dict[str, Any]):
+        """Выполнение ИИ-анализа отчета и обновление поста в группе"""
+        job_id = job['id']
+        report = WeeklyReport.model_validate_json(job['payload'])
+        logger.info(f"ИИ-обработка задачи {job_id} (пользователь {report.user_id}, попытка {job['attempts']})")
+
+        try:
+            # Повторные попытки не должны занимать основную модель в час пик
+            processed_report = await self.ollama_service.process_report(report, low_priority=job['attempts'] > 1)
+        except asyncio.CancelledError:
+            # Задача будет повторена после перезапуска
+            self._finish_job(job_id, AIJobStatus.PENDING, error="interrupted")
+            raise
+        except Exception as e:
+            processed_report = None
+            logger.error(f"Ошибка ИИ-обработки задачи {job_id}: {e}")
+
+        if processed_report and processed_report.is_processed:
+            if self.db_manager:
+                await self.db_manager.update_report_analysis(
+                    processed_report.user_id, processed_report.week_start.date(),
+                    processed_report.summary, processed_report.analysis
+                )
+            if job['group_message_id'] is not None:
+                await self.telegram_service.update_report_in_group(job['group_message_id'], processed_report)
+            self._finish_job(
+                job_id, AIJobStatus.DONE,
+                summary=processed_report.summary,
+                analysis=processed_report.analysis
+            )
+            logger.info(f"Задача ИИ-обработки {job_id} выполнена")
+            return
+
+        if job['attempts'] >= self.max_attempts:
+            self._finish_job(job_id, AIJobStatus.FAILED, error="Ollama недоступен")
+            # Пост в группе перерисовывается без отметки об анализе в очереди
+            if job['group_message_id'] is not None:
+                await self.telegram_service.update_report_in_group(job['group_message_id'], report)
+            logger.warning(f"Задача ИИ-обработки {job_id} не выполнена после {job['attempts']} попыток")
+            return
+
+        # Экспоненциальная задержка перед повтором: 1, 2, 4... минут
+        retry_at = datetime.now() + timedelta(minutes=2 ** (job['attempts'] - 1))
+        self._finish_job(job_id, AIJobStatus.PENDING, error="Ollama недоступен", retry_at=retry_at)
+        logger.info(f"Задача ИИ-обработки {job_id} будет повторена в {retry_at.strftime('%H:%M')}")
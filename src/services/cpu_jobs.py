@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+CPU-задачи для выполнения в пуле процессов.
+Функции этого модуля запускаются через TaskManager.run_cpu/stream_cpu
+в отдельных процессах, поэтому они объявлены на уровне модуля,
+принимают и возвращают только сериализуемые pickle данные (списки,
+словари, строки) и не обращаются к состоянию бота.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import csv
+import io
+from typing import List, Dict, Any, Sequence, Tuple
+
+
+def render_csv_chunk(rows: List[Dict[str, Any]], columns: Sequence[Tuple[str, str]],
+                     delimiter: str = ",", include_header: bool = False) -> str:
+    """Часть CSV-файла: строки rows по колонкам (ключ, заголовок)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter, lineterminator="\r\n")
+    if include_header:
+        writer.writerow([title for _, title in columns])
+    for row in rows:
+        writer.writerow([_format_value(row.get(key)) for key, _ in columns])
+    return buffer.getvalue()
+
+
+def _format_value(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "да" if value else "нет"
+    return str(value)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Учет пользователей, до которых не доходят сообщения.
+Если пользователь заблокировал бота или его чат не найден, он
+отмечается в таблице delivery_status и исключается из рассылок
+напоминаний, чтобы не расходовать лимиты Telegram впустую.
+При следующем обращении пользователя к боту отметка снимается.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+from typing import Set, List, Dict, Any
+
+from loguru import logger
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from database import DatabaseManager
+
+
+class DeliveryTracker:
+    """Отслеживание недоступных для бота пользователей"""
+
+    def __init__(self, db_manager: DatabaseManager):
+        self.db_manager = db_manager
+        # Кэш недоступных пользователей: проверка при каждом обновлении без запросов к БД
+        self._unreachable: Set[int] = set()
+
+    async def load(self) -> None:
+        """Загрузка отметок из базы данных"""
+        self._unreachable = {
+            entry['user_id'] for entry in await self.db_manager.get_unreachable_users()
+        }
+        if self._unreachable:
+            logger.info(f"Недоступных для бота пользователей: {len(self._unreachable)}")
+
+    def is_unreachable(self, user_id: int) -> bool:
+        return int(user_id) in self._unreachable
+
+    @property
+    def unreachable_count(self) -> int:
+        return len(self._unreachable)
+
+    async def mark_unreachable(self, user_id: int, reason: str) -> None:
+        """Отметка пользователя, до которого не доходят сообщения"""
+        user_id = int(user_id)
+        # Групповые чаты (отрицательные ID) не отмечаются
+        if user_id <= 0 or user_id in self._unreachable:
+            return
+
+        self._unreachable.add(user_id)
+        await self.db_manager.mark_user_unreachable(user_id, reason)
+        logger.warning(f"Пользователь {user_id} исключен из рассылок: {reason}")
+
+    async def on_user_activity(self, user_id: int) -> None:
+        """Снятие отметки при обращении пользователя к боту"""
+        if user_id not in self._unreachable:
+            return
+
+        self._unreachable.discard(user_id)
+        await self.db_manager.mark_user_reachable(user_id)
+        logger.info(f"Пользователь {user_id} снова доступен для рассылок")
+
+    async def handle_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Обработчик всех входящих обновлений (регистрируется в отдельной группе)"""
+        if update.effective_user and update.effective_chat and update.effective_chat.type == "private":
+            await self.on_user_activity(update.effective_user.id)
+
+    async def get_unreachable_users(self) -> List[Dict[str, Any]]:
+        """Список недоступных пользователей для администраторов"""
+        return await self.db_manager.get_unreachable_users()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Объединение правок сообщений Telegram.
+Для каждого сообщения хранится только последний желаемый текст:
+промежуточные состояния прогресса, пришедшие между правками,
+отбрасываются, а сами правки выполняются не чаще заданного интервала.
+Правки, не меняющие текст сообщения, не отправляются, а ответ
+RetryAfter приостанавливает отправку и правка повторяется.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple, Any
+
+from loguru import logger
+from telegram import Bot, InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter, NetworkError, TelegramError
+
+from config import settings
+from .rate_limiter import TelegramRateLimiter
+
+# Сколько последних отправленных текстов хранится для пропуска повторных правок
+APPLIED_CACHE_SIZE = 1000
+
+# Число попыток правки при превышении лимита или сетевой ошибке
+EDIT_MAX_ATTEMPTS = 3
+
+MessageKey = Tuple[int, int]
+
+
+@dataclass
+class _EditRequest:
+    """Желаемое состояние сообщения"""
+    text: str
+    reply_markup: Optional[InlineKeyboardMarkup] = None
+    parse_mode: Optional[str] = 'HTML'
+
+    def same_content(self, other: Optional["_EditRequest"]) -> bool:
+        return (other is not None and self.text == other.text and
+                self.reply_markup == other.reply_markup)
+
+
+class MessageEditCoalescer:
+    """Отложенные правки сообщений с объединением промежуточных состояний"""
+
+    def __init__(self, bot: Bot, rate_limiter: TelegramRateLimiter,
+                 min_interval: Optional[float] = None):
+        self.bot = bot
+        self.rate_limiter = rate_limiter
+        self.min_interval = min_interval if min_interval is not None else settings.telegram_edit_interval_seconds
+
+        self._pending: Dict[MessageKey, _EditRequest] = {}
+        self._applied: "OrderedDict[MessageKey, _EditRequest]" = OrderedDict()
+        self._last_edit_at: Dict[MessageKey, float] = {}
+        self._workers: Dict[MessageKey, asyncio.Task] = {}
+        self.stats = {"requested": 0, "edited": 0, "coalesced": 0, "skipped": 0, "failed": 0}
+
+    def request(self, chat_id: int, message_id: int, text: str,
+                reply_markup: Optional[InlineKeyboardMarkup] = None,
+                parse_mode: Optional[str] = 'HTML') -> None:
+        """Запрос правки: сообщение получит последний запрошенный текст"""
+        key = (int(chat_id), int(message_id))
+        self.stats["requested"] += 1
+        if len(self._last_edit_at) > APPLIED_CACHE_SIZE:
+            self._prune()
+        if key in self._pending:
+            # Предыдущее состояние еще не отправлено - оно заменяется новым
+            self.stats["coalesced"] += 1
+        self._pending[key] = _EditRequest(text, reply_markup, parse_mode)
+
+        worker = self._workers.get(key)
+        if worker is None or worker.done():
+            self._workers[key] = asyncio.create_task(self._run(key))
+
+    async def flush(self, chat_id: int, message_id: int) -> None:
+        """Ожидание применения всех запрошенных правок сообщения"""
+        worker = self._workers.get((int(chat_id), int(message_id)))
+        if worker and not worker.done():
+            await asyncio.shield(worker)
+
+    async def close(self) -> None:
+        """Применение всех отложенных правок (при остановке бота)"""
+        workers = [worker for worker in self._workers.values() if not worker.done()]
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _run(self, key: MessageKey) -> None:
+        """Применение правок одного сообщения с интервалом не меньше min_interval"""
+        try:
+            while key in self._pending:
+                wait = self._last_edit_at.get(key, 0.0) + self.min_interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+                edit = self._pending.pop(key, None)
+                if edit is None:
+                    break
+                if edit.same_content(self._applied.get(key)):
+                    self.stats["skipped"] += 1
+                    continue
+
+                if await self._apply(key, edit):
+                    self._remember(key, edit)
+                self._last_edit_at[key] = time.monotonic()
+        finally:
+            if self._workers.get(key) is asyncio.current_task():
+                del self._workers[key]
+
+    async def _apply(self, key: MessageKey, edit: _EditRequest) -> bool:
+        """Правка сообщения в Telegram; True, если текст сообщения соответствует запросу"""
+        chat_id, message_id = key
+        for attempt in range(1, EDIT_MAX_ATTEMPTS + 1):
+            # Пока шла пауза, могло прийти более новое состояние - повторять старое незачем
+            if attempt > 1 and key in self._pending:
+                return False
+
+            await self.rate_limiter.acquire(chat_id)
+            try:
+                await self.bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=edit.text,
+                    reply_markup=edit.reply_markup,
+                    parse_mode=edit.parse_mode
+                )
+                self.stats["edited"] += 1
+                return True
+            except RetryAfter as e:
+                self.rate_limiter.retry_after(e.retry_after)
+            except BadRequest as e:
+                if "message is not modified" in str(e).lower():
+                    self.stats["skipped"] += 1
+                    return True
+                logger.debug(f"Не удалось отредактировать сообщение {message_id} в чате {chat_id}: {e}")
+                break
+            except NetworkError as e:
+                logger.debug(f"Попытка {attempt} правки сообщения {message_id} не удалась: {e}")
+                await asyncio.sleep(attempt)
+            except TelegramError as e:
+                logger.debug(f"Не удалось отредактировать сообщение {message_id} в чате {chat_id}: {e}")
+                break
+
+        self.stats["failed"] += 1
+        return False
+
+    def _prune(self) -> None:
+        """Удаление отметок времени правок, интервал после которых уже истек"""
+        threshold = time.monotonic() - self.min_interval
+        self._last_edit_at = {
+            key: edited_at for key, edited_at in self._last_edit_at.items() if edited_at > threshold
+        }
+
+    def _remember(self, key: MessageKey, edit: _EditRequest) -> None:
+        self._applied[key] = edit
+        self._applied.move_to_end(key)
+        while len(self._applied) > APPLIED_CACHE_SIZE:
+            self._applied.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика правок"""
+        return {**self.stats, "pending": len(self._pending)}
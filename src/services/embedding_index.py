@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Семантический индекс отчетов на основе эмбеддингов Ollama.
+Векторы полей отчетов хранятся в SQLite в компактном виде (float32),
+поиск выполняется косинусным сходством на NumPy. Индекс используется
+для выявления почти дословных повторов отчетов и поиска похожих
+проблем в разных отделах.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import asyncio
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from config import settings
+from models.report import WeeklyReport
+from .ollama_service import OllamaService
+
+
+# Индексируемые поля отчета
+INDEXED_FIELDS = ("completed_tasks", "achievements", "problems", "next_week_plans")
+
+# Короткие ответы ("нет", "отсутствуют") совпадают у всех и не индексируются
+MIN_TEXT_LENGTH = 20
+
+# Размер кэша эмбеддингов, полученных заранее (пока отчет заполняется)
+EMBEDDING_CACHE_SIZE = 512
+
+
+@dataclass
+class SimilarEntry:
+    """Найденный похожий фрагмент отчета"""
+    user_id: int
+    full_name: str
+    department: Optional[str]
+    week_start: datetime
+    field: str
+    text: str
+    similarity: float
+
+
+@dataclass
+class _FieldIndex:
+    """Векторы одного поля отчетов в памяти"""
+    vectors: Optional[np.ndarray] = None
+    entries: List[Dict] = field(default_factory=list)
+
+
+class EmbeddingIndex:
+    """Индекс эмбеддингов полей отчетов"""
+
+    def __init__(self, db_path: Path, ollama_service: OllamaService):
+        self.db_path = Path(db_path)
+        self.ollama_service = ollama_service
+        self.model = settings.ollama_embedding_model
+        self.duplicate_threshold = settings.embedding_duplicate_threshold
+        self._fields: Dict[str, _FieldIndex] = {}
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._init_table()
+
+    def _init_table(self):
+        """Создание таблицы эмбеддингов"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS report_embeddings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    full_name TEXT,
+                    department TEXT,
+                    week_start DATE NOT NULL,
+                    field TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    vector BLOB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(user_id, week_start, field, model)
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_field ON report_embeddings (field, model)")
+            conn.commit()
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        """Нормирование вектора для косинусного сходства"""
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _load(self):
+        """Загрузка векторов текущей модели из базы в память"""
+        rows_by_field: Dict[str, List[Tuple[Dict, np.ndarray]]] = {}
+
+        with sqlite3.connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT user_id, full_name, department, week_start, field, text, dim, vector
+                FROM report_embeddings WHERE model = ?
+                ORDER BY id
+            """, (self.model,))
+            for row in cursor.fetchall():
+                vector = np.frombuffer(row['vector'], dtype=np.float32)
+                if vector.shape[0] != row['dim']:
+                    continue
+                entry = {
+                    'user_id': row['user_id'],
+                    'full_name': row['full_name'],
+                    'department': row['department'],
+                    'week_start': str(row['week_start']),
+                    'text': row['text']
+                }
+                rows_by_field.setdefault(row['field'], []).append((entry, self._normalize(vector)))
+
+        self._fields = {}
+        for field_name, rows in rows_by_field.items():
+            self._fields[field_name] = _FieldIndex(
+                vectors=np.vstack([vector for _, vector in rows]).astype(np.float32),
+                entries=[entry for entry, _ in rows]
+            )
+
+        self._loaded = True
+        total = sum(len(index.entries) for index in self._fields.values())
+        logger.info(f"Индекс эмбеддингов загружен: {total} векторов")
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self._load()
+
+    def _store(self, report: WeeklyReport, field_name: str, text: str, vector: np.ndarray):
+        """Сохранение вектора в базе и в памяти (с заменой прежнего)"""
+        week_start = str(report.week_start.date())
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT OR REPLACE INTO report_embeddings
+                (user_id, full_name, department, week_start, field, text, model, dim, vector)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                report.user_id, report.full_name, report.department, week_start,
+                field_name, text, self.model, vector.shape[0], vector.tobytes()
+            ))
+            conn.commit()
+
+        entry = {
+            'user_id': report.user_id,
+            'full_name': report.full_name,
+            'department': report.department,
+            'week_start': week_start,
+            'text': text
+        }
+        normalized = self._normalize(vector)
+        index = self._fields.setdefault(field_name, _FieldIndex())
+
+        if index.vectors is not None and index.vectors.shape[1] != normalized.shape[0]:
+            logger.warning(f"Размерность эмбеддингов поля {field_name} изменилась, индекс поля пересоздается")
+            index.vectors = None
+            index.entries = []
+
+        for position, existing in enumerate(index.entries):
+            if existing['user_id'] == report.user_id and existing['week_start'] == week_start:
+                index.entries[position] = entry
+                index.vectors[position] = normalized
+                return
+
+        index.entries.append(entry)
+        index.vectors = (
+            normalized[np.newaxis, :] if index.vectors is None
+            else np.vstack([index.vectors, normalized])
+        )
+
+    def _cache_key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model}\x1f{text}".encode("utf-8")).hexdigest()
+
+    async def _embed_cached(self, text: str) -> Optional[List[float]]:
+        """Эмбеддинг текста с использованием кэша"""
+        key = self._cache_key(text)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        vector = await self.ollama_service.embed(text)
+        if vector:
+            self._cache[key] = vector
+            while len(self._cache) > EMBEDDING_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return vector
+
+    async def prefetch(self, text: str) -> None:
+        """Получение эмбеддинга поля заранее, пока отчет еще заполняется"""
+        text = (text or "").strip()
+        if len(text) < MIN_TEXT_LENGTH:
+            return
+        try:
+            await self._embed_cached(text)
+        except Exception as e:
+            logger.warning(f"Не удалось заранее получить эмбеддинг: {e}")
+
+    async def _embed_fields(self, report: WeeklyReport) -> Dict[str, Tuple[str, np.ndarray]]:
+        """Получение эмбеддингов содержательных полей отчета"""
+        texts = {
+            name: (getattr(report, name) or "").strip()
+            for name in INDEXED_FIELDS
+        }
+        texts = {name: text for name, text in texts.items() if len(text) >= MIN_TEXT_LENGTH}
+
+        vectors = await asyncio.gather(*(self._embed_cached(text) for text in texts.values()))
+
+        return {
+            name: (text, np.asarray(vector, dtype=np.float32))
+            for (name, text), vector in zip(texts.items(), vectors)
+            if vector
+        }
+
+    async def index_report(self, report: WeeklyReport) -> Optional[Tuple[datetime, float]]:
+        """Добавление отчета в индекс с проверкой на повтор.
+
+        Возвращает неделю и сходство отчета того же сотрудника, который
+        новый отчет почти дословно повторяет, либо None.
+        """
+        embedded = await self._embed_fields(report)
+        if not embedded:
+            return None
+
+        async with self._lock:
+            self._ensure_loaded()
+            duplicate = self._find_duplicate(report, embedded)
+            for field_name, (text, vector) in embedded.items():
+                self._store(report, field_name, text, vector)
+
+        if duplicate:
+            logger.warning(
+                f"Отчет пользователя {report.user_id} повторяет отчет за неделю "
+                f"{duplicate[0].strftime('%d.%m.%Y')} (сходство {duplicate[1]:.2f})"
+            )
+        return duplicate
+
+    def _find_duplicate(self, report: WeeklyReport,
+                        embedded: Dict[str, Tuple[str, np.ndarray]]) -> Optional[Tuple[datetime, float]]:
+        """Поиск прошлого отчета сотрудника с максимальным средним сходством полей"""
+        current_week = str(report.week_start.date())
+        scores: Dict[str, List[float]] = {}
+
+        for field_name, (_, vector) in embedded.items():
+            index = self._fields.get(field_name)
+            if index is None or index.vectors is None or index.vectors.shape[1] != vector.shape[0]:
+                continue
+
+            positions = [
+                position for position, entry in enumerate(index.entries)
+                if entry['user_id'] == report.user_id and entry['week_start'] != current_week
+            ]
+            if not positions:
+                continue
+
+            similarities = index.vectors[positions] @ self._normalize(vector)
+            for position, similarity in zip(positions, similarities):
+                scores.setdefault(index.entries[position]['week_start'], []).append(float(similarity))
+
+        best: Optional[Tuple[datetime, float]] = None
+        for week_start, values in scores.items():
+            # Повтором считается совпадение большинства полей, а не одного
+            if len(values) < len(embedded) // 2 + 1:
+                continue
+            score = float(np.mean(values))
+            if score >= self.duplicate_threshold and (best is None or score > best[1]):
+                best = (datetime.fromisoformat(week_start), score)
+
+        return best
+
+    async def search(self, query: str, field_name: str = "problems", top_k: int = 5,
+                     min_similarity: float = 0.5) -> List[SimilarEntry]:
+        """Поиск фрагментов отчетов, похожих на запрос"""
+        vector = await self.ollama_service.embed(query)
+        if not vector:
+            return []
+
+        query_vector = self._normalize(np.asarray(vector, dtype=np.float32))
+
+        async with self._lock:
+            self._ensure_loaded()
+            index = self._fields.get(field_name)
+            if index is None or index.vectors is None or index.vectors.shape[1] != query_vector.shape[0]:
+                return []
+
+            similarities = index.vectors @ query_vector
+            top_k = min(top_k, similarities.shape[0])
+            candidates = np.argpartition(-similarities, top_k - 1)[:top_k]
+            ranked = candidates[np.argsort(-similarities[candidates])]
+
+            return [
+                SimilarEntry(
+                    user_id=index.entries[position]['user_id'],
+                    full_name=index.entries[position]['full_name'],
+                    department=index.entries[position]['department'],
+                    week_start=datetime.fromisoformat(index.entries[position]['week_start']),
+                    field=field_name,
+                    text=index.entries[position]['text'],
+                    similarity=float(similarities[position])
+                )
+                for position in ranked
+                if similarities[position] >= min_similarity
+            ]
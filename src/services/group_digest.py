@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Сводные публикации отчетов в групповом чате.
+В режиме сводки отчеты, поступившие в течение окна, публикуются
+одним общим сообщением, которое затем редактируется по мере
+поступления новых отчетов и результатов ИИ-анализа. Перед дедлайном
+это заменяет сотни отдельных сообщений несколькими правками и
+удерживает бота в пределах лимита групповых чатов (~20 сообщений в минуту).
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from config import settings
+from models.report import WeeklyReport
+from utils.text_utils import split_long_message
+from .telegram_service import SEND_OK
+
+# Максимальная длина одной части сводки (лимит Telegram - 4096 символов)
+DIGEST_PART_LENGTH = 4000
+
+
+@dataclass
+class _Digest:
+    """Сводка отчетов одного окна"""
+    digest_id: str
+    started_at: float
+    created_at: datetime = field(default_factory=datetime.now)
+    entries: Dict[Tuple[int, str], Tuple[WeeklyReport, bool]] = field(default_factory=dict)
+    message_ids: List[int] = field(default_factory=list)
+    rendered_parts: List[str] = field(default_factory=list)
+
+
+class GroupDigest:
+    """Объединение отчетов в сводные сообщения группового чата"""
+
+    def __init__(self, telegram_service, window_seconds: Optional[int] = None,
+                 flush_delay: Optional[float] = None, max_reports: Optional[int] = None):
+        self.telegram_service = telegram_service
+        self.window_seconds = window_seconds or settings.group_digest_window_seconds
+        self.flush_delay = flush_delay or settings.group_digest_flush_seconds
+        self.max_reports = max_reports or settings.group_digest_max_reports
+
+        self._current: Optional[_Digest] = None
+        # Недавние сводки: для дополнения отчетов результатами ИИ-анализа
+        self._recent: List[_Digest] = []
+        self._pending_flush: Dict[str, asyncio.Task] = {}
+        self._lock = asyncio.Lock()
+        self.stats = {"reports": 0, "posts": 0, "edits": 0}
+
+    @staticmethod
+    def _entry_key(report: WeeklyReport) -> Tuple[int, str]:
+        return report.user_id, report.week_start.strftime('%Y-%m-%d')
+
+    def _current_digest(self) -> _Digest:
+        """Текущая сводка; новая начинается по истечении окна или при переполнении"""
+        now = time.monotonic()
+        digest = self._current
+        if (digest is None or now - digest.started_at >= self.window_seconds or
+                len(digest.entries) >= self.max_reports):
+            digest = _Digest(digest_id=datetime.now().strftime('%Y%m%d%H%M%S%f'), started_at=now)
+            self._current = digest
+            self._recent.append(digest)
+            # Дополнять результатами анализа можно только последние сводки
+            self._recent = self._recent[-20:]
+        return digest
+
+    def add(self, report: WeeklyReport, analysis_pending: bool = False) -> None:
+        """Добавление отчета в текущую сводку (публикация - после паузы)"""
+        key = self._entry_key(report)
+        digest = self._find(key) or self._current_digest()
+        digest.entries[key] = (report.model_copy(deep=True), analysis_pending)
+        self.stats["reports"] += 1
+        self._schedule_flush(digest)
+
+    def update(self, report: WeeklyReport) -> bool:
+        """Замена отчета в сводке (например, после ИИ-анализа); False, если отчета нет в сводках"""
+        key = self._entry_key(report)
+        digest = self._find(key)
+        if not digest:
+            return False
+        digest.entries[key] = (report.model_copy(deep=True), False)
+        self._schedule_flush(digest)
+        return True
+
+    def _find(self, key: Tuple[int, str]) -> Optional[_Digest]:
+        for digest in reversed(self._recent):
+            if key in digest.entries:
+                return digest
+        return None
+
+    def _schedule_flush(self, digest: _Digest) -> None:
+        """Отложенная публикация: все изменения за паузу попадают в одну правку"""
+        task = self._pending_flush.get(digest.digest_id)
+        if task and not task.done():
+            return
+        self._pending_flush[digest.digest_id] = asyncio.create_task(self._flush_later(digest))
+
+    async def _flush_later(self, digest: _Digest) -> None:
+        try:
+            await asyncio.sleep(self.flush_delay)
+            # Изменения, пришедшие во время публикации, планируют следующую публикацию
+            self._pending_flush.pop(digest.digest_id, None)
+            await self.flush(digest)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка публикации сводки отчетов {digest.digest_id}: {e}")
+
+    def _render(self, digest: _Digest) -> List[str]:
+        """Текст сводки, разбитый на части допустимой длины"""
+        header = (
+            f"📋 <b>Еженедельные отчеты</b> "
+            f"({len(digest.entries)}, с {digest.created_at.strftime('%d.%m.%Y %H:%M')})"
+        )
+        entries = [
+            self.telegram_service.format_report_digest_entry(index, report, analysis_pending)
+            for index, (report, analysis_pending) in enumerate(digest.entries.values(), start=1)
+        ]
+        return split_long_message("\n\n".join([header] + entries), DIGEST_PART_LENGTH)
+
+    async def flush(self, digest: _Digest) -> None:
+        """Публикация или правка сообщений сводки"""
+        async with self._lock:
+            parts = self._render(digest)
+            chat_id = self.telegram_service.group_chat_id
+
+            for index, part in enumerate(parts):
+                if index < len(digest.message_ids):
+                    if index < len(digest.rendered_parts) and digest.rendered_parts[index] == part:
+                        continue
+                    if await self.telegram_service.edit_message_safe(chat_id, digest.message_ids[index], part):
+                        self.stats["edits"] += 1
+                    continue
+
+                status, message_id = await self.telegram_service.send_message_durable(
+                    f"group-digest:{digest.digest_id}:{index}", chat_id, part,
+                    timeout=settings.request_timeout,
+                    parse_mode='HTML',
+                    message_thread_id=self.telegram_service.thread_id
+                )
+                if status != SEND_OK:
+                    # Остальные части будут опубликованы при следующей правке
+                    logger.error(f"Не удалось опубликовать часть {index + 1} сводки отчетов")
+                    break
+                digest.message_ids.append(message_id)
+                self.stats["posts"] += 1
+
+            digest.rendered_parts = parts[:len(digest.message_ids)]
+            logger.info(
+                f"Сводка отчетов обновлена: {len(digest.entries)} отчетов, "
+                f"{len(digest.message_ids)} сообщений"
+            )
+
+    async def close(self) -> None:
+        """Немедленная публикация незавершенных сводок (при остановке бота)"""
+        tasks = [task for task in self._pending_flush.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        self._pending_flush.clear()
+        for digest in self._recent:
+            if digest.entries and digest.rendered_parts != self._render(digest):
+                await self.flush(digest)
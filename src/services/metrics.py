@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Метрики задержек бота.
+Гистограммы времени ожидания в очереди задач, этапов обработки отчета,
+запросов к Ollama, обработчиков обновлений и вызовов Telegram API.
+Метрики доступны в текстовом формате Prometheus на локальном
+HTTP-эндпоинте /metrics и в виде краткой сводки по команде /metrics.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple, Any, Iterator, Sequence
+
+from aiohttp import web
+from loguru import logger
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import HTTPXRequest
+
+from config import settings
+
+# Границы корзин гистограмм, секунды: от быстрых запросов к БД до долгого ИИ-анализа
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Series:
+    """Наблюдения гистограммы для одного набора меток"""
+
+    __slots__ = ("bucket_counts", "count", "total")
+
+    def __init__(self, size: int):
+        self.bucket_counts = [0] * size
+        self.count = 0
+        self.total = 0.0
+
+
+class Histogram:
+    """Гистограмма длительностей с метками"""
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], _Series] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        """Учет одного наблюдения"""
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _Series(len(self.buckets))
+
+        series.count += 1
+        series.total += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series.bucket_counts[index] += 1
+                break
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Замер длительности блока кода (в том числе с await внутри)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.label_names, key)) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+    def render(self) -> List[str]:
+        """Строки в текстовом формате Prometheus"""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series.bucket_counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', repr(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', '+Inf'))} {series.count}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {series.total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {series.count}")
+        return lines
+
+    def _quantile(self, series: _Series, q: float) -> float:
+        """Оценка квантиля по корзинам (линейная интерполяция внутри корзины)"""
+        rank = q * series.count
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, series.bucket_counts):
+            if count and cumulative + count >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound
+        # Наблюдение больше последней границы
+        return self.buckets[-1]
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Сводка по каждому набору меток: количество, среднее, p50, p95"""
+        return [
+            {
+                "labels": dict(zip(self.label_names, key)),
+                "count": series.count,
+                "avg": series.total / series.count,
+                "p50": self._quantile(series, 0.5),
+                "p95": self._quantile(series, 0.95)
+            }
+            for key, series in sorted(self._series.items()) if series.count
+        ]
+
+
+class MetricsRegistry:
+    """Набор метрик бота"""
+
+    def __init__(self):
+        self._histograms: Dict[str, Histogram] = {}
+
+    def histogram(self, name: str, description: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """Получение (или создание) гистограммы"""
+        if name not in self._histograms:
+            self._histograms[name] = Histogram(name, description, label_names, buckets)
+        return self._histograms[name]
+
+    @property
+    def histograms(self) -> List[Histogram]:
+        return list(self._histograms.values())
+
+    def render_prometheus(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines: List[str] = []
+        for histogram in self._histograms.values():
+            lines.extend(histogram.render())
+        return "\n".join(lines) + "\n"
+
+
+# Глобальный набор метрик
+metrics = MetricsRegistry()
+
+TASK_QUEUE_WAIT = metrics.histogram(
+    "report_bot_task_queue_wait_seconds", "Ожидание фоновой задачи до начала выполнения"
+)
+TASK_DURATION = metrics.histogram(
+    "report_bot_task_duration_seconds", "Выполнение фоновой задачи", ["status"]
+)
+REPORT_STAGE = metrics.histogram(
+    "report_bot_report_stage_seconds", "Этапы обработки отчета", ["stage"]
+)
+OLLAMA_REQUEST = metrics.histogram(
+    "report_bot_ollama_request_seconds", "Запросы к Ollama", ["kind", "status"]
+)
+HANDLER_DURATION = metrics.histogram(
+    "report_bot_handler_seconds", "Обработка входящих обновлений Telegram", ["update_type"]
+)
+TELEGRAM_API = metrics.histogram(
+    "report_bot_telegram_api_seconds", "Вызовы Telegram Bot API", ["method", "status"]
+)
+
+
+def _update_type(update: object) -> str:
+    """Тип обновления для метки (без пользовательских данных, чтобы число меток было ограничено)"""
+    if not isinstance(update, Update):
+        return "other"
+    if update.callback_query:
+        return "callback_query"
+    if update.message and update.message.text and update.message.text.startswith("/"):
+        return "command"
+    if update.message:
+        return "message"
+    return "other"
+
+
+class InstrumentedApplication(Application):
+    """Приложение python-telegram-bot с замером времени обработки обновлений"""
+
+    async def process_update(self, update: object) -> None:
+        with HANDLER_DURATION.time(update_type=_update_type(update)):
+            await super().process_update(update)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTP-клиент Telegram Bot API с замером длительности вызовов"""
+
+    async def do_request(self, url: str, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = await super().do_request(url, *args, **kwargs)
+            status = "ok" if 200 <= result[0] < 300 else str(result[0])
+            return result
+        finally:
+            TELEGRAM_API.observe(time.perf_counter() - started, method=method, status=status)
+
+
+def format_metrics_summary() -> str:
+    """Краткая сводка метрик для администраторов (HTML)"""
+    lines = ["📈 <b>Задержки</b> (среднее / p50 / p95, с)\n"]
+    for histogram in metrics.histograms:
+        rows = histogram.summary()
+        if not rows:
+            continue
+        lines.append(f"<b>{histogram.description}</b>")
+        for row in rows:
+            label = ", ".join(value for value in row["labels"].values() if value) or "все"
+            lines.append(
+                f"• {label}: {row['avg']:.2f} / {row['p50']:.2f} / {row['p95']:.2f} ({row['count']})"
+            )
+        lines.append("")
+    if len(lines) == 1:
+        lines.append("Данных пока нет.")
+    return "\n".join(lines).strip()
+
+
+class MetricsServer:
+    """Локальный HTTP-эндпоинт /metrics в формате Prometheus"""
+
+    def __init__(self, listen: Optional[str] = None, port: Optional[int] = None):
+        self.listen = listen or settings.metrics_listen
+        self.port = port or settings.metrics_port
+        self.app = web.Application()
+        self.app.router.add_get("/metrics", self._handle_metrics)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Метрики доступны на http://{self.listen}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
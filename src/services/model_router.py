@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Маршрутизация запросов между моделями Ollama.
+Краткие сводки, короткие отчеты и низкоприоритетные задачи
+направляются на небольшую быструю модель, полный анализ - на основную.
+При перегрузке (глубокая очередь ИИ или рост задержек основной модели)
+все запросы временно переводятся на быструю модель, чтобы задержка
+в час перед дедлайном оставалась ограниченной.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import time
+from collections import deque
+from typing import Callable, Dict, Optional, Any
+
+from loguru import logger
+
+from config import settings
+
+
+class RequestKind:
+    """Типы запросов к модели"""
+    ANALYSIS = "analysis"
+    SUMMARY = "summary"
+    WEEKLY_SUMMARY = "weekly_summary"
+    PERFORMANCE = "performance"
+    IMPROVEMENTS = "improvements"
+
+
+# Запросы, для которых всегда достаточно быстрой модели
+FAST_KINDS = {RequestKind.SUMMARY}
+
+# Число последних запросов основной модели для оценки задержки
+LATENCY_SAMPLES = 20
+
+# Минимальная длительность режима перегрузки (защита от частых переключений)
+DEGRADED_MIN_SECONDS = 300
+
+
+class ModelRouter:
+    """Выбор модели для запроса"""
+
+    def __init__(self, primary_model: Optional[str] = None, fast_model: Optional[str] = None,
+                 queue_depth_provider: Optional[Callable[[], int]] = None):
+        self.primary_model = primary_model or settings.ollama_model
+        self.fast_model = fast_model if fast_model is not None else settings.ollama_fast_model
+        self.queue_depth_provider = queue_depth_provider
+        self.max_content_tokens = settings.ai_fast_model_max_prompt_tokens
+        self.max_queue_depth = settings.ai_downgrade_queue_depth
+        self.max_latency = settings.ai_downgrade_latency_seconds
+
+        self.degraded = False
+        self.degraded_since = 0.0
+        self.downgrade_count = 0
+        self._primary_latencies: deque = deque(maxlen=LATENCY_SAMPLES)
+        self._requests: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.fast_model) and self.fast_model != self.primary_model
+
+    @property
+    def models(self):
+        """Модели, которые могут понадобиться (для прогрева)"""
+        return [self.primary_model, self.fast_model] if self.enabled else [self.primary_model]
+
+    def record_latency(self, model: str, seconds: float) -> None:
+        """Учет времени генерации (без загрузки модели)"""
+        if model == self.primary_model:
+            self._primary_latencies.append(seconds)
+
+    def _recent_latency(self) -> Optional[float]:
+        """Медиана задержки основной модели по последним запросам"""
+        if len(self._primary_latencies) < 3:
+            return None
+        ordered = sorted(self._primary_latencies)
+        return ordered[len(ordered) // 2]
+
+    def _queue_depth(self) -> int:
+        if not self.queue_depth_provider:
+            return 0
+        try:
+            return self.queue_depth_provider()
+        except Exception as e:
+            logger.warning(f"Не удалось получить глубину очереди ИИ: {e}")
+            return 0
+
+    def _update_degraded(self) -> None:
+        """Переключение режима перегрузки с гистерезисом"""
+        depth = self._queue_depth()
+        latency = self._recent_latency()
+
+        if not self.degraded:
+            if depth > self.max_queue_depth or (latency is not None and latency > self.max_latency):
+                self.degraded = True
+                self.degraded_since = time.monotonic()
+                self.downgrade_count += 1
+                # В режиме перегрузки основная модель не используется, и ее
+                # задержка оценивается заново после возврата
+                self._primary_latencies.clear()
+                logger.warning(
+                    f"Перегрузка ИИ (очередь {depth}, задержка {latency or 0:.1f} с): "
+                    f"запросы переводятся на модель {self.fast_model}"
+                )
+            return
+
+        # Возврат на основную модель только после заметного снижения нагрузки
+        if time.monotonic() - self.degraded_since >= DEGRADED_MIN_SECONDS and depth <= self.max_queue_depth // 2:
+            self.degraded = False
+            logger.info(f"Нагрузка ИИ снизилась: полный анализ снова выполняет {self.primary_model}")
+
+    def select(self, kind: str, content_tokens: int = 0, low_priority: bool = False) -> str:
+        """Модель для запроса данного типа"""
+        if not self.enabled:
+            model = self.primary_model
+        else:
+            self._update_degraded()
+            use_fast = (
+                self.degraded or
+                low_priority or
+                kind in FAST_KINDS or
+                (kind == RequestKind.ANALYSIS and content_tokens <= self.max_content_tokens)
+            )
+            model = self.fast_model if use_fast else self.primary_model
+
+        self._requests[model] = self._requests.get(model, 0) + 1
+        return model
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика маршрутизации"""
+        return {
+            "enabled": self.enabled,
+            "primary_model": self.primary_model,
+            "fast_model": self.fast_model,
+            "degraded": self.degraded,
+            "downgrade_count": self.downgrade_count,
+            "recent_latency": self._recent_latency(),
+            "requests": dict(self._requests)
+        }
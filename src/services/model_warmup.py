@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Сервис прогрева модели Ollama перед пиковыми окнами.
+Модель загружается заранее перед дедлайнами отделов и рассылками
+напоминаний и удерживается в памяти до конца окна, чтобы первый
+отчет после простоя не ждал загрузки модели.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Optional, Set, Tuple
+
+from loguru import logger
+
+from config import settings, REPORT_DEADLINE_DAY, REPORT_DEADLINE_HOUR
+from database import DatabaseManager
+from utils.date_utils import deadline_weekday
+from .ollama_service import OllamaService
+from .reminder_service import parse_reminder_settings, deadline_reminder_minute
+
+
+class ModelWarmupService:
+    """Прогрев модели перед дедлайнами и напоминаниями"""
+
+    def __init__(self, ollama_service: OllamaService, db_manager: DatabaseManager,
+                 lead_minutes: Optional[int] = None, window_minutes: Optional[int] = None):
+        self.ollama_service = ollama_service
+        self.db_manager = db_manager
+        self.lead = timedelta(minutes=lead_minutes or settings.ollama_warmup_lead_minutes)
+        self.window = timedelta(minutes=window_minutes or settings.ollama_warmup_window_minutes)
+        self.check_interval = 300
+        self.is_running = False
+        self._task: Optional[asyncio.Task] = None
+        self._warmed_until: Optional[datetime] = None
+
+    async def start(self):
+        """Запуск сервиса прогрева"""
+        if self.is_running:
+            logger.warning("Сервис прогрева модели уже запущен")
+            return
+
+        self.is_running = True
+        self._task = asyncio.create_task(self._warmup_loop())
+        logger.info("Сервис прогрева модели запущен")
+
+    async def stop(self):
+        """Остановка сервиса прогрева"""
+        self.is_running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        logger.info("Сервис прогрева модели остановлен")
+
+    async def _warmup_loop(self):
+        """Основной цикл: прогрев при запуске и перед окнами"""
+        # Первый запрос после запуска бота не должен ждать загрузки модели
+        await self.ollama_service.warm_up()
+
+        while self.is_running:
+            try:
+                await self._check_and_warm_up()
+                await asyncio.sleep(self.check_interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Ошибка в цикле прогрева модели: {e}")
+                await asyncio.sleep(self.check_interval)
+
+    async def _check_and_warm_up(self):
+        """Прогрев модели, если текущее время попадает в окно перед событием"""
+        now = datetime.now()
+        window_end = await self._get_active_window_end(now)
+        if not window_end:
+            return
+
+        # Модель уже удерживается до конца этого окна
+        if self._warmed_until and self._warmed_until >= window_end:
+            return
+
+        logger.info(f"Прогрев модели перед пиковым окном (до {window_end.strftime('%d.%m %H:%M')})")
+        if await self.ollama_service.warm_up(hold_until=window_end):
+            self._warmed_until = window_end
+
+    async def _get_active_window_end(self, now: datetime) -> Optional[datetime]:
+        """Конец окна, в которое попадает текущее время, если такое есть"""
+        window_end = None
+        for event in self._expand_events(await self._get_weekly_events(), now):
+            start, end = event - self.lead, event + self.window
+            if start <= now <= end and (window_end is None or end > window_end):
+                window_end = end
+        return window_end
+
+    @staticmethod
+    def _expand_events(events: Set[Tuple[int, int, int]], now: datetime) -> List[datetime]:
+        """Даты событий на прошлой, текущей и следующей неделе"""
+        monday = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+        return [
+            monday + timedelta(weeks=week, days=weekday, hours=hour, minutes=minute)
+            for week in (-1, 0, 1)
+            for weekday, hour, minute in events
+        ]
+
+    async def _get_weekly_events(self) -> Set[Tuple[int, int, int]]:
+        """Еженедельные события (день недели, час, минута), вызывающие пик отчетов"""
+        events: Set[Tuple[int, int, int]] = {(deadline_weekday(REPORT_DEADLINE_DAY), REPORT_DEADLINE_HOUR, 0)}
+        reminder_settings = await self.db_manager.get_reminder_settings()
+        reminders_enabled = bool(reminder_settings.get('auto_enabled'))
+        lead_hours = settings.reminder_deadline_lead_hours
+
+        for department in await self.db_manager.get_departments():
+            if department.is_active and department.report_required:
+                events.add((deadline_weekday(department.report_deadline_day), department.report_deadline_hour, 0))
+                # Напоминание ReminderService перед дедлайном отдела
+                if reminders_enabled and lead_hours > 0:
+                    minute_of_week = deadline_reminder_minute(
+                        department.report_deadline_day, department.report_deadline_hour, lead_hours
+                    )
+                    events.add((minute_of_week // (24 * 60), minute_of_week // 60 % 24, minute_of_week % 60))
+
+        if reminders_enabled:
+            events.update(parse_reminder_settings(reminder_settings))
+
+        return events
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Пул серверов Ollama с балансировкой нагрузки.
+Запрос направляется на сервер с наименьшим числом выполняющихся
+запросов; для каждого сервера ведется состояние автомата защиты
+(circuit breaker), чтобы недоступный сервер временно исключался
+из маршрутизации, а запросы переходили на остальные.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any
+
+from loguru import logger
+
+from config import settings
+
+
+class CircuitState:
+    """Состояния автомата защиты сервера"""
+    CLOSED = "closed"        # сервер работает, запросы проходят
+    OPEN = "open"            # сервер исключен до истечения паузы
+    HALF_OPEN = "half_open"  # пробный запрос после паузы
+
+
+@dataclass
+class OllamaEndpoint:
+    """Сервер Ollama и его текущее состояние"""
+    url: str
+    outstanding: int = 0
+    state: str = CircuitState.CLOSED
+    consecutive_failures: int = 0
+    opened_at: float = 0.0
+    total_requests: int = 0
+    total_failures: int = 0
+    last_latency: Optional[float] = None
+    last_error: Optional[str] = None
+
+
+class OllamaEndpointPool:
+    """Маршрутизация запросов между серверами Ollama"""
+
+    def __init__(self, urls: List[str], failure_threshold: Optional[int] = None,
+                 recovery_timeout: Optional[float] = None):
+        if not urls:
+            raise ValueError("Не указан ни один сервер Ollama")
+
+        self.endpoints = [OllamaEndpoint(url=url.rstrip('/')) for url in urls]
+        self.failure_threshold = failure_threshold or settings.ollama_circuit_failure_threshold
+        self.recovery_timeout = recovery_timeout or settings.ollama_circuit_recovery_seconds
+
+    def _is_available(self, endpoint: OllamaEndpoint) -> bool:
+        """Можно ли направить запрос на сервер"""
+        if endpoint.state == CircuitState.OPEN:
+            if time.monotonic() - endpoint.opened_at < self.recovery_timeout:
+                return False
+            endpoint.state = CircuitState.HALF_OPEN
+            logger.info(f"Сервер Ollama {endpoint.url}: пробный запрос после паузы")
+
+        # В полуоткрытом состоянии допускается только один пробный запрос
+        if endpoint.state == CircuitState.HALF_OPEN:
+            return endpoint.outstanding == 0
+        return True
+
+    def acquire(self, exclude: Optional[List[OllamaEndpoint]] = None) -> Optional[OllamaEndpoint]:
+        """Выбор сервера с наименьшим числом выполняющихся запросов"""
+        exclude = exclude or []
+        candidates = [
+            endpoint for endpoint in self.endpoints
+            if endpoint not in exclude and self._is_available(endpoint)
+        ]
+        if not candidates:
+            return None
+
+        endpoint = min(candidates, key=lambda item: (item.outstanding, item.total_requests))
+        endpoint.outstanding += 1
+        endpoint.total_requests += 1
+        return endpoint
+
+    def release(self, endpoint: OllamaEndpoint, success: bool, latency: Optional[float] = None,
+                error: Optional[str] = None) -> None:
+        """Фиксация результата запроса к серверу"""
+        endpoint.outstanding = max(endpoint.outstanding - 1, 0)
+
+        if success:
+            if endpoint.state != CircuitState.CLOSED:
+                logger.info(f"Сервер Ollama {endpoint.url} снова доступен")
+            endpoint.state = CircuitState.CLOSED
+            endpoint.consecutive_failures = 0
+            endpoint.last_latency = latency
+            return
+
+        endpoint.consecutive_failures += 1
+        endpoint.total_failures += 1
+        endpoint.last_error = error
+
+        if endpoint.state == CircuitState.HALF_OPEN or endpoint.consecutive_failures >= self.failure_threshold:
+            if endpoint.state != CircuitState.OPEN:
+                logger.warning(
+                    f"Сервер Ollama {endpoint.url} исключен на {self.recovery_timeout:.0f} с "
+                    f"после {endpoint.consecutive_failures} ошибок подряд"
+                )
+            endpoint.state = CircuitState.OPEN
+            endpoint.opened_at = time.monotonic()
+
+    def abandon(self, endpoint: OllamaEndpoint) -> None:
+        """Освобождение сервера после отмены запроса (не считается ошибкой)"""
+        endpoint.outstanding = max(endpoint.outstanding - 1, 0)
+
+    def mark_health(self, endpoint: OllamaEndpoint, healthy: bool, error: Optional[str] = None) -> None:
+        """Учет результата проверки доступности (без влияния на счетчик запросов)"""
+        if healthy:
+            endpoint.state = CircuitState.CLOSED
+            endpoint.consecutive_failures = 0
+        else:
+            endpoint.state = CircuitState.OPEN
+            endpoint.opened_at = time.monotonic()
+            endpoint.last_error = error
+
+    @property
+    def available_count(self) -> int:
+        return sum(1 for endpoint in self.endpoints if endpoint.state != CircuitState.OPEN)
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """Состояние серверов пула"""
+        return [
+            {
+                "url": endpoint.url,
+                "state": endpoint.state,
+                "outstanding": endpoint.outstanding,
+                "requests": endpoint.total_requests,
+                "failures": endpoint.total_failures,
+                "last_latency": endpoint.last_latency,
+                "last_error": endpoint.last_error
+            }
+            for endpoint in self.endpoints
+        ]
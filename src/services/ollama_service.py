@@ -1,120 +1,401 @@
 import aiohttp
 import asyncio
-from typing import Optional, Dict, Any
+import math
+import re
+import time
+from collections import deque
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
 from loguru import logger
 
 from config import settings
 from models.report import WeeklyReport
+from utils.text_utils import extractive_summary
+from .prompt_builder import PromptBuilder
+from .ollama_pool import OllamaEndpoint, OllamaEndpointPool
+from .model_router import ModelRouter, RequestKind
+from .metrics import OLLAMA_REQUEST
+
+# Лимиты генерации (num_predict) для разных типов запросов.
+# Русский текст занимает ~2.3 токена на слово, поэтому лимиты
+# рассчитаны от объема ответа, запрошенного в промпте, с запасом.
+ANALYSIS_NUM_PREDICT = 1280      # не более 500 слов
+SUMMARY_NUM_PREDICT = 560        # не более 200 слов
+WEEKLY_SUMMARY_NUM_PREDICT = 1024  # не более 400 слов
+PERFORMANCE_NUM_PREDICT = 800    # не более 300 слов
+IMPROVEMENTS_NUM_PREDICT = 680   # не более 250 слов
+
+# Относительная важность полей отчета при нехватке контекста
+REPORT_FIELD_WEIGHTS = {
+    "completed_tasks": 2.0,
+    "problems": 1.5,
+    "achievements": 1.0,
+    "next_week_plans": 1.0
+}
+
+# Число предложений каждого поля в автоматической выжимке (без ИИ)
+FALLBACK_SUMMARY_SENTENCES = {
+    "completed_tasks": 2,
+    "achievements": 1,
+    "problems": 1,
+    "next_week_plans": 1
+}
+
+FALLBACK_SUMMARY_LABELS = {
+    "completed_tasks": "Выполнено",
+    "achievements": "Достижения",
+    "problems": "Проблемы",
+    "next_week_plans": "Планы"
+}
+
+# Запрос считается "холодным", если Ollama потратил на загрузку модели больше этого времени
+COLD_LOAD_THRESHOLD_SECONDS = 1.0
+
+# Количество последних запросов, по которым считается статистика задержек
+LATENCY_WINDOW = 200
 
 class OllamaService:
     """Сервис для работы с Ollama API"""
     
-    def __init__(self):
-        self.base_url = settings.ollama_url
+    def __init__(self, urls: Optional[List[str]] = None):
+        self.pool = OllamaEndpointPool(urls or settings.get_ollama_urls())
         self.model = settings.ollama_model
         self.timeout = aiohttp.ClientTimeout(total=120)  # 2 минуты таймаут
+        self.prompt_builder = PromptBuilder()
+        self.router = ModelRouter(primary_model=self.model)
+        self.keep_alive = settings.ollama_keep_alive
+        
+        # Задержки запросов, раздельно для холодной и прогретой модели
+        self._latencies: Dict[str, deque] = {
+            "cold": deque(maxlen=LATENCY_WINDOW),
+            "warm": deque(maxlen=LATENCY_WINDOW)
+        }
+        self._load_durations: deque = deque(maxlen=LATENCY_WINDOW)
+        self.last_warmup_at: Optional[datetime] = None
+        self.warmup_count = 0
+        # Модель удерживается в памяти до этого времени (окно перед дедлайном)
+        self.hold_until: Optional[datetime] = None
     
-    async def _make_request(self, prompt: str) -> Optional[str]:
-        """Выполнение запроса к Ollama API"""
+    async def _request_endpoint(self, endpoint: OllamaEndpoint, path: str,
+                                payload: Optional[Dict[str, Any]] = None,
+                                timeout: Optional[aiohttp.ClientTimeout] = None
+                                ) -> Tuple[Optional[Dict[str, Any]], float, Optional[str]]:
+        """Запрос к конкретному серверу: (ответ, время, ошибка)"""
+        started = time.monotonic()
         try:
-            async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                payload = {
-                    "model": self.model,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.7,
-                        "top_p": 0.9,
-                        "max_tokens": 1000
-                    }
-                }
-                
-                logger.info(f"Отправка запроса к Ollama: {self.base_url}/api/generate")
+            async with aiohttp.ClientSession(timeout=timeout or self.timeout) as session:
+                if payload is None:
+                    request = session.get(f"{endpoint.url}{path}")
+                else:
+                    request = session.post(f"{endpoint.url}{path}", json=payload)
                 
-                async with session.post(
-                    f"{self.base_url}/api/generate",
-                    json=payload
-                ) as response:
+                async with request as response:
                     if response.status == 200:
-                        result = await response.json()
-                        return result.get('response', '').strip()
-                    else:
-                        logger.error(f"Ошибка Ollama API: {response.status} - {await response.text()}")
-                        return None
+                        return await response.json(), time.monotonic() - started, None
+                    error = f"{response.status} - {await response.text()}"
+                    logger.error(f"Ошибка Ollama API ({endpoint.url}{path}): {error}")
                         
         except asyncio.TimeoutError:
-            logger.error("Таймаут при обращении к Ollama API")
-            return None
+            error = "timeout"
+            logger.error(f"Таймаут при обращении к Ollama API ({endpoint.url}{path})")
         except aiohttp.ClientError as e:
-            logger.error(f"Ошибка соединения с Ollama: {e}")
-            return None
+            error = str(e) or e.__class__.__name__
+            logger.error(f"Ошибка соединения с Ollama ({endpoint.url}): {e}")
         except Exception as e:
-            logger.error(f"Неожиданная ошибка при работе с Ollama: {e}")
+            error = str(e) or e.__class__.__name__
+            logger.error(f"Неожиданная ошибка при работе с Ollama ({endpoint.url}): {e}")
+        
+        return None, time.monotonic() - started, error
+    
+    async def _post(self, path: str, payload: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any], float]]:
+        """POST-запрос к наименее загруженному серверу с переходом на другой при ошибке"""
+        tried: List[OllamaEndpoint] = []
+        
+        while True:
+            endpoint = self.pool.acquire(exclude=tried)
+            if endpoint is None:
+                if not tried:
+                    logger.error("Нет доступных серверов Ollama")
+                return None
+            tried.append(endpoint)
+            
+            try:
+                result, elapsed, error = await self._request_endpoint(endpoint, path, payload)
+            except asyncio.CancelledError:
+                self.pool.abandon(endpoint)
+                raise
+            
+            if result is not None:
+                self.pool.release(endpoint, success=True, latency=elapsed)
+                return result, elapsed
+            
+            self.pool.release(endpoint, success=False, error=error)
+            if len(tried) < len(self.pool.endpoints):
+                logger.warning(f"Запрос {path} переключается на другой сервер Ollama")
+    
+    async def _make_request(self, prompt: str, num_predict: int = SUMMARY_NUM_PREDICT,
+                            kind: str = RequestKind.SUMMARY, content_tokens: Optional[int] = None,
+                            low_priority: bool = False) -> Optional[str]:
+        """Выполнение запроса к Ollama API.
+        
+        kind, content_tokens и low_priority определяют выбор модели (см. ModelRouter).
+        """
+        prompt_tokens = self.prompt_builder.estimate_tokens(prompt)
+        model = self.router.select(
+            kind,
+            content_tokens if content_tokens is not None else prompt_tokens,
+            low_priority
+        )
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": False,
+            "keep_alive": self._current_keep_alive(),
+            "options": self.prompt_builder.build_options(
+                num_predict,
+                temperature=0.7,
+                top_p=0.9
+            )
+        }
+        
+        logger.info(
+            f"Отправка запроса к Ollama /api/generate: {model} "
+            f"(~{prompt_tokens} токенов промпта, num_predict={num_predict})"
+        )
+        
+        started = time.perf_counter()
+        response = await self._post("/api/generate", payload)
+        OLLAMA_REQUEST.observe(
+            time.perf_counter() - started, kind=kind, status="ok" if response is not None else "error"
+        )
+        if response is None:
+            return None
+        
+        result, elapsed = response
+        self._record_latency(elapsed, result)
+        self.router.record_latency(model, elapsed - (result.get('load_duration') or 0) / 1e9)
+        return result.get('response', '').strip()
+    
+    def _record_latency(self, elapsed: float, result: Dict[str, Any]) -> None:
+        """Учет задержки запроса с разделением на холодные и прогретые"""
+        # load_duration возвращается Ollama в наносекундах
+        load_seconds = (result.get('load_duration') or 0) / 1e9
+        kind = "cold" if load_seconds >= COLD_LOAD_THRESHOLD_SECONDS else "warm"
+        self._latencies[kind].append(elapsed)
+        if kind == "cold":
+            self._load_durations.append(load_seconds)
+            logger.info(f"Холодный запрос к Ollama: загрузка модели {load_seconds:.1f} с, всего {elapsed:.1f} с")
+    
+    @staticmethod
+    def _parse_duration(value: str) -> Optional[int]:
+        """Перевод длительности Ollama ("30m", "1h", "300") в секунды"""
+        match = re.fullmatch(r'\s*(\d+)\s*([smh]?)\s*', str(value))
+        if not match:
+            return None
+        multiplier = {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+        return int(match.group(1)) * multiplier
+    
+    def _current_keep_alive(self) -> str:
+        """keep_alive для очередного запроса.
+        
+        Каждый запрос заново отсчитывает keep_alive, поэтому внутри окна
+        перед дедлайном обычный запрос не должен сокращать удержание модели.
+        """
+        if not self.hold_until:
+            return self.keep_alive
+        
+        remaining = (self.hold_until - datetime.now()).total_seconds()
+        default = self._parse_duration(self.keep_alive)
+        if remaining <= 0 or default is None or remaining <= default:
+            return self.keep_alive
+        return f"{math.ceil(remaining / 60)}m"
+    
+    async def warm_up(self, hold_until: Optional[datetime] = None) -> bool:
+        """Предварительная загрузка модели в память Ollama.
+        
+        Запрос без промпта только загружает модель. num_ctx передается тот же,
+        что и в рабочих запросах, иначе модель будет перезагружена при первом отчете.
+        hold_until - до какого времени удерживать модель в памяти.
+        """
+        if hold_until and (not self.hold_until or hold_until > self.hold_until):
+            self.hold_until = hold_until
+        keep_alive = self._current_keep_alive()
+        
+        # Все используемые модели загружаются на каждом сервере пула
+        targets = [(endpoint, model) for endpoint in self.pool.endpoints for model in self.router.models]
+        results = await asyncio.gather(*(
+            self._request_endpoint(endpoint, "/api/generate", {
+                "model": model,
+                "keep_alive": keep_alive,
+                "options": {"num_ctx": self.prompt_builder.num_ctx}
+            })
+            for endpoint, model in targets
+        ))
+        
+        warmed = 0
+        for (endpoint, model), (result, elapsed, error) in zip(targets, results):
+            self.pool.mark_health(endpoint, result is not None, error)
+            if result is None:
+                logger.warning(f"Не удалось прогреть модель {model} на {endpoint.url}: {error}")
+                continue
+            
+            warmed += 1
+            load_seconds = (result.get('load_duration') or 0) / 1e9
+            if load_seconds >= COLD_LOAD_THRESHOLD_SECONDS:
+                self._load_durations.append(load_seconds)
+            logger.info(
+                f"Модель {model} прогрета на {endpoint.url} за {elapsed:.1f} с "
+                f"(загрузка {load_seconds:.1f} с, keep_alive={keep_alive})"
+            )
+        
+        if warmed:
+            self.last_warmup_at = datetime.now()
+            self.warmup_count += 1
+        return warmed > 0
+    
+    @staticmethod
+    def _latency_summary(values) -> Dict[str, Any]:
+        """Сводка по списку задержек"""
+        if not values:
+            return {"count": 0, "avg": None, "p95": None, "max": None}
+        ordered = sorted(values)
+        return {
+            "count": len(ordered),
+            "avg": sum(ordered) / len(ordered),
+            "p95": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+            "max": ordered[-1]
+        }
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """Метрики задержек Ollama: холодные и прогретые запросы"""
+        return {
+            "cold": self._latency_summary(self._latencies["cold"]),
+            "warm": self._latency_summary(self._latencies["warm"]),
+            "load": self._latency_summary(self._load_durations),
+            "keep_alive": self._current_keep_alive(),
+            "hold_until": self.hold_until,
+            "warmup_count": self.warmup_count,
+            "last_warmup_at": self.last_warmup_at,
+            "endpoints": self.pool.get_stats(),
+            "routing": self.router.get_stats()
+        }
+    
+    async def embed(self, text: str) -> Optional[List[float]]:
+        """Получение векторного представления текста через /api/embeddings"""
+        payload = {
+            "model": settings.ollama_embedding_model,
+            "prompt": text
+        }
+        
+        response = await self._post("/api/embeddings", payload)
+        if response is None:
             return None
+        
+        result, _ = response
+        return result.get('embedding') or None
     
     async def check_connection(self) -> bool:
-        """Проверка доступности Ollama API"""
-        try:
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
-                async with session.get(f"{self.base_url}/api/tags") as response:
-                    if response.status == 200:
-                        logger.info("Соединение с Ollama установлено")
-                        return True
-                    else:
-                        logger.warning(f"Ollama недоступен: {response.status}")
-                        return False
-        except Exception as e:
-            logger.warning(f"Не удалось подключиться к Ollama: {e}")
-            return False
+        """Проверка доступности Ollama API (хотя бы одного сервера пула)"""
+        results = await asyncio.gather(*(
+            self._request_endpoint(endpoint, "/api/tags", timeout=aiohttp.ClientTimeout(total=10))
+            for endpoint in self.pool.endpoints
+        ))
+        
+        for endpoint, (result, _, error) in zip(self.pool.endpoints, results):
+            self.pool.mark_health(endpoint, result is not None, error)
+            if result is None:
+                logger.warning(f"Ollama недоступен: {endpoint.url} ({error})")
+        
+        available = sum(1 for result, _, _ in results if result is not None)
+        if available:
+            logger.info(f"Соединение с Ollama установлено ({available} из {len(results)} серверов)")
+        return available > 0
     
-    async def process_report(self, report: WeeklyReport) -> WeeklyReport:
+    async def process_report(self, report: WeeklyReport, low_priority: bool = False) -> WeeklyReport:
         """Обработка отчета через Ollama"""
         logger.info(f"Начало обработки отчета пользователя {report.user_id}")
         
         # Создаем промпт для анализа отчета
         analysis_prompt = self._create_analysis_prompt(report)
         
+        # Объем самого отчета определяет, нужна ли для анализа основная модель
+        content_tokens = sum(
+            self.prompt_builder.estimate_tokens(value)
+            for value in self._report_fields(report).values()
+        )
+        
         # Получаем анализ от ИИ
-        ai_analysis = await self._make_request(analysis_prompt)
+        ai_analysis = await self._make_request(
+            analysis_prompt, ANALYSIS_NUM_PREDICT,
+            kind=RequestKind.ANALYSIS, content_tokens=content_tokens, low_priority=low_priority
+        )
         
         if ai_analysis:
             # Создаем промпт для краткой сводки
             summary_prompt = self._create_summary_prompt(report)
-            ai_summary = await self._make_request(summary_prompt)
+            ai_summary = await self._make_request(
+                summary_prompt, SUMMARY_NUM_PREDICT,
+                kind=RequestKind.SUMMARY, low_priority=low_priority
+            )
             
             # Обновляем отчет
             report.mark_as_processed(
-                summary=ai_summary or "Краткая сводка недоступна",
+                summary=ai_summary or self.build_fallback_summary(report),
                 analysis=ai_analysis
             )
             
             logger.info(f"Отчет пользователя {report.user_id} успешно обработан")
         else:
-            logger.warning(f"Не удалось обработать отчет пользователя {report.user_id}")
+            # Отчет не помечается обработанным: очередь ИИ повторит анализ
+            # и заменит автоматическую выжимку
+            report.summary = self.build_fallback_summary(report)
+            logger.warning(f"Не удалось обработать отчет пользователя {report.user_id}, "
+                           f"использована автоматическая выжимка")
         
         return report
     
+    def build_fallback_summary(self, report: WeeklyReport) -> str:
+        """Автоматическая выжимка отчета без ИИ (при недоступности или перегрузке Ollama)"""
+        lines = []
+        for name, value in self._report_fields(report).items():
+            if not value:
+                continue
+            extract = extractive_summary(value, max_sentences=FALLBACK_SUMMARY_SENTENCES[name], max_length=300)
+            if extract:
+                lines.append(f"{FALLBACK_SUMMARY_LABELS[name]}: {extract}")
+        return "\n".join(lines)
+    
+    @staticmethod
+    def _report_fields(report: WeeklyReport) -> Dict[str, Optional[str]]:
+        """Текстовые поля отчета, между которыми делится бюджет промпта"""
+        return {
+            "completed_tasks": report.completed_tasks,
+            "achievements": report.achievements,
+            "problems": report.problems,
+            "next_week_plans": report.next_week_plans
+        }
+    
     def _create_analysis_prompt(self, report: WeeklyReport) -> str:
         """Создание промпта для анализа отчета"""
-        return f"""Проанализируй еженедельный отчет сотрудника предприятия АО ЭМЗ "ФИРМА СЭЛМА".
+        template = """Проанализируй еженедельный отчет сотрудника предприятия АО ЭМЗ "ФИРМА СЭЛМА".
 
 Информация о сотруднике:
-- ФИО: {report.full_name}
-- Отдел: {report.department or 'Не указан'}
-- Должность: {report.position or 'Не указана'}
-- Период: {report.week_start.strftime('%d.%m.%Y')} - {report.week_end.strftime('%d.%m.%Y')}
+- ФИО: {full_name}
+- Отдел: {department}
+- Должность: {position}
+- Период: {week_start} - {week_end}
 
 Выполненные задачи:
-{report.completed_tasks}
+{completed_tasks}
 
 Достижения:
-{report.achievements}
+{achievements}
 
 Проблемы:
-{report.problems}
+{problems}
 
 Планы на следующую неделю:
-{report.next_week_plans}
+{next_week_plans}
 
 Пожалуйста, проведи анализ отчета и предоставь:
 1. Оценку продуктивности сотрудника (высокая/средняя/низкая)
@@ -124,24 +405,35 @@ class OllamaService:
 5. Общие рекомендации для сотрудника
 
 Ответ должен быть структурированным, профессиональным и конструктивным. Объем ответа - не более 500 слов."""
+        return self.prompt_builder.fit_template(
+            template,
+            self._report_fields(report),
+            ANALYSIS_NUM_PREDICT,
+            weights=REPORT_FIELD_WEIGHTS,
+            full_name=report.full_name,
+            department=report.department or 'Не указан',
+            position=report.position or 'Не указана',
+            week_start=report.week_start.strftime('%d.%m.%Y'),
+            week_end=report.week_end.strftime('%d.%m.%Y')
+        )
     
     def _create_summary_prompt(self, report: WeeklyReport) -> str:
         """Создание промпта для краткой сводки"""
-        return f"""Создай краткую сводку еженедельного отчета сотрудника для руководства.
+        template = """Создай краткую сводку еженедельного отчета сотрудника для руководства.
 
-Отчет сотрудника {report.full_name} ({report.department or 'отдел не указан'}) за {report.week_start.strftime('%d.%m.%Y')} - {report.week_end.strftime('%d.%m.%Y')}:
+Отчет сотрудника {full_name} ({department}) за {week_start} - {week_end}:
 
 Выполненные задачи:
-{report.completed_tasks}
+{completed_tasks}
 
 Достижения:
-{report.achievements}
+{achievements}
 
 Проблемы:
-{report.problems}
+{problems}
 
 Планы на следующую неделю:
-{report.next_week_plans}
+{next_week_plans}
 
 Создай краткую сводку (не более 200 слов), которая включает:
 1. Основные выполненные задачи
@@ -150,27 +442,26 @@ class OllamaService:
 4. Главные планы на следующую неделю
 
 Сводка должна быть информативной и подходящей для руководства."""
+        return self.prompt_builder.fit_template(
+            template,
+            self._report_fields(report),
+            SUMMARY_NUM_PREDICT,
+            weights=REPORT_FIELD_WEIGHTS,
+            full_name=report.full_name,
+            department=report.department or 'отдел не указан',
+            week_start=report.week_start.strftime('%d.%m.%Y'),
+            week_end=report.week_end.strftime('%d.%m.%Y')
+        )
     
     async def generate_weekly_summary(self, reports: list[WeeklyReport]) -> str:
         """Генерация общей сводки по всем отчетам за неделю"""
         if not reports:
             return "Отчеты за неделю отсутствуют."
         
-        # Подготавливаем данные для анализа
-        reports_data = []
-        for report in reports:
-            reports_data.append(f"""
-Сотрудник: {report.full_name} ({report.department or 'отдел не указан'})
-Задачи: {report.completed_tasks[:200]}...
-Достижения: {report.achievements[:100]}...
-Проблемы: {report.problems[:100]}...
-""")
-        
-        prompt = f"""Проанализируй еженедельные отчеты сотрудников АО ЭМЗ "ФИРМА СЭЛМА" и создай общую сводку для руководства.
-
-Отчеты ({len(reports)} шт.):
-{''.join(reports_data[:10])}  # Ограничиваем количество для промпта
+        template = """Проанализируй еженедельные отчеты сотрудников АО ЭМЗ "ФИРМА СЭЛМА" и создай общую сводку для руководства.
 
+Отчеты ({total} шт.):
+{reports_data}
 Создай общую сводку, включающую:
 1. Общую статистику (количество отчетов, отделы)
 2. Основные достижения компании за неделю
@@ -179,8 +470,56 @@ class OllamaService:
 5. Прогноз на следующую неделю
 
 Объем сводки - не более 400 слов. Стиль - деловой, структурированный."""
+        record_template = """
+Сотрудник: {full_name} ({department})
+Задачи: {completed_tasks}
+Достижения: {achievements}
+Проблемы: {problems}
+"""
+        
+        # Бюджет делится между отчетами: короткие отчеты попадают в промпт
+        # целиком, длинные сокращаются, а не обрезаются по фиксированной длине
+        records = [
+            {
+                "completed_tasks": report.completed_tasks,
+                "achievements": report.achievements,
+                "problems": report.problems
+            }
+            for report in reports
+        ]
+        budget = (
+            self.prompt_builder.input_budget(WEEKLY_SUMMARY_NUM_PREDICT) -
+            self.prompt_builder.estimate_tokens(template.format(total=len(reports), reports_data=""))
+        )
+        overhead = max(
+            self.prompt_builder.estimate_tokens(
+                record_template.format(
+                    full_name=report.full_name,
+                    department=report.department or 'отдел не указан',
+                    completed_tasks="", achievements="", problems=""
+                )
+            )
+            for report in reports
+        )
+        fitted = self.prompt_builder.fit_records(
+            records, budget, weights=REPORT_FIELD_WEIGHTS, overhead_per_record=overhead
+        )
+        
+        reports_data = [
+            record_template.format(
+                full_name=report.full_name,
+                department=report.department or 'отдел не указан',
+                **fields
+            )
+            for report, fields in zip(reports, fitted)
+        ]
+        if len(fitted) < len(reports):
+            logger.warning(f"В сводку вошли {len(fitted)} из {len(reports)} отчетов из-за размера контекста")
+            reports_data.append(f"\n...и еще {len(reports) - len(fitted)} отчетов, не поместившихся в сводку.\n")
         
-        result = await self._make_request(prompt)
+        prompt = template.format(total=len(reports), reports_data=''.join(reports_data))
+        
+        result = await self._make_request(prompt, WEEKLY_SUMMARY_NUM_PREDICT, kind=RequestKind.WEEKLY_SUMMARY)
         return result or "Не удалось сгенерировать общую сводку."
     
     async def analyze_employee_performance(self, reports: list[WeeklyReport], user_id: int) -> str:
@@ -192,21 +531,12 @@ class OllamaService:
         
         # Сортируем по дате
         user_reports.sort(key=lambda x: x.week_start)
+        recent_reports = user_reports[-4:]  # Последние 4 недели
         
-        reports_summary = []
-        for i, report in enumerate(user_reports[-4:], 1):  # Последние 4 недели
-            reports_summary.append(f"""
-Неделя {i} ({report.week_start.strftime('%d.%m.%Y')} - {report.week_end.strftime('%d.%m.%Y')}):
-Задачи: {report.completed_tasks[:150]}...
-Достижения: {report.achievements[:100]}...
-Проблемы: {report.problems[:100]}...
-""")
-        
-        prompt = f"""Проанализируй динамику работы сотрудника {user_reports[0].full_name} за последние недели.
+        template = """Проанализируй динамику работы сотрудника {full_name} за последние недели.
 
 Отчеты сотрудника:
-{''.join(reports_summary)}
-
+{reports_summary}
 Проведи анализ и предоставь:
 1. Динамику производительности (растет/стабильна/снижается)
 2. Сильные стороны сотрудника
@@ -215,18 +545,61 @@ class OllamaService:
 5. Рекомендации для развития
 
 Объем анализа - не более 300 слов."""
+        week_template = """
+Неделя {index} ({week_start} - {week_end}):
+Задачи: {completed_tasks}
+Достижения: {achievements}
+Проблемы: {problems}
+"""
+        
+        records = [
+            {
+                "completed_tasks": report.completed_tasks,
+                "achievements": report.achievements,
+                "problems": report.problems
+            }
+            for report in recent_reports
+        ]
+        budget = (
+            self.prompt_builder.input_budget(PERFORMANCE_NUM_PREDICT) -
+            self.prompt_builder.estimate_tokens(
+                template.format(full_name=user_reports[0].full_name, reports_summary="")
+            )
+        )
+        overhead = self.prompt_builder.estimate_tokens(
+            week_template.format(index=0, week_start="00.00.0000", week_end="00.00.0000",
+                                 completed_tasks="", achievements="", problems="")
+        )
+        fitted = self.prompt_builder.fit_records(
+            records, budget, weights=REPORT_FIELD_WEIGHTS, overhead_per_record=overhead
+        )
+        
+        reports_summary = [
+            week_template.format(
+                index=index,
+                week_start=report.week_start.strftime('%d.%m.%Y'),
+                week_end=report.week_end.strftime('%d.%m.%Y'),
+                **fields
+            )
+            for index, (report, fields) in enumerate(zip(recent_reports, fitted), 1)
+        ]
+        
+        prompt = template.format(
+            full_name=user_reports[0].full_name,
+            reports_summary=''.join(reports_summary)
+        )
         
-        result = await self._make_request(prompt)
+        result = await self._make_request(prompt, PERFORMANCE_NUM_PREDICT, kind=RequestKind.PERFORMANCE)
         return result or "Не удалось проанализировать производительность сотрудника."
     
     async def suggest_improvements(self, report: WeeklyReport) -> str:
         """Предложения по улучшению для сотрудника"""
-        prompt = f"""На основе отчета сотрудника {report.full_name}, предложи конкретные рекомендации для повышения эффективности работы.
+        template = """На основе отчета сотрудника {full_name}, предложи конкретные рекомендации для повышения эффективности работы.
 
 Текущий отчет:
-Задачи: {report.completed_tasks}
-Проблемы: {report.problems}
-Планы: {report.next_week_plans}
+Задачи: {completed_tasks}
+Проблемы: {problems}
+Планы: {next_week_plans}
 
 Предоставь:
 1. 3-5 конкретных рекомендаций для улучшения работы
@@ -235,8 +608,19 @@ class OllamaService:
 4. Рекомендации по профессиональному развитию
 
 Ответ должен быть конструктивным и практичным. Объем - не более 250 слов."""
+        prompt = self.prompt_builder.fit_template(
+            template,
+            {
+                "completed_tasks": report.completed_tasks,
+                "problems": report.problems,
+                "next_week_plans": report.next_week_plans
+            },
+            IMPROVEMENTS_NUM_PREDICT,
+            weights=REPORT_FIELD_WEIGHTS,
+            full_name=report.full_name
+        )
         
-        result = await self._make_request(prompt)
+        result = await self._make_request(prompt, IMPROVEMENTS_NUM_PREDICT, kind=RequestKind.IMPROVEMENTS)
         return result or "Рекомендации временно недоступны."
     
     async def close(self):
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+Очередь исходящих сообщений Telegram (outbox).
+Сообщение сначала записывается в таблицу outbox_messages с ключом
+идемпотентности, затем фоновые обработчики отправляют его в пределах
+лимитов Telegram. Интерактивные сообщения (публикация отчета в группе,
+уведомления администраторов) отправляются раньше массовых рассылок.
+Неудачные отправки повторяются с нарастающей паузой,
+а неотправленные сообщения продолжают рассылаться после перезапуска
+бота. Повторная постановка сообщения с тем же ключом не приводит
+к повторной отправке.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import asyncio
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Tuple
+
+from loguru import logger
+
+from config import settings
+from .telegram_service import SEND_RETRY
+
+
+class OutboxStatus:
+    """Статусы исходящих сообщений"""
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+
+
+class OutboxPriority:
+    """Очередность отправки: меньшее значение уходит раньше"""
+    INTERACTIVE = 0   # ответ ждет пользователь или администратор
+    BULK = 1          # массовые рассылки (напоминания)
+
+
+# Пауза перед повторной отправкой: 30 с, 1 мин, 2 мин... (не более 30 минут)
+OUTBOX_RETRY_BASE_SECONDS = 30
+OUTBOX_RETRY_MAX_SECONDS = 1800
+
+
+class MessageOutbox:
+    """Долговременная очередь исходящих сообщений"""
+
+    def __init__(self, db_path: Path, telegram_service, workers: Optional[int] = None,
+                 max_attempts: Optional[int] = None):
+        self.db_path = Path(db_path)
+        self.telegram_service = telegram_service
+        self.workers = workers or settings.telegram_bulk_concurrency
+        self.max_attempts = max_attempts or settings.outbox_max_attempts
+        self.poll_interval = 10
+
+        self.is_running = False
+        self._worker_tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        # Ожидающие результата отправки: ключ идемпотентности -> future
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+
+        self._init_table()
+
+    def _init_table(self):
+        """Создание таблицы исходящих сообщений"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS outbox_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    idempotency_key TEXT NOT NULL UNIQUE,
+                    chat_id INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    options TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    message_id INTEGER,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    sent_at TIMESTAMP
+                )
+            """)
+            # Таблица, созданная до появления приоритетов
+            cursor.execute("PRAGMA table_info(outbox_messages)")
+            if 'priority' not in [row[1] for row in cursor.fetchall()]:
+                cursor.execute("ALTER TABLE outbox_messages ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+            cursor.execute("DROP INDEX IF EXISTS idx_outbox_status")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_outbox_claim ON outbox_messages (status, priority, next_attempt_at)"
+            )
+            conn.commit()
+
+    async def start(self):
+        """Запуск фоновой отправки"""
+        if self.is_running:
+            logger.warning("Очередь исходящих сообщений уже запущена")
+            return
+
+        # Сообщения, отправка которых прервана остановкой бота, отправляются повторно
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE outbox_messages SET status = ? WHERE status = ?",
+                (OutboxStatus.PENDING, OutboxStatus.SENDING)
+            )
+            conn.commit()
+
+        pending = self.get_stats()[OutboxStatus.PENDING]
+        if pending:
+            logger.info(f"Возобновлена отправка {pending} сообщений из очереди")
+
+        self.is_running = True
+        self._worker_tasks = [
+            asyncio.create_task(self._worker_loop(index)) for index in range(self.workers)
+        ]
+        logger.info(f"Очередь исходящих сообщений запущена: {self.workers} обработчиков")
+
+    async def stop(self):
+        """Остановка фоновой отправки (неотправленное останется в очереди)"""
+        self.is_running = False
+        for task in self._worker_tasks:
+            task.cancel()
+        for task in self._worker_tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._worker_tasks = []
+        logger.info("Очередь исходящих сообщений остановлена")
+
+    def enqueue_many(self, messages: List[Tuple[str, int, str, Dict[str, Any]]],
+                     priority: int = OutboxPriority.INTERACTIVE) -> int:
+        """Постановка сообщений в очередь одной транзакцией.
+
+        messages - кортежи (ключ, chat_id, текст, параметры отправки).
+        Возвращает число новых сообщений (уже известные ключи пропускаются).
+        """
+        now = datetime.now()
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT OR IGNORE INTO outbox_messages
+                    (idempotency_key, chat_id, text, options, priority, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [
+                (key, int(chat_id), text, json.dumps(options) if options else None, priority, now, now)
+                for key, chat_id, text, options in messages
+            ])
+            conn.commit()
+            added = cursor.rowcount
+
+        if added:
+            self._wakeup.set()
+        return added
+
+    def enqueue(self, key: str, chat_id: int, text: str,
+                priority: int = OutboxPriority.INTERACTIVE, **options) -> bool:
+        """Постановка сообщения в очередь; False, если сообщение с таким ключом уже есть"""
+        return self.enqueue_many([(key, chat_id, text, options)], priority) > 0
+
+    def _get_result(self, key: str) -> Optional[Tuple[str, Optional[int]]]:
+        """Итог отправки сообщения, если она завершена"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT status, message_id FROM outbox_messages WHERE idempotency_key = ?", (key,)
+            )
+            row = cursor.fetchone()
+        if row and row[0] in (OutboxStatus.SENT, OutboxStatus.FAILED):
+            return row[0], row[1]
+        return None
+
+    async def wait(self, key: str, timeout: Optional[float] = None) -> Tuple[str, Optional[int]]:
+        """Ожидание отправки сообщения: (статус, ID сообщения в Telegram)"""
+        # Future регистрируется до проверки базы, чтобы не пропустить завершение
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, []).append(future)
+        try:
+            result = self._get_result(key)
+            if result:
+                return result
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return OutboxStatus.PENDING, None
+        finally:
+            waiters = self._waiters.get(key, [])
+            if future in waiters:
+                waiters.remove(future)
+            if not waiters:
+                self._waiters.pop(key, None)
+
+    async def send(self, key: str, chat_id: int, text: str, timeout: Optional[float] = None,
+                   priority: int = OutboxPriority.INTERACTIVE, **options) -> Tuple[str, Optional[int]]:
+        """Постановка сообщения в очередь и ожидание его отправки"""
+        self.enqueue(key, chat_id, text, priority, **options)
+        return await self.wait(key, timeout)
+
+    def _resolve(self, key: str, status: str, message_id: Optional[int]) -> None:
+        for future in self._waiters.get(key, []):
+            if not future.done():
+                future.set_result((status, message_id))
+
+    def _claim_next(self) -> Optional[Dict[str, Any]]:
+        """Атомарный захват следующего готового к отправке сообщения"""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT * FROM outbox_messages
+                WHERE status = ? AND next_attempt_at <= ?
+                ORDER BY priority, next_attempt_at, id
+                LIMIT 1
+            """, (OutboxStatus.PENDING, datetime.now()))
+            row = cursor.fetchone()
+            if not row:
+                return None
+
+            cursor.execute("""
+                UPDATE outbox_messages SET status = ?, attempts = attempts + 1
+                WHERE id = ? AND status = ?
+            """, (OutboxStatus.SENDING, row['id'], OutboxStatus.PENDING))
+            conn.commit()
+
+            if cursor.rowcount == 0:
+                return None
+
+            message = dict(row)
+            message['attempts'] += 1
+            return message
+
+    def _finish(self, message_id: int, status: str, telegram_message_id: Optional[int] = None,
+                error: Optional[str] = None, retry_at: Optional[datetime] = None):
+        """Фиксация результата отправки"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE outbox_messages
+                SET status = ?, message_id = ?, last_error = ?,
+                    next_attempt_at = COALESCE(?, next_attempt_at),
+                    sent_at = CASE WHEN ? = 'sent' THEN ? ELSE sent_at END
+                WHERE id = ?
+            """, (status, telegram_message_id, error, retry_at, status, datetime.now(), message_id))
+            conn.commit()
+
+    async def _worker_loop(self, index: int):
+        """Цикл фонового обработчика"""
+        while self.is_running:
+            try:
+                message = self._claim_next()
+
+                if not message:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                await self._deliver(message)
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике очереди сообщений #{index}: {e}")
+                await asyncio.sleep(5)
+
+    async def _deliver(self, message: Dict[str, Any]):
+        """Отправка сообщения из очереди"""
+        options = json.loads(message['options']) if message['options'] else {}
+        try:
+            status, telegram_message_id = await self.telegram_service.deliver_message(
+                message['chat_id'], message['text'], **options
+            )
+        except asyncio.CancelledError:
+            # Сообщение будет отправлено после перезапуска
+            self._finish(message['id'], OutboxStatus.PENDING, error="interrupted")
+            raise
+
+        key = message['idempotency_key']
+        if status == OutboxStatus.SENT:
+            self._finish(message['id'], OutboxStatus.SENT, telegram_message_id=telegram_message_id)
+            self._resolve(key, OutboxStatus.SENT, telegram_message_id)
+            return
+
+        # Заблокировавшим бота и отклоненным сообщениям повтор не поможет
+        if status != SEND_RETRY or message['attempts'] >= self.max_attempts:
+            self._finish(message['id'], OutboxStatus.FAILED, error=status)
+            # Ожидающим сообщается причина (например, бот заблокирован)
+            self._resolve(key, OutboxStatus.FAILED if status == SEND_RETRY else status, None)
+            logger.warning(f"Сообщение {key} для {message['chat_id']} не отправлено ({status})")
+            return
+
+        delay = min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (message['attempts'] - 1), OUTBOX_RETRY_MAX_SECONDS)
+        retry_at = datetime.now() + timedelta(seconds=delay)
+        self._finish(message['id'], OutboxStatus.PENDING, error=status, retry_at=retry_at)
+        logger.info(f"Сообщение {key} будет отправлено повторно в {retry_at.strftime('%H:%M:%S')}")
+
+    def get_stats(self) -> Dict[str, int]:
+        """Статистика очереди по статусам"""
+        stats = {
+            OutboxStatus.PENDING: 0,
+            OutboxStatus.SENDING: 0,
+            OutboxStatus.SENT: 0,
+            OutboxStatus.FAILED: 0
+        }
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT status, COUNT(*) FROM outbox_messages GROUP BY status")
+            for status, count in cursor.fetchall():
+                stats[status] = count
+        return stats
+
+    def cleanup(self, max_age_days: int = 7) -> int:
+        """Удаление старых завершенных сообщений"""
+        cutoff = datetime.now() - timedelta(days=max_age_days)
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "DELETE FROM outbox_messages WHERE status IN (?, ?) AND created_at < ?",
+                (OutboxStatus.SENT, OutboxStatus.FAILED, cutoff)
+            )
+            conn.commit()
+            return cursor.rowcount
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Построитель промптов для Ollama с учетом бюджета токенов.
+Оценивает размер текста в токенах, распределяет бюджет контекста
+между полями отчетов и аккуратно сокращает текст, чтобы промпт
+гарантированно помещался в окно контекста модели.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import math
+import re
+from typing import Dict, List, Optional, Any
+
+from config import settings
+
+
+# Средняя длина токена в символах (эмпирически для SentencePiece-токенизаторов)
+CYRILLIC_CHARS_PER_TOKEN = 2.6
+LATIN_CHARS_PER_TOKEN = 3.8
+OTHER_CHARS_PER_TOKEN = 1.5
+
+TRUNCATION_MARK = "…"
+
+
+class PromptBuilder:
+    """Сборка промптов с распределением бюджета токенов"""
+
+    def __init__(self, num_ctx: Optional[int] = None, reserve_tokens: Optional[int] = None):
+        # Размер контекста фиксирован: смена num_ctx между запросами
+        # заставляет Ollama перезагружать модель
+        self.num_ctx = num_ctx or settings.ollama_num_ctx
+        self.reserve_tokens = reserve_tokens if reserve_tokens is not None else settings.ollama_prompt_reserve_tokens
+
+    @staticmethod
+    def estimate_tokens(text: Optional[str]) -> int:
+        """Приблизительная оценка количества токенов в тексте"""
+        if not text:
+            return 0
+
+        cyrillic = len(re.findall(r'[а-яА-ЯёЁ]', text))
+        latin = len(re.findall(r'[a-zA-Z0-9]', text))
+        spaces = text.count(' ')
+        other = len(text) - cyrillic - latin - spaces
+
+        estimate = (
+            cyrillic / CYRILLIC_CHARS_PER_TOKEN +
+            latin / LATIN_CHARS_PER_TOKEN +
+            other / OTHER_CHARS_PER_TOKEN
+        )
+        return int(math.ceil(estimate))
+
+    def input_budget(self, num_predict: int) -> int:
+        """Количество токенов, доступных для промпта"""
+        return max(self.num_ctx - num_predict - self.reserve_tokens, 0)
+
+    def build_options(self, num_predict: int, **extra: Any) -> Dict[str, Any]:
+        """Формирование параметров генерации для Ollama"""
+        options = {
+            "num_ctx": self.num_ctx,
+            "num_predict": num_predict
+        }
+        options.update(extra)
+        return options
+
+    def allocate_budget(self, sizes: Dict[str, int], budget: int,
+                        weights: Optional[Dict[str, float]] = None) -> Dict[str, int]:
+        """Распределение бюджета между частями (water-filling).
+
+        Части, которые помещаются в свою долю, получают ровно свой размер,
+        а высвободившийся остаток делится между оставшимися пропорционально весам.
+        """
+        weights = weights or {}
+        allocation: Dict[str, int] = {}
+        remaining = {key: size for key, size in sizes.items() if size > 0}
+        left = max(budget, 0)
+
+        for key, size in sizes.items():
+            if size <= 0:
+                allocation[key] = 0
+
+        while remaining:
+            total_weight = sum(weights.get(key, 1.0) for key in remaining)
+            shares = {key: left * weights.get(key, 1.0) / total_weight for key in remaining}
+            fitted = [key for key in remaining if remaining[key] <= shares[key]]
+
+            if not fitted:
+                for key in remaining:
+                    allocation[key] = int(shares[key])
+                break
+
+            for key in fitted:
+                allocation[key] = remaining[key]
+                left -= remaining[key]
+                del remaining[key]
+
+        return allocation
+
+    def truncate_to_tokens(self, text: Optional[str], max_tokens: int) -> str:
+        """Сокращение текста до бюджета с сохранением целых строк и предложений"""
+        if not text:
+            return ""
+        if self.estimate_tokens(text) <= max_tokens:
+            return text
+        if max_tokens <= 0:
+            return TRUNCATION_MARK
+
+        limit = max_tokens - self.estimate_tokens(TRUNCATION_MARK)
+
+        # Сначала стараемся сохранить целые строки (пункты списков),
+        # затем предложения, затем слова
+        for pattern in (r'(?<=\n)', r'(?<=[.!?;])\s+', r'\s+'):
+            pieces = [piece for piece in re.split(pattern, text) if piece]
+            kept = self._take_pieces(pieces, limit, joiner='' if pattern == r'(?<=\n)' else ' ')
+            if kept:
+                return kept.rstrip() + TRUNCATION_MARK
+
+        # Одно очень длинное слово - режем посимвольно
+        ratio = limit / max(self.estimate_tokens(text), 1)
+        return text[:max(int(len(text) * ratio), 1)] + TRUNCATION_MARK
+
+    def _take_pieces(self, pieces: List[str], limit: int, joiner: str) -> str:
+        """Набор фрагментов текста, пока они помещаются в лимит"""
+        result = ""
+        for piece in pieces:
+            candidate = f"{result}{joiner}{piece}" if result else piece
+            if self.estimate_tokens(candidate) > limit:
+                break
+            result = candidate
+        return result
+
+    def fit_fields(self, fields: Dict[str, Optional[str]], budget: int,
+                   weights: Optional[Dict[str, float]] = None) -> Dict[str, str]:
+        """Вписывание полей отчета в общий бюджет токенов"""
+        sizes = {key: self.estimate_tokens(value) for key, value in fields.items()}
+        allocation = self.allocate_budget(sizes, budget, weights)
+        return {
+            key: self.truncate_to_tokens(value or "", allocation.get(key, 0))
+            for key, value in fields.items()
+        }
+
+    def fit_template(self, template: str, fields: Dict[str, Optional[str]], num_predict: int,
+                     weights: Optional[Dict[str, float]] = None, **static: Any) -> str:
+        """Заполнение шаблона так, чтобы промпт помещался в контекст.
+
+        Статические подстановки (ФИО, отдел, даты) вставляются целиком,
+        а бюджет, оставшийся после шаблона, делится между полями.
+        """
+        skeleton = template.format(**static, **{key: "" for key in fields})
+        budget = self.input_budget(num_predict) - self.estimate_tokens(skeleton)
+        fitted = self.fit_fields(fields, budget, weights)
+        return template.format(**static, **fitted)
+
+    def fit_records(self, records: List[Dict[str, Optional[str]]], budget: int,
+                    weights: Optional[Dict[str, float]] = None,
+                    min_tokens_per_record: int = 40,
+                    overhead_per_record: int = 0) -> List[Dict[str, str]]:
+        """Распределение бюджета между несколькими отчетами.
+
+        Если на каждый отчет приходится меньше min_tokens_per_record токенов,
+        лишние отчеты отбрасываются (в конце списка), чтобы оставшиеся
+        сохранили осмысленное содержание. overhead_per_record - стоимость
+        обрамления одного отчета в шаблоне (подписи полей, переносы строк).
+        """
+        if not records or budget <= 0:
+            return []
+
+        per_record = max(min_tokens_per_record + overhead_per_record, 1)
+        max_records = max(budget // per_record, 1)
+        records = records[:max_records]
+        budget -= overhead_per_record * len(records)
+
+        record_sizes = {
+            str(index): sum(self.estimate_tokens(value) for value in record.values())
+            for index, record in enumerate(records)
+        }
+        allocation = self.allocate_budget(record_sizes, budget)
+
+        return [
+            self.fit_fields(record, allocation.get(str(index), 0), weights)
+            for index, record in enumerate(records)
+        ]
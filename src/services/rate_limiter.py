@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Ограничение частоты отправки сообщений в Telegram.
+Глобальный лимит бота (около 30 сообщений в секунду) соблюдается
+алгоритмом "корзины токенов", лимит на отдельный чат - минимальным
+интервалом между сообщениями. Ответ RetryAfter приостанавливает
+отправку для всего бота на указанное Telegram время.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import asyncio
+import time
+from typing import Dict, Optional, Any
+
+from loguru import logger
+
+from config import settings
+
+# Интервалы между сообщениями в один чат: личные чаты - около 1 в секунду,
+# группы - не более 20 в минуту
+PRIVATE_CHAT_INTERVAL_SECONDS = 1.0
+GROUP_CHAT_INTERVAL_SECONDS = 3.0
+
+# При таком числе отслеживаемых чатов устаревшие записи удаляются
+CHAT_SLOTS_CLEANUP_SIZE = 5000
+
+
+class TokenBucket:
+    """Корзина токенов: не более rate операций в секунду с допустимым всплеском capacity"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        """Ожидание свободного токена"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Приостановка выдачи токенов (например, по ответу RetryAfter)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        # После паузы корзина начинает с нуля, чтобы не было всплеска
+        self.tokens = 0
+        self.updated_at = self.paused_until
+
+
+class TelegramRateLimiter:
+    """Глобальный лимит отправки и лимиты отдельных чатов"""
+
+    def __init__(self, rate_per_second: Optional[float] = None):
+        self.bucket = TokenBucket(rate_per_second or settings.telegram_rate_limit_per_second)
+        self._chat_slots: Dict[int, float] = {}
+        self.stats = {"acquired": 0, "retry_after": 0, "waited_seconds": 0.0}
+
+    @staticmethod
+    def _chat_interval(chat_id: int) -> float:
+        # Идентификаторы групп и каналов отрицательные
+        return GROUP_CHAT_INTERVAL_SECONDS if int(chat_id) < 0 else PRIVATE_CHAT_INTERVAL_SECONDS
+
+    def _reserve_chat_slot(self, chat_id: int) -> float:
+        """Резервирование времени отправки в чат; возвращает необходимую задержку"""
+        now = time.monotonic()
+        if len(self._chat_slots) > CHAT_SLOTS_CLEANUP_SIZE:
+            self._chat_slots = {key: slot for key, slot in self._chat_slots.items() if slot > now}
+
+        slot = max(now, self._chat_slots.get(chat_id, 0.0))
+        self._chat_slots[chat_id] = slot + self._chat_interval(chat_id)
+        return slot - now
+
+    async def acquire(self, chat_id: int) -> None:
+        """Ожидание разрешения на отправку сообщения в чат"""
+        started = time.monotonic()
+        delay = self._reserve_chat_slot(chat_id)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self.bucket.acquire()
+
+        self.stats["acquired"] += 1
+        self.stats["waited_seconds"] += time.monotonic() - started
+
+    def retry_after(self, seconds: float) -> None:
+        """Telegram сообщил о превышении лимита: пауза для всех отправок бота"""
+        self.stats["retry_after"] += 1
+        logger.warning(f"Превышен лимит Telegram, отправка приостановлена на {seconds} с")
+        self.bucket.pause(seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика ограничителя"""
+        return {
+            "rate_per_second": self.bucket.rate,
+            "acquired": self.stats["acquired"],
+            "retry_after": self.stats["retry_after"],
+            "avg_wait": self.stats["waited_seconds"] / self.stats["acquired"] if self.stats["acquired"] else 0.0
+        }
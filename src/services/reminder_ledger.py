@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Журнал отправленных напоминаний.
+Каждое автоматическое напоминание записывается в таблицу reminder_ledger
+с ключом (сотрудник, неделя, слот рассылки) до отправки. Запись
+захватывается атомарно, поэтому при перезапуске бота в окне рассылки
+или при двух одновременно запущенных экземплярах напоминание уходит
+один раз, а прерванная рассылка продолжается только для тех, кому
+напоминание еще не отправлено.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import sqlite3
+import uuid
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Any, Iterable
+
+from loguru import logger
+
+
+class LedgerStatus:
+    """Статусы записей журнала напоминаний"""
+    CLAIMED = "claimed"
+    SENT = "sent"
+    FAILED = "failed"
+    SKIPPED = "skipped"     # сотрудник сдал отчет до досылки прерванной рассылки
+
+
+# Через сколько захваченное, но не подтвержденное напоминание
+# считается прерванным (экземпляр бота остановился во время рассылки)
+CLAIM_LEASE = timedelta(minutes=10)
+
+
+class ReminderLedger:
+    """Учет отправки напоминаний по сотрудникам, неделям и слотам рассылки"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._init_table()
+
+    def _init_table(self):
+        """Создание таблицы журнала напоминаний"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS reminder_ledger (
+                    user_id INTEGER NOT NULL,
+                    week_start DATE NOT NULL,
+                    slot TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'claimed',
+                    claim_token TEXT,
+                    claimed_at TIMESTAMP,
+                    sent_at TIMESTAMP,
+                    PRIMARY KEY (user_id, week_start, slot)
+                )
+            """)
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_reminder_ledger_status ON reminder_ledger (status, claimed_at)"
+            )
+            conn.commit()
+
+    def claim(self, week_start: date, slot: str, user_ids: Iterable[int]) -> List[int]:
+        """Захват напоминаний для отправки.
+
+        Возвращает сотрудников, которым напоминание можно отправлять:
+        новых для этого слота и тех, чей прошлый захват истек без
+        подтверждения. Отправленные и захваченные другим экземпляром
+        напоминания пропускаются.
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return []
+
+        token = uuid.uuid4().hex
+        now = datetime.now()
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT OR IGNORE INTO reminder_ledger (user_id, week_start, slot, status, claim_token, claimed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [(user_id, week_start, slot, LedgerStatus.CLAIMED, token, now) for user_id in user_ids])
+            cursor.executemany("""
+                UPDATE reminder_ledger SET claim_token = ?, claimed_at = ?
+                WHERE user_id = ? AND week_start = ? AND slot = ? AND status = ? AND claimed_at < ?
+            """, [(token, now, user_id, week_start, slot, LedgerStatus.CLAIMED, now - CLAIM_LEASE)
+                  for user_id in user_ids])
+            cursor.execute(
+                "SELECT user_id FROM reminder_ledger WHERE week_start = ? AND slot = ? AND claim_token = ?",
+                (week_start, slot, token)
+            )
+            claimed = {row[0] for row in cursor.fetchall()}
+            conn.commit()
+
+        return [user_id for user_id in user_ids if user_id in claimed]
+
+    def mark(self, week_start: date, slot: str, user_id: int, status: str) -> None:
+        """Фиксация результата отправки напоминания"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE reminder_ledger SET status = ?, sent_at = ?
+                WHERE user_id = ? AND week_start = ? AND slot = ?
+            """, (status, datetime.now(), user_id, week_start, slot))
+            conn.commit()
+
+    def get_interrupted(self, since: date) -> List[Dict[str, Any]]:
+        """Захваченные, но не подтвержденные напоминания начиная с недели since"""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT * FROM reminder_ledger
+                WHERE status = ? AND week_start >= ?
+                ORDER BY claimed_at
+            """, (LedgerStatus.CLAIMED, since))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def cleanup(self, max_age_days: int = 30) -> int:
+        """Удаление записей о старых неделях"""
+        cutoff = date.today() - timedelta(days=max_age_days)
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM reminder_ledger WHERE week_start < ?", (cutoff,))
+            conn.commit()
+            removed = cursor.rowcount
+        if removed:
+            logger.info(f"Из журнала напоминаний удалено {removed} записей")
+        return removed
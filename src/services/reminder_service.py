@@ -2,21 +2,131 @@
 """
 Сервис автоматических напоминаний о еженедельных отчетах.
 АО ЭМЗ "ФИРМА СЭЛМА"
+Рассылки идут по дням и времени из настроек напоминаний, а также
+за REMINDER_DEADLINE_LEAD_HOURS до дедлайна каждого отдела. При
+REMINDER_WAVES_ENABLED рассылка разбивается на волны по отделам,
+растянутые на REMINDER_WAVE_WINDOW_MINUTES, чтобы отчеты и ИИ-анализ
+не приходили одним пиком. Журнал напоминаний (REMINDER_LEDGER_ENABLED)
+гарантирует, что каждое напоминание уходит сотруднику один раз даже при
+перезапуске или нескольких экземплярах бота.
 
 Автор: Telegram Report Bot
 Версия: 1.0.0
 """
 
 import asyncio
-from datetime import datetime, date, time, timedelta
-from typing import List, Optional
+from dataclasses import dataclass
+from datetime import datetime, date, timedelta
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 from loguru import logger
 
 from database import DatabaseManager
-from services.telegram_service import TelegramService
+from services.telegram_service import TelegramService, SEND_OK
+from services.reminder_ledger import ReminderLedger, LedgerStatus, CLAIM_LEASE
 from models.department import Employee
 from config import settings
+from utils.date_utils import deadline_weekday
+
+
+# Сокращения дней недели в настройках напоминаний
+WEEKDAY_NAMES = {"Пн": 0, "Вт": 1, "Ср": 2, "Чт": 3, "Пт": 4, "Сб": 5, "Вс": 6}
+
+# Названия наборов дней, которые прежние версии админки сохраняли вместо сокращений
+WEEKDAY_PRESETS = {"Каждый день": "Пн,Вт,Ср,Чт,Пт,Сб,Вс", "Только пятница": "Пт"}
+
+MINUTES_PER_WEEK = 7 * 24 * 60
+
+# Максимальный непрерывный сон: после него расписание перечитывается из БД
+# (на случай перевода системных часов или правки дедлайнов в обход бота)
+MAX_SLEEP_SECONDS = 3600
+
+# Насколько рассылка может опоздать (перезапуск, задержка цикла) и все же быть отправлена
+MISSED_REMINDER_GRACE = timedelta(minutes=30)
+
+# Период проверки нагрузки ИИ, пока волна напоминаний отложена
+WAVE_LOAD_CHECK_SECONDS = 60
+
+
+def parse_reminder_settings(reminder_settings: Dict[str, Any]) -> List[Tuple[int, int, int]]:
+    """Напоминания (день недели, час, минута) из настроек администратора"""
+    try:
+        hour, minute = (int(part) for part in str(reminder_settings.get('reminder_time', '09:00')).split(':'))
+    except ValueError:
+        hour, minute = 9, 0
+
+    reminder_days = str(reminder_settings.get('reminder_days') or '').strip()
+    events = []
+    for day in WEEKDAY_PRESETS.get(reminder_days, reminder_days).split(','):
+        weekday = WEEKDAY_NAMES.get(day.strip())
+        if weekday is not None:
+            events.append((weekday, hour, minute))
+    if reminder_days and not events:
+        logger.warning(f"В настройках напоминаний не распознаны дни недели: {reminder_days!r}")
+    return events
+
+
+def next_deadline(after: datetime, deadline_day: int, deadline_hour: int) -> datetime:
+    """Ближайший дедлайн отдела после after (deadline_day - как в БД, 5=пятница)"""
+    monday = (after - timedelta(days=after.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+    deadline = monday + timedelta(days=deadline_weekday(deadline_day), hours=deadline_hour)
+    return deadline if deadline > after else deadline + timedelta(weeks=1)
+
+
+def deadline_reminder_minute(deadline_day: int, deadline_hour: int, lead_hours: int) -> int:
+    """Минута недели (от понедельника 00:00) напоминания за lead_hours до дедлайна"""
+    return ((deadline_weekday(deadline_day) * 24 + deadline_hour - lead_hours) * 60) % MINUTES_PER_WEEK
+
+
+@dataclass
+class ScheduledReminder:
+    """Ближайшая автоматическая рассылка"""
+    fire_at: datetime
+    # Коды отделов, чьим сотрудникам идет напоминание; None - всем, кто не сдал отчет
+    departments: Optional[Set[str]] = None
+
+
+@dataclass
+class ReminderWave:
+    """Волна рассылки: сотрудники одного отдела и время отправки"""
+    send_at: datetime
+    # Позже этого времени волна не откладывается из-за нагрузки ИИ
+    latest_at: datetime
+    department_code: Optional[str]
+    users: List[Employee]
+
+
+def plan_reminder_waves(users: List[Employee], deadlines: Dict[str, datetime], start: datetime,
+                        window: timedelta, max_users: int) -> List[ReminderWave]:
+    """Разбиение рассылки на волны по отделам.
+
+    Отделы с более близким дедлайном получают напоминание раньше; отдел
+    больше max_users делится на несколько волн. Волны равномерно
+    распределяются по окну window, но напоминание отделу уходит не позже
+    середины времени, оставшегося до его дедлайна.
+    """
+    by_department: Dict[Optional[str], List[Employee]] = {}
+    for user in users:
+        by_department.setdefault(user.department_code, []).append(user)
+
+    no_deadline = start + timedelta(weeks=1)
+    order = sorted(by_department, key=lambda code: (deadlines.get(code, no_deadline), code or ""))
+    size = max_users if max_users > 0 else max(len(users), 1)
+    chunks = [
+        (code, by_department[code][offset:offset + size])
+        for code in order
+        for offset in range(0, len(by_department[code]), size)
+    ]
+
+    step = window / (len(chunks) - 1) if len(chunks) > 1 else timedelta(0)
+    waves = []
+    for index, (code, members) in enumerate(chunks):
+        latest_at = start + window
+        if code in deadlines:
+            latest_at = max(start, min(latest_at, start + (deadlines[code] - start) / 2))
+        waves.append(ReminderWave(min(start + step * index, latest_at), latest_at, code, members))
+    waves.sort(key=lambda wave: wave.send_at)
+    return waves
 
 
 class ReminderService:
@@ -27,6 +137,13 @@ class ReminderService:
         self.telegram_service = telegram_service
         self.is_running = False
         self._task: Optional[asyncio.Task] = None
+        self._settings_changed = asyncio.Event()
+        self.next_reminder: Optional[ScheduledReminder] = None
+        # Текущая нагрузка ИИ (задачи в очереди и в работе); назначается в main
+        self.load_provider: Optional[Callable[[], int]] = None
+        self._deliveries: Set[asyncio.Task] = set()
+        # Журнал отправленных напоминаний; назначается в main
+        self.ledger: Optional[ReminderLedger] = None
     
     async def start(self):
         """Запуск сервиса напоминаний"""
@@ -36,6 +153,8 @@ class ReminderService:
         
         self.is_running = True
         self._task = asyncio.create_task(self._reminder_loop())
+        if self.ledger:
+            self._start_delivery(self._resume_interrupted())
         logger.info("Сервис автоматических напоминаний запущен")
     
     async def stop(self):
@@ -47,15 +166,51 @@ class ReminderService:
                 await self._task
             except asyncio.CancelledError:
                 pass
+        # Незавершенные волны: уже отправленные напоминания не повторятся
+        # при следующей рассылке благодаря ключам идемпотентности
+        for delivery in list(self._deliveries):
+            delivery.cancel()
+        if self._deliveries:
+            await asyncio.gather(*self._deliveries, return_exceptions=True)
         logger.info("Сервис автоматических напоминаний остановлен")
     
+    def reschedule(self):
+        """Пересчет времени следующей рассылки после изменения настроек"""
+        self._settings_changed.set()
+    
     async def _reminder_loop(self):
-        """Основной цикл проверки напоминаний"""
+        """Основной цикл: сон ровно до ближайшей рассылки по сохраненным настройкам"""
+        # Рассылка, время которой только что прошло (бот перезапускался), еще отправляется;
+        # повторно ее не получат благодаря ключам идемпотентности
+        last_fired = datetime.now() - MISSED_REMINDER_GRACE
         while self.is_running:
             try:
-                await self._check_and_send_reminders()
-                # Проверяем каждые 30 минут
-                await asyncio.sleep(1800)
+                self._settings_changed.clear()
+                reminder = await self.get_next_reminder(last_fired)
+                if reminder != self.next_reminder:
+                    self.next_reminder = reminder
+                    if reminder:
+                        logger.info(f"Следующее автоматическое напоминание: {reminder.fire_at:%d.%m.%Y %H:%M}")
+                    else:
+                        logger.info("Автоматические напоминания отключены")
+                
+                if not await self._sleep_until(reminder.fire_at if reminder else None):
+                    # Настройки изменились или истек лимит сна - расписание считается заново
+                    last_fired = max(last_fired, datetime.now())
+                    continue
+                
+                last_fired = reminder.fire_at
+                delay = datetime.now() - reminder.fire_at
+                if delay > MISSED_REMINDER_GRACE:
+                    logger.warning(f"Напоминание на {reminder.fire_at:%d.%m.%Y %H:%M} пропущено: опоздание {delay}")
+                    continue
+                
+                logger.info("Отправка автоматических напоминаний")
+                if settings.reminder_waves_enabled:
+                    # Волны растянуты во времени - цикл не ждет их окончания
+                    self._start_delivery(self._send_automatic_reminders(reminder))
+                else:
+                    await self._send_automatic_reminders(reminder)
             except asyncio.CancelledError:
                 logger.info("Цикл напоминаний остановлен")
                 break
@@ -63,72 +218,141 @@ class ReminderService:
                 logger.error(f"Ошибка в цикле напоминаний: {e}")
                 await asyncio.sleep(300)  # Ждем 5 минут при ошибке
     
-    async def _check_and_send_reminders(self):
-        """Проверка и отправка напоминаний"""
-        now = datetime.now()
-        current_date = now.date()
-        current_time = now.time()
+    def _start_delivery(self, coro):
+        """Фоновая рассылка, отменяемая при остановке сервиса"""
+        delivery = asyncio.create_task(coro)
+        self._deliveries.add(delivery)
+        delivery.add_done_callback(self._deliveries.discard)
+    
+    async def _sleep_until(self, fire_at: Optional[datetime]) -> bool:
+        """Сон до fire_at; False, если раньше изменились настройки или истек лимит сна"""
+        timeout = MAX_SLEEP_SECONDS
+        if fire_at is not None:
+            timeout = min(timeout, (fire_at - datetime.now()).total_seconds())
+        
+        if timeout > 0:
+            try:
+                await asyncio.wait_for(self._settings_changed.wait(), timeout)
+                return False
+            except asyncio.TimeoutError:
+                pass
+        return fire_at is not None and datetime.now() >= fire_at
+    
+    async def get_next_reminder(self, after: Optional[datetime] = None) -> Optional[ScheduledReminder]:
+        """Ближайшая рассылка строго после after; None, если автонапоминания выключены"""
+        after = after or datetime.now()
+        monday = (after - timedelta(days=after.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
         
-        # Получаем начало текущей недели (понедельник)
-        week_start = current_date - timedelta(days=current_date.weekday())
+        upcoming: Dict[datetime, Set[Optional[str]]] = {}
+        for minute_of_week, department_code in await self._get_weekly_schedule():
+            fire_at = monday + timedelta(minutes=minute_of_week)
+            if fire_at <= after:
+                fire_at += timedelta(weeks=1)
+            upcoming.setdefault(fire_at, set()).add(department_code)
         
-        # Проверяем, нужно ли отправлять напоминания
-        should_send = await self._should_send_reminders(current_date, current_time)
+        if not upcoming:
+            return None
         
-        if should_send:
-            logger.info("Отправка автоматических напоминаний")
-            await self._send_automatic_reminders(week_start)
-    
-    async def _should_send_reminders(self, current_date: date, current_time: time) -> bool:
-        """Определяет, нужно ли отправлять напоминания сейчас"""
-        # Отправляем напоминания в среду в 14:00
-        wednesday_reminder = (
-            current_date.weekday() == 2 and  # Среда
-            current_time.hour == 14 and
-            current_time.minute < 30
-        )
+        fire_at = min(upcoming)
+        departments = upcoming[fire_at]
+        # Общая рассылка в то же время уже покрывает напоминания отделам
+        return ScheduledReminder(fire_at, None if None in departments else departments)
+    
+    async def _get_weekly_schedule(self) -> List[Tuple[int, Optional[str]]]:
+        """Еженедельные рассылки: (минута недели от понедельника 00:00, код отдела или None)"""
+        reminder_settings = await self.db_manager.get_reminder_settings()
+        if not reminder_settings.get('auto_enabled'):
+            return []
         
-        # Отправляем напоминания в пятницу в 16:00 (за 2 часа до дедлайна)
-        friday_reminder = (
-            current_date.weekday() == 4 and  # Пятница
-            current_time.hour == 16 and
-            current_time.minute < 30
-        )
+        schedule: List[Tuple[int, Optional[str]]] = [
+            ((weekday * 24 + hour) * 60 + minute, None)
+            for weekday, hour, minute in parse_reminder_settings(reminder_settings)
+        ]
         
-        return wednesday_reminder or friday_reminder
+        # Напоминание перед дедлайном каждого отдела
+        lead_hours = settings.reminder_deadline_lead_hours
+        if lead_hours > 0:
+            for department in await self.db_manager.get_departments():
+                if department.is_active and department.report_required:
+                    schedule.append((
+                        deadline_reminder_minute(department.report_deadline_day,
+                                                 department.report_deadline_hour, lead_hours),
+                        department.code
+                    ))
+        return schedule
     
-    async def _send_automatic_reminders(self, week_start: date):
+    async def _send_automatic_reminders(self, reminder: ScheduledReminder):
         """Отправка автоматических напоминаний"""
         try:
+            fire_date = reminder.fire_at.date()
+            week_start = fire_date - timedelta(days=fire_date.weekday())
+            
             # Получаем список сотрудников без отчетов
             missing_users = await self.db_manager.get_missing_reports_users(week_start)
+            if reminder.departments is not None:
+                missing_users = [user for user in missing_users if user.department_code in reminder.departments]
             
             if not missing_users:
                 logger.info("Все сотрудники уже сдали отчеты")
                 return
             
-            # Отправляем напоминания
-            results = await self.telegram_service.send_bulk_reminders(missing_users)
-            sent_count = results.get('sent', 0)
-            failed_count = results.get('failed', 0)
+            now = datetime.now()
+            if settings.reminder_waves_enabled:
+                waves = plan_reminder_waves(
+                    missing_users,
+                    await self._get_department_deadlines(now),
+                    now,
+                    timedelta(minutes=settings.reminder_wave_window_minutes),
+                    settings.reminder_wave_max_users
+                )
+            else:
+                waves = [ReminderWave(now, now, None, missing_users)]
+            
+            slot = f"{reminder.fire_at:%a-%H%M}"
+            sent_count = failed_count = skipped_count = 0
+            for number, wave in enumerate(waves, 1):
+                await self._wait_for_wave(wave)
+                results = await self._send_wave(week_start, slot, wave.users)
+                sent_count += results.get('sent', 0)
+                failed_count += results.get('failed', 0)
+                skipped_count += results.get('skipped', 0)
+                if len(waves) > 1:
+                    logger.info(
+                        f"Волна напоминаний {number}/{len(waves)} (отдел {wave.department_code or '-'}): "
+                        f"{results.get('sent', 0)} из {len(wave.users)}"
+                    )
+            
+            if skipped_count == len(missing_users):
+                logger.info(f"Напоминания слота {slot} уже отправлены ранее или другим экземпляром бота")
+                return
             
             logger.info(f"Автоматические напоминания отправлены: {sent_count} успешно, {failed_count} ошибок")
             
             # Уведомляем администраторов
+            unreachable_count = len(await self.db_manager.get_unreachable_users())
+            departments_line = (
+                f"🏢 Отделы (до дедлайна): {', '.join(sorted(reminder.departments))}\n"
+                if reminder.departments is not None else ""
+            )
             admin_message = (
                 f"🤖 <b>Автоматические напоминания отправлены</b>\n\n"
                 f"📊 Статистика:\n"
                 f"• Всего без отчетов: {len(missing_users)}\n"
                 f"• Напоминания отправлены: {sent_count}\n"
-                f"• Ошибки отправки: {failed_count}\n\n"
+                f"• Ошибки отправки: {failed_count}\n"
+                f"• Недоступны (заблокировали бота): {unreachable_count}\n"
+                f"• Отправлены ранее: {skipped_count}\n"
+                f"• Волн рассылки: {len(waves)}\n\n"
+                f"{departments_line}"
                 f"📅 Неделя: {week_start.strftime('%d.%m.%Y')}"
             )
             
             # Получаем список администраторов
             admin_ids = await self._get_admin_ids()
-            if admin_ids:
-                await self.telegram_service.send_admin_notification(admin_ids, admin_message)
+            self.telegram_service.notify_admins(admin_ids, admin_message)
             
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"Ошибка отправки автоматических напоминаний: {e}")
             
@@ -141,8 +365,103 @@ class ReminderService:
             )
             
             admin_ids = await self._get_admin_ids()
-            if admin_ids:
-                await self.telegram_service.send_admin_notification(admin_ids, error_message)
+            self.telegram_service.notify_admins(admin_ids, error_message)
+    
+    async def _send_wave(self, week_start: date, slot: str, users: List[Employee]) -> Dict[str, int]:
+        """Отправка напоминаний тем, кому они еще не отправлены в этом слоте"""
+        skipped = 0
+        result_callback = None
+        if self.ledger:
+            claimed = set(self.ledger.claim(week_start, slot, [user.user_id for user in users]))
+            skipped = len(users) - len(claimed)
+            users = [user for user in users if user.user_id in claimed]
+            
+            def result_callback(chat_id: int, status: str):
+                self.ledger.mark(week_start, slot, chat_id,
+                                 LedgerStatus.SENT if status == SEND_OK else LedgerStatus.FAILED)
+        
+        results = {'sent': 0, 'failed': 0}
+        if users:
+            # Ключ рассылки защищает от повторной отправки через очередь
+            # исходящих сообщений, если бот перезапустится до ее окончания
+            results = await self.telegram_service.send_bulk_reminders(
+                users,
+                idempotency_prefix=f"auto-reminder:{week_start.isoformat()}:{slot}",
+                result_callback=result_callback
+            )
+        return {**results, 'skipped': skipped}
+    
+    async def _resume_interrupted(self):
+        """Досылка напоминаний текущей недели, прерванных остановкой бота"""
+        try:
+            today = date.today()
+            rows = self.ledger.get_interrupted(today - timedelta(days=today.weekday()))
+            if not rows:
+                return
+            
+            # Захват остановленного экземпляра истекает через CLAIM_LEASE
+            latest_claim = max(datetime.fromisoformat(str(row['claimed_at'])) for row in rows)
+            delay = (latest_claim + CLAIM_LEASE - datetime.now()).total_seconds()
+            logger.info(f"Прерванных напоминаний: {len(rows)}, досылка через {max(delay, 0):.0f} с")
+            if delay > 0:
+                await asyncio.sleep(delay)
+            
+            slots: Dict[Tuple[str, str], Set[int]] = {}
+            for row in rows:
+                slots.setdefault((str(row['week_start']), row['slot']), set()).add(row['user_id'])
+            
+            for (week_text, slot), user_ids in slots.items():
+                week_start = date.fromisoformat(week_text)
+                missing_users = [
+                    user for user in await self.db_manager.get_missing_reports_users(week_start)
+                    if user.user_id in user_ids
+                ]
+                # Успевшим сдать отчет напоминание больше не нужно
+                submitted = user_ids - {user.user_id for user in missing_users}
+                for user_id in self.ledger.claim(week_start, slot, submitted):
+                    self.ledger.mark(week_start, slot, user_id, LedgerStatus.SKIPPED)
+                
+                results = await self._send_wave(week_start, slot, missing_users)
+                logger.info(
+                    f"Досылка напоминаний слота {slot}: {results.get('sent', 0)} отправлено, "
+                    f"{len(submitted)} уже сдали отчет"
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка досылки прерванных напоминаний: {e}")
+    
+    async def _get_department_deadlines(self, after: datetime) -> Dict[str, datetime]:
+        """Ближайшие дедлайны отделов после after"""
+        deadlines = {}
+        for department in await self.db_manager.get_departments():
+            if department.is_active and department.report_required:
+                deadlines[department.code] = next_deadline(
+                    after, department.report_deadline_day, department.report_deadline_hour
+                )
+        return deadlines
+    
+    async def _wait_for_wave(self, wave: ReminderWave):
+        """Ожидание времени волны; при высокой нагрузке ИИ волна откладывается, но не позже latest_at"""
+        delay = (wave.send_at - datetime.now()).total_seconds()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        
+        while self._get_load() > settings.reminder_wave_max_ai_load:
+            remaining = (wave.latest_at - datetime.now()).total_seconds()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(WAVE_LOAD_CHECK_SECONDS, remaining))
+    
+    def _get_load(self) -> int:
+        """Текущая нагрузка ИИ (0, если источник не задан)"""
+        if not self.load_provider:
+            return 0
+        try:
+            return self.load_provider()
+        except Exception as e:
+            logger.debug(f"Не удалось получить нагрузку ИИ: {e}")
+            return 0
     
     async def _get_admin_ids(self) -> List[int]:
         """Получение списка ID администраторов"""
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Черновики отчетов, заполняемых пользователями.
+Черновик живет, пока пользователь проходит шаги создания отчета, и
+удаляется после REPORT_DRAFT_TTL_HOURS без изменений, поэтому
+брошенные на полпути отчеты не копятся в памяти. При подключенном
+SQLitePersistence черновики сохраняются в базе и восстанавливаются
+после перезапуска бота.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from loguru import logger
+
+from config import settings
+from models.report import WeeklyReport
+from .sqlite_persistence import SQLitePersistence
+
+
+class ReportDraftStore:
+    """Черновики отчетов по пользователям с удалением по сроку неактивности"""
+
+    def __init__(self, ttl_hours: Optional[float] = None):
+        self.ttl = timedelta(hours=ttl_hours if ttl_hours is not None else settings.report_draft_ttl_hours)
+        self.persistence: Optional[SQLitePersistence] = None
+        self._drafts: Dict[int, WeeklyReport] = {}
+        self._updated_at: Dict[int, datetime] = {}
+
+    def load(self, persistence: SQLitePersistence) -> int:
+        """Подключение хранилища и восстановление сохраненных черновиков"""
+        self.persistence = persistence
+        for user_id, (report, updated_at) in persistence.get_drafts().items():
+            self._drafts[user_id] = report
+            self._updated_at[user_id] = updated_at
+        evicted = self.evict_expired()
+        if self._drafts:
+            logger.info(f"Восстановлено черновиков отчетов: {len(self._drafts)}")
+        return evicted
+
+    def _is_expired(self, user_id: int, now: datetime) -> bool:
+        return now - self._updated_at[user_id] > self.ttl
+
+    def _touch(self, user_id: int) -> None:
+        """Продление срока черновика и его запись в хранилище"""
+        now = datetime.now()
+        self._updated_at[user_id] = now
+        if self.persistence:
+            # Черновик изменяется на месте после получения, поэтому
+            # сохраняется при каждом обращении (запись идет пакетами)
+            self.persistence.update_draft(user_id, self._drafts[user_id], now)
+
+    def __contains__(self, user_id: int) -> bool:
+        if user_id not in self._drafts:
+            return False
+        if self._is_expired(user_id, datetime.now()):
+            self._evict(user_id)
+            return False
+        return True
+
+    def __getitem__(self, user_id: int) -> WeeklyReport:
+        if user_id not in self:
+            raise KeyError(user_id)
+        self._touch(user_id)
+        return self._drafts[user_id]
+
+    def __setitem__(self, user_id: int, report: WeeklyReport) -> None:
+        self._drafts[user_id] = report
+        self._touch(user_id)
+
+    def __delitem__(self, user_id: int) -> None:
+        del self._drafts[user_id]
+        del self._updated_at[user_id]
+        if self.persistence:
+            self.persistence.drop_draft(user_id)
+
+    def __len__(self) -> int:
+        return len(self._drafts)
+
+    def _evict(self, user_id: int) -> None:
+        del self[user_id]
+        logger.info(f"Черновик отчета пользователя {user_id} удален по сроку неактивности")
+
+    def evict_expired(self) -> int:
+        """Удаление черновиков, не изменявшихся дольше срока хранения"""
+        now = datetime.now()
+        expired = [user_id for user_id in self._drafts if self._is_expired(user_id, now)]
+        for user_id in expired:
+            self._evict(user_id)
+        return len(expired)
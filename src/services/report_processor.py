@@ -1,5 +1,7 @@
 import asyncio
-from typing import List, Dict, Optional, Tuple
+import os
+import tempfile
+from typing import List, Dict, Optional, Tuple, Any, Sequence
 from datetime import datetime, timedelta
 from loguru import logger
 
@@ -7,8 +9,42 @@ from models.report import WeeklyReport
 from models.department import Employee, Department
 from .ollama_service import OllamaService
 from .telegram_service import TelegramService
+from .cpu_jobs import render_csv_chunk
 from config import settings
 
+# Число строк в части выгрузки, формируемой одним процессом
+EXPORT_CHUNK_SIZE = 500
+
+REPORT_EXPORT_COLUMNS = [
+    ("id", "ID"),
+    ("user_id", "ID пользователя"),
+    ("full_name", "Сотрудник"),
+    ("department", "Отдел"),
+    ("position", "Должность"),
+    ("week_start", "Начало недели"),
+    ("week_end", "Конец недели"),
+    ("completed_tasks", "Выполненные задачи"),
+    ("achievements", "Достижения"),
+    ("problems", "Проблемы"),
+    ("next_week_plans", "Планы на следующую неделю"),
+    ("submitted_at", "Отправлен"),
+    ("is_late", "С опозданием")
+]
+
+USER_EXPORT_COLUMNS = [
+    ("user_id", "ID пользователя"),
+    ("username", "Username"),
+    ("full_name", "ФИО"),
+    ("department", "Отдел"),
+    ("position", "Должность"),
+    ("email", "Email"),
+    ("phone", "Телефон"),
+    ("is_active", "Активен"),
+    ("is_blocked", "Заблокирован"),
+    ("is_admin", "Администратор"),
+    ("last_activity", "Последний отчет")
+]
+
 class ReportProcessor:
     """Сервис для обработки и управления отчетами"""
     
@@ -17,6 +53,8 @@ class ReportProcessor:
         self.telegram_service = telegram_service
         self.reports_storage: List[WeeklyReport] = []  # В реальном проекте - база данных
         self.employees_storage: List[Employee] = []   # В реальном проекте - база данных
+        # Менеджер задач (пул процессов для выгрузок), подключается в main.py
+        self.task_manager = None
     
     async def process_new_report(self, report: WeeklyReport) -> bool:
         """Обработка нового отчета"""
@@ -45,9 +83,9 @@ class ReportProcessor:
             
         except Exception as e:
             logger.error(f"Ошибка обработки отчета пользователя {report.user_id}: {e}")
-            # Уведомляем администраторов об ошибке
-            await self.telegram_service.send_admin_notification(
-                settings.admin_user_ids,
+            # Уведомляем администраторов об ошибке (в фоне, не задерживая обработку)
+            self.telegram_service.notify_admins(
+                settings.get_admin_ids(),
                 f"Ошибка обработки отчета пользователя {report.user_id}: {str(e)}"
             )
             return False
@@ -239,6 +277,61 @@ class ReportProcessor:
         """Получение сотрудников по коду отдела"""
         return [emp for emp in self.employees_storage if emp.department_code and emp.department_code == department_code]
     
+    async def _write_csv_export(self, rows: List[Dict[str, Any]], columns: Sequence[Tuple[str, str]],
+                                prefix: str, delimiter: str = ",", encoding: str = "utf-8") -> Optional[str]:
+        """Выгрузка строк в CSV-файл; части файла формируются параллельно вне event loop"""
+        if not rows:
+            return None
+        
+        jobs = [
+            (rows[start:start + EXPORT_CHUNK_SIZE], columns, delimiter, start == 0)
+            for start in range(0, len(rows), EXPORT_CHUNK_SIZE)
+        ]
+        export_file = None
+        try:
+            export_file = tempfile.NamedTemporaryFile(
+                "w", encoding=encoding, newline="", prefix=prefix, suffix=".csv", delete=False
+            )
+            with export_file:
+                if self.task_manager:
+                    async for chunk in self.task_manager.stream_cpu(render_csv_chunk, jobs):
+                        export_file.write(chunk)
+                else:
+                    for job in jobs:
+                        export_file.write(await asyncio.to_thread(render_csv_chunk, *job))
+            
+            logger.info(f"Выгрузка {export_file.name}: {len(rows)} строк, частей: {len(jobs)}")
+            return export_file.name
+        except Exception as e:
+            logger.error(f"Ошибка формирования выгрузки {prefix}: {e}")
+            # Частично записанный файл не оставляем на диске
+            if export_file:
+                try:
+                    os.remove(export_file.name)
+                except OSError:
+                    pass
+            return None
+    
+    async def create_csv_export(self, reports_data: List[Dict[str, Any]]) -> Optional[str]:
+        """Выгрузка отчетов в CSV"""
+        return await self._write_csv_export(reports_data, REPORT_EXPORT_COLUMNS, "reports_")
+    
+    async def create_excel_export(self, reports_data: List[Dict[str, Any]]) -> Optional[str]:
+        """Выгрузка отчетов в CSV для Excel (разделитель ";" и BOM для кириллицы)"""
+        return await self._write_csv_export(
+            reports_data, REPORT_EXPORT_COLUMNS, "reports_excel_", delimiter=";", encoding="utf-8-sig"
+        )
+    
+    async def create_reports_export(self, reports_data: List[Dict[str, Any]]) -> Optional[str]:
+        """Выгрузка всех отчетов (меню отчетов администратора)"""
+        return await self.create_excel_export(reports_data)
+    
+    async def create_users_export(self, users_data: List[Dict[str, Any]]) -> Optional[str]:
+        """Выгрузка списка сотрудников для Excel"""
+        return await self._write_csv_export(
+            users_data, USER_EXPORT_COLUMNS, "users_", delimiter=";", encoding="utf-8-sig"
+        )
+    
     async def export_reports_to_text(self, start_date: datetime, end_date: datetime) -> str:
         """Экспорт отчетов в текстовый формат"""
         reports = self.get_reports_for_period(start_date, end_date)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Упреждающая ИИ-обработка отчетов во время заполнения.
+Пока сотрудник просматривает отчет перед отправкой, анализ уже
+выполняется в фоне. Результат привязан к отпечатку содержимого
+отчета: если отчет изменился, упреждающая задача отменяется,
+а при подтверждении готовый результат используется без ожидания.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+
+from loguru import logger
+
+from models.report import WeeklyReport
+from .ollama_service import OllamaService
+
+
+@dataclass
+class _SpeculativeJob:
+    """Упреждающая задача одного пользователя"""
+    fingerprint: str
+    task: asyncio.Task
+    created_at: datetime = field(default_factory=datetime.now)
+
+
+class SpeculativeProcessor:
+    """Фоновый анализ черновиков отчетов"""
+
+    def __init__(self, ollama_service: OllamaService, embedding_index=None):
+        self.ollama_service = ollama_service
+        self.embedding_index = embedding_index
+        self._jobs: Dict[int, _SpeculativeJob] = {}
+        # Фоновые запросы эмбеддингов (ссылки хранятся до завершения задачи)
+        self._prefetch_tasks: Set[asyncio.Task] = set()
+        self.stats = {"started": 0, "hits": 0, "misses": 0, "cancelled": 0}
+
+    def prefetch_field(self, text: Optional[str]) -> None:
+        """Заблаговременное получение эмбеддинга поля (для проверки на повтор)"""
+        if self.embedding_index and text:
+            task = asyncio.create_task(self.embedding_index.prefetch(text))
+            self._prefetch_tasks.add(task)
+            task.add_done_callback(self._prefetch_tasks.discard)
+
+    def schedule(self, user_id: int, report: WeeklyReport) -> None:
+        """Запуск анализа черновика, если его содержимое изменилось"""
+        fingerprint = report.content_fingerprint()
+        job = self._jobs.get(user_id)
+        if job and job.fingerprint == fingerprint:
+            return
+
+        self.discard(user_id)
+
+        # При перегрузке ИИ упреждающая работа только отнимает ресурсы
+        if self.ollama_service.router.degraded:
+            logger.info(f"Упреждающий анализ отчета пользователя {user_id} пропущен: перегрузка ИИ")
+            return
+
+        snapshot = report.model_copy(deep=True)
+        task = asyncio.create_task(self.ollama_service.process_report(snapshot))
+        self._jobs[user_id] = _SpeculativeJob(fingerprint=fingerprint, task=task)
+        self.stats["started"] += 1
+        logger.info(f"Запущен упреждающий анализ отчета пользователя {user_id}")
+
+    def discard(self, user_id: int) -> None:
+        """Отмена упреждающего анализа (отчет изменен или отменен)"""
+        job = self._jobs.pop(user_id, None)
+        if job and not job.task.done():
+            job.task.cancel()
+            self.stats["cancelled"] += 1
+            logger.info(f"Упреждающий анализ отчета пользователя {user_id} отменен")
+
+    async def take(self, user_id: int, report: WeeklyReport) -> bool:
+        """Применение результата упреждающего анализа к подтвержденному отчету.
+
+        Если анализ еще выполняется, дожидается его вместо запуска нового.
+        Возвращает True, если отчет получил результат анализа.
+        """
+        job = self._jobs.pop(user_id, None)
+        if not job or job.fingerprint != report.content_fingerprint():
+            if job:
+                job.task.cancel()
+            self.stats["misses"] += 1
+            return False
+
+        try:
+            processed = await job.task
+        except asyncio.CancelledError:
+            # Отменена сама обработка подтвержденного отчета
+            if asyncio.current_task().cancelling():
+                raise
+            processed = None
+        except Exception as e:
+            logger.error(f"Ошибка упреждающего анализа отчета пользователя {user_id}: {e}")
+            processed = None
+
+        if not processed or not processed.is_processed:
+            self.stats["misses"] += 1
+            return False
+
+        report.mark_as_processed(summary=processed.summary, analysis=processed.analysis)
+        self.stats["hits"] += 1
+        logger.info(f"Использован упреждающий анализ отчета пользователя {user_id}")
+        return True
+
+    def take_ready(self, user_id: int, report: WeeklyReport) -> bool:
+        """Применение результата, только если анализ уже завершен (без ожидания)"""
+        job = self._jobs.get(user_id)
+        if (not job or not job.task.done() or job.task.cancelled() or
+                job.fingerprint != report.content_fingerprint()):
+            return False
+
+        self._jobs.pop(user_id, None)
+        processed = job.task.result() if job.task.exception() is None else None
+        if not processed or not processed.is_processed:
+            return False
+
+        report.mark_as_processed(summary=processed.summary, analysis=processed.analysis)
+        self.stats["hits"] += 1
+        logger.info(f"Использован готовый упреждающий анализ отчета пользователя {user_id}")
+        return True
+
+    def cleanup(self, max_age_minutes: int = 60) -> None:
+        """Удаление брошенных черновиков"""
+        cutoff = datetime.now() - timedelta(minutes=max_age_minutes)
+        for user_id in [user_id for user_id, job in self._jobs.items() if job.created_at < cutoff]:
+            self.discard(user_id)
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Хранение состояния диалогов в SQLite.
+Реализация BasePersistence python-telegram-bot: состояния
+ConversationHandler, user_data и черновики отчетов сохраняются в базе
+бота, поэтому перезапуск не прерывает заполнение отчета. Изменения
+копятся в памяти и записываются одной транзакцией не чаще раза
+в PERSISTENCE_FLUSH_INTERVAL секунд; при остановке бота все
+незаписанные изменения сохраняются.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import asyncio
+import copy
+import json
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Any, Tuple
+
+from loguru import logger
+from telegram.ext import BasePersistence, PersistenceInput
+
+from config import settings
+from models.report import WeeklyReport
+
+# Таблица и ключ отложенной записи: значение None означает удаление
+PendingKey = Tuple[str, Any]
+
+
+class SQLitePersistence(BasePersistence):
+    """Состояния диалогов, user_data и черновики отчетов в SQLite"""
+
+    def __init__(self, db_path: Path, flush_interval: Optional[float] = None):
+        self.flush_interval = flush_interval if flush_interval is not None else settings.persistence_flush_interval
+        # Данные чатов, бота и callback_data ботом не используются
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=self.flush_interval
+        )
+        self.db_path = Path(db_path)
+        self._pending: Dict[PendingKey, Any] = {}
+        self._writer: Optional[asyncio.Task] = None
+        self.stats = {"writes": 0, "rows": 0}
+        self._init_tables()
+
+    def _init_tables(self):
+        """Создание таблиц состояния диалогов"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS persistence_conversations (
+                    name TEXT NOT NULL,
+                    conversation_key TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (name, conversation_key)
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS persistence_user_data (
+                    user_id INTEGER PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS report_drafts (
+                    user_id INTEGER PRIMARY KEY,
+                    report TEXT NOT NULL,
+                    updated_at TIMESTAMP NOT NULL
+                )
+            """)
+            conn.commit()
+
+    # Отложенная запись
+
+    def _stage(self, table: str, key: Any, value: Any) -> None:
+        """Постановка изменения в очередь записи"""
+        self._pending[(table, key)] = value
+        if self._writer is None or self._writer.done():
+            try:
+                self._writer = asyncio.get_running_loop().create_task(self._delayed_write())
+            except RuntimeError:
+                # Вне цикла событий (например, при остановке) - записываем сразу
+                self._write_pending()
+
+    async def _delayed_write(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        self._write_pending()
+
+    def _write_pending(self) -> None:
+        """Запись всех накопленных изменений одной транзакцией"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                for (table, key), value in pending.items():
+                    self._write_row(cursor, table, key, value)
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи состояния диалогов: {e}")
+            # Изменения возвращаются в очередь, кроме уже замененных более новыми
+            for item_key, value in pending.items():
+                self._pending.setdefault(item_key, value)
+            return
+
+        self.stats["writes"] += 1
+        self.stats["rows"] += len(pending)
+
+    @staticmethod
+    def _write_row(cursor: sqlite3.Cursor, table: str, key: Any, value: Any) -> None:
+        now = datetime.now()
+        if table == "conversations":
+            name, conversation_key = key
+            if value is None:
+                cursor.execute(
+                    "DELETE FROM persistence_conversations WHERE name = ? AND conversation_key = ?",
+                    (name, conversation_key)
+                )
+            else:
+                cursor.execute("""
+                    INSERT OR REPLACE INTO persistence_conversations (name, conversation_key, state, updated_at)
+                    VALUES (?, ?, ?, ?)
+                """, (name, conversation_key, json.dumps(value), now))
+
+        elif table == "user_data":
+            if value is None:
+                cursor.execute("DELETE FROM persistence_user_data WHERE user_id = ?", (key,))
+                return
+            try:
+                data = json.dumps(value, ensure_ascii=False)
+            except (TypeError, ValueError) as e:
+                logger.warning(f"user_data пользователя {key} не сохранены: {e}")
+                return
+            cursor.execute(
+                "INSERT OR REPLACE INTO persistence_user_data (user_id, data, updated_at) VALUES (?, ?, ?)",
+                (key, data, now)
+            )
+
+        elif table == "drafts":
+            if value is None:
+                cursor.execute("DELETE FROM report_drafts WHERE user_id = ?", (key,))
+                return
+            # Черновик сериализуется при записи: правки после постановки в очередь тоже попадут в БД
+            report, updated_at = value
+            cursor.execute(
+                "INSERT OR REPLACE INTO report_drafts (user_id, report, updated_at) VALUES (?, ?, ?)",
+                (key, report.model_dump_json(), updated_at)
+            )
+
+    # Состояния диалогов
+
+    async def get_conversations(self, name: str) -> Dict[Tuple, object]:
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT conversation_key, state FROM persistence_conversations WHERE name = ?", (name,)
+            )
+            return {tuple(json.loads(key)): json.loads(state) for key, state in cursor.fetchall()}
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]) -> None:
+        self._stage("conversations", (name, json.dumps(list(key))), new_state)
+
+    # Данные пользователей
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT user_id, data FROM persistence_user_data")
+            return {user_id: json.loads(data) for user_id, data in cursor.fetchall()}
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        # Копия: данные могут измениться до записи, а сохранить нужно текущее состояние
+        self._stage("user_data", user_id, copy.deepcopy(data))
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage("user_data", user_id, None)
+
+    # Черновики отчетов
+
+    def get_drafts(self) -> Dict[int, Tuple[WeeklyReport, datetime]]:
+        """Сохраненные черновики отчетов с временем последнего изменения"""
+        drafts = {}
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT user_id, report, updated_at FROM report_drafts")
+            for user_id, report, updated_at in cursor.fetchall():
+                try:
+                    drafts[user_id] = (WeeklyReport.model_validate_json(report),
+                                       datetime.fromisoformat(str(updated_at)))
+                except ValueError as e:
+                    logger.warning(f"Поврежденный черновик отчета пользователя {user_id} пропущен: {e}")
+        return drafts
+
+    def update_draft(self, user_id: int, report: WeeklyReport, updated_at: datetime) -> None:
+        self._stage("drafts", user_id, (report, updated_at))
+
+    def drop_draft(self, user_id: int) -> None:
+        self._stage("drafts", user_id, None)
+
+    # Данные чатов, бота и callback_data не хранятся
+
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: Any) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Any) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def update_bot_data(self, data: Any) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Any) -> None:
+        pass
+
+    async def get_callback_data(self) -> Optional[Any]:
+        return None
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Запись всех изменений при остановке приложения"""
+        if self._writer and not self._writer.done():
+            self._writer.cancel()
+        self._write_pending()
+        logger.info(f"Состояние диалогов сохранено: {self.stats}")
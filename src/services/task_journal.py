@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Журнал фоновых задач.
+Каждая задача TaskManager вместе с данными, необходимыми для ее
+повторного запуска, записывается в таблицу task_journal, а переходы
+между статусами фиксируются по мере выполнения. Задачи, прерванные
+перезапуском бота, возобновляются при следующем старте; повторное
+завершение уже завершенной задачи ничего не меняет.
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import sqlite3
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional, List, Dict, Any
+
+from loguru import logger
+
+# Статусы, из которых задача считается завершенной
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+class TaskJournal:
+    """Долговременное хранилище состояния фоновых задач"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._init_table()
+
+    def _init_table(self):
+        """Создание таблицы журнала"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS task_journal (
+                    task_id TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    payload TEXT,
+                    priority INTEGER DEFAULT 1,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 0,
+                    error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    started_at TIMESTAMP,
+                    completed_at TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_task_journal_status ON task_journal (status)")
+            conn.commit()
+
+    def record_created(self, task_id: str, user_id: int, kind: str, payload: Optional[str],
+                       priority: int) -> None:
+        """Запись новой (или возобновленной) задачи"""
+        now = datetime.now()
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO task_journal (task_id, user_id, kind, payload, priority, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, 'pending', ?, ?)
+                ON CONFLICT(task_id) DO UPDATE SET status = 'pending', updated_at = excluded.updated_at
+            """, (task_id, user_id, kind, payload, int(priority), now, now))
+            conn.commit()
+
+    def record_started(self, task_id: str) -> None:
+        """Задача начала выполняться (попытка засчитывается)"""
+        now = datetime.now()
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE task_journal
+                SET status = 'running', attempts = attempts + 1, started_at = ?, updated_at = ?
+                WHERE task_id = ? AND status NOT IN (?, ?, ?)
+            """, (now, now, task_id, *FINISHED_STATUSES))
+            conn.commit()
+
+    def record_finished(self, task_id: str, status: str, error: Optional[str] = None) -> bool:
+        """Фиксация итога задачи; False, если задача уже была завершена ранее"""
+        now = datetime.now()
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE task_journal
+                SET status = ?, error = ?, completed_at = ?, updated_at = ?
+                WHERE task_id = ? AND status NOT IN (?, ?, ?)
+            """, (status, error, now, now, task_id, *FINISHED_STATUSES))
+            conn.commit()
+            return cursor.rowcount > 0
+
+    def get_unfinished(self) -> List[Dict[str, Any]]:
+        """Задачи, прерванные до завершения, в порядке создания"""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT * FROM task_journal
+                WHERE status NOT IN (?, ?, ?)
+                ORDER BY created_at
+            """, FINISHED_STATUSES)
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_stats(self) -> Dict[str, int]:
+        """Количество задач журнала по статусам"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT status, COUNT(*) FROM task_journal GROUP BY status")
+            return dict(cursor.fetchall())
+
+    def cleanup(self, max_age_days: int = 7) -> int:
+        """Удаление старых завершенных задач"""
+        cutoff = datetime.now() - timedelta(days=max_age_days)
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "DELETE FROM task_journal WHERE status IN (?, ?, ?) AND created_at < ?",
+                (*FINISHED_STATUSES, cutoff)
+            )
+            conn.commit()
+            removed = cursor.rowcount
+        if removed:
+            logger.info(f"Из журнала задач удалено {removed} завершенных задач")
+        return removed
@@ -2,20 +2,38 @@
 """
 Сервис для управления фоновыми задачами обработки отчетов.
 Обеспечивает асинхронную обработку без блокировки основного потока бота.
+В режиме пула задачи выполняются ограниченным числом обработчиков,
+а остальные ожидают в очереди с приоритетами. Задачи с данными для
+повторного запуска записываются в журнал и возобновляются после
+перезапуска бота. Тяжелые вычисления (выгрузки, аналитика по истории)
+выполняются в пуле процессов, не задерживая обработку обновлений.
 
 Автор: Telegram Report Bot
 Версия: 1.0.0
 """
 
 import asyncio
+import heapq
+import itertools
+import json
+import multiprocessing
 import uuid
-from datetime import datetime
-from enum import Enum
-from typing import Dict, Optional, Callable, Any
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from enum import Enum, IntEnum
+from typing import Dict, Optional, Callable, Any, List, Tuple, Sequence, AsyncIterator
 from dataclasses import dataclass
 
 from loguru import logger
 
+from config import settings
+from .metrics import TASK_QUEUE_WAIT, TASK_DURATION
+
+# Сколько раз задача из журнала запускается, прежде чем считаться неудачной
+# (защита от задачи, которая каждый раз роняет бота)
+RESUME_MAX_ATTEMPTS = 3
+
 
 class TaskStatus(Enum):
     """Статусы задач"""
@@ -26,6 +44,22 @@ class TaskStatus(Enum):
     CANCELLED = "cancelled"
 
 
+# Статусы завершенных задач
+FINISHED_STATUSES = (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED)
+
+
+class TaskPriority(IntEnum):
+    """Приоритеты задач в очереди (меньше - раньше)"""
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class TaskQueueFullError(Exception):
+    """Очередь задач заполнена, задача не принята"""
+    pass
+
+
 @dataclass
 class TaskInfo:
     """Информация о задаче"""
@@ -38,33 +72,229 @@ class TaskInfo:
     result: Optional[Any] = None
     error: Optional[str] = None
     progress_message: Optional[str] = None
+    priority: int = TaskPriority.NORMAL
+    kind: Optional[str] = None  # тип задачи в журнале (None - задача не восстанавливается)
 
 
 class TaskManager:
     """Менеджер фоновых задач"""
     
-    def __init__(self):
+    def __init__(self, pool_enabled: Optional[bool] = None, workers: Optional[int] = None,
+                 max_queue_size: Optional[int] = None):
         self.tasks: Dict[str, TaskInfo] = {}
         self.running_tasks: Dict[str, asyncio.Task] = {}
         self.user_tasks: Dict[int, str] = {}  # user_id -> task_id
         self.progress_callbacks: Dict[str, Callable] = {}
         
-    def create_task(self, user_id: int, coro, progress_callback: Optional[Callable] = None) -> str:
-        """Создание новой задачи"""
-        task_id = str(uuid.uuid4())
+        # Режим пула: задачи ждут свободного обработчика в очереди с приоритетами
+        self.pool_enabled = settings.task_pool_enabled if pool_enabled is None else pool_enabled
+        self.workers = workers or settings.task_pool_workers
+        self.max_queue_size = max_queue_size or settings.task_queue_max_size
+        self._queue: List[Tuple[int, int, str]] = []  # (приоритет, порядковый номер, task_id)
+        self._queued_coros: Dict[str, Any] = {}
+        self._sequence = itertools.count()
+        self._queue_signal = asyncio.Semaphore(0)
+        self._worker_tasks: List[asyncio.Task] = []
+        
+        # Журнал задач (TaskJournal), подключается в main.py
+        self.journal = None
+        # Восстановление задач из журнала: тип -> функция(данные) -> (корутина, progress_callback)
+        self._resumers: Dict[str, Callable[[Dict[str, Any]], Tuple[Any, Optional[Callable]]]] = {}
+        # При остановке бота прерванные задачи остаются в журнале незавершенными
+        self._stopping = False
+        
+        # Завершенные задачи в порядке времени завершения: очистка без обхода всех задач.
+        # Результаты задач освобождаются раньше самих задач (TASK_RESULT_RETENTION_MINUTES)
+        self.retention_hours = settings.task_retention_hours
+        self.result_retention = timedelta(minutes=settings.task_result_retention_minutes)
+        self._expiry_heap: List[Tuple[datetime, str]] = []
+        self._result_heap: List[Tuple[datetime, str]] = []
+        
+        # Пул процессов для CPU-задач создается при первом использовании;
+        # процессы перезапускаются после заданного числа задач (освобождение памяти)
+        self.cpu_pool_enabled = settings.cpu_pool_enabled
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._process_pool_jobs = 0
+        
+    async def start(self):
+        """Запуск обработчиков пула (в обычном режиме не требуется)"""
+        if not self.pool_enabled or self._worker_tasks:
+            return
+        self._worker_tasks = [
+            asyncio.create_task(self._worker_loop(index)) for index in range(self.workers)
+        ]
+        logger.info(
+            f"Пул задач запущен: {self.workers} обработчиков, очередь до {self.max_queue_size} задач"
+        )
+    
+    async def stop(self):
+        """Остановка: задачи прерываются, но в журнале остаются незавершенными"""
+        self._stopping = True
+        for task in self._worker_tasks:
+            task.cancel()
+        for task in self._worker_tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._worker_tasks = []
+        
+        for coro in self._queued_coros.values():
+            coro.close()
+        self._queued_coros.clear()
+        self._queue = []
+        
+        running = list(self.running_tasks.values())
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+            logger.info(f"Прервано выполняемых задач: {len(running)}")
+        
+        self._shutdown_process_pool()
+    
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        # Пул целиком заменяется новым после заданного числа задач на процесс: память,
+        # накопленная процессами, освобождается. Встроенный max_tasks_per_child не
+        # используется - в Python 3.12 он может приводить к зависанию пула
+        recycle_after = settings.cpu_pool_workers * settings.cpu_pool_max_tasks_per_child
+        if self._process_pool is not None and self._process_pool_jobs >= recycle_after:
+            logger.info(f"Пул процессов перезапускается после {self._process_pool_jobs} задач")
+            # Уже переданные старому пулу задачи будут завершены
+            self._process_pool.shutdown(wait=False)
+            self._process_pool = None
+        
+        if self._process_pool is None:
+            # spawn: дочерние процессы не наследуют состояние event loop и соединений бота
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=settings.cpu_pool_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            self._process_pool_jobs = 0
+            logger.info(f"Пул процессов запущен: {settings.cpu_pool_workers} процессов")
+        
+        self._process_pool_jobs += 1
+        return self._process_pool
+    
+    def _shutdown_process_pool(self) -> None:
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+    
+    async def run_cpu(self, func: Callable, *args) -> Any:
+        """Выполнение CPU-задачи вне event loop.
+        
+        func - функция уровня модуля (см. services.cpu_jobs), args - данные,
+        сериализуемые pickle. Без пула процессов задача выполняется в потоке.
+        """
+        if not self.cpu_pool_enabled:
+            return await asyncio.to_thread(func, *args)
+        
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_process_pool(), func, *args)
+        except BrokenProcessPool:
+            # Процесс аварийно завершился: следующая задача получит новый пул
+            logger.error(f"Пул процессов поврежден при выполнении {func.__name__}, пул будет пересоздан")
+            self._shutdown_process_pool()
+            raise
+    
+    async def stream_cpu(self, func: Callable, jobs: Sequence[tuple]) -> AsyncIterator[Any]:
+        """Параллельное выполнение частей CPU-задачи.
+        
+        Части (кортежи аргументов func) выполняются одновременно, а результаты
+        отдаются в исходном порядке по мере готовности.
+        """
+        futures = [asyncio.ensure_future(self.run_cpu(func, *args)) for args in jobs]
+        try:
+            for future in futures:
+                yield await future
+        finally:
+            for future in futures:
+                future.cancel()
+    
+    def register_resumer(self, kind: str,
+                         resumer: Callable[[Dict[str, Any]], Tuple[Any, Optional[Callable]]]) -> None:
+        """Регистрация функции, воссоздающей задачу данного типа по данным из журнала"""
+        self._resumers[kind] = resumer
+    
+    async def resume(self) -> int:
+        """Возобновление задач, прерванных перезапуском бота"""
+        if not self.journal:
+            return 0
+        
+        resumed = 0
+        for entry in self.journal.get_unfinished():
+            task_id = entry['task_id']
+            resumer = self._resumers.get(entry['kind'])
+            if not resumer or not entry['payload']:
+                self.journal.record_finished(task_id, TaskStatus.FAILED.value, "нет данных для возобновления")
+                continue
+            if entry['attempts'] >= RESUME_MAX_ATTEMPTS:
+                self.journal.record_finished(task_id, TaskStatus.FAILED.value, "превышено число попыток")
+                logger.warning(f"Задача {task_id} не возобновлена: превышено число попыток")
+                continue
+            
+            try:
+                coro, progress_callback = resumer(json.loads(entry['payload']))
+                self.create_task(
+                    entry['user_id'], coro, progress_callback,
+                    priority=entry['priority'], kind=entry['kind'],
+                    payload=entry['payload'], task_id=task_id
+                )
+                resumed += 1
+            except Exception as e:
+                logger.error(f"Не удалось возобновить задачу {task_id}: {e}")
+                self.journal.record_finished(task_id, TaskStatus.FAILED.value, str(e))
+        
+        if resumed:
+            logger.info(f"Возобновлено задач после перезапуска: {resumed}")
+        return resumed
+    
+    def _journal(self, method: str, *args) -> None:
+        """Запись в журнал задач (ошибка журнала не прерывает задачу)"""
+        if not self.journal:
+            return
+        try:
+            getattr(self.journal, method)(*args)
+        except Exception as e:
+            logger.error(f"Ошибка записи в журнал задач ({method}): {e}")
+    
+    def create_task(self, user_id: int, coro, progress_callback: Optional[Callable] = None,
+                    priority: int = TaskPriority.NORMAL, kind: Optional[str] = None,
+                    payload: Optional[str] = None, task_id: Optional[str] = None) -> str:
+        """Создание новой задачи.
+        
+        Задача с типом kind и данными payload (JSON) записывается в журнал и может быть
+        возобновлена после перезапуска. В режиме пула при заполненной очереди
+        возбуждается TaskQueueFullError.
+        """
+        # Попутно удаляем устаревшие задачи (дешево, если удалять нечего)
+        self._expire(datetime.now())
         
         # Отменяем предыдущую задачу пользователя, если есть
         if user_id in self.user_tasks:
             old_task_id = self.user_tasks[user_id]
             self.cancel_task(old_task_id)
         
+        if self.pool_enabled and len(self._queue) >= self.max_queue_size:
+            coro.close()
+            logger.warning(f"Очередь задач заполнена ({len(self._queue)}), задача пользователя {user_id} отклонена")
+            raise TaskQueueFullError("Очередь задач заполнена")
+        
+        task_id = task_id or str(uuid.uuid4())
+        
         # Создаем информацию о задаче
         task_info = TaskInfo(
             task_id=task_id,
             user_id=user_id,
             status=TaskStatus.PENDING,
-            created_at=datetime.now()
+            created_at=datetime.now(),
+            priority=priority,
+            kind=kind if self.journal and payload else None
         )
+        if task_info.kind:
+            self._journal("record_created", task_id, user_id, kind, payload, priority)
         
         self.tasks[task_id] = task_info
         self.user_tasks[user_id] = task_id
@@ -72,6 +302,17 @@ class TaskManager:
         if progress_callback:
             self.progress_callbacks[task_id] = progress_callback
         
+        if self.pool_enabled:
+            # Задача ждет свободного обработчика
+            self._queued_coros[task_id] = coro
+            heapq.heappush(self._queue, (int(priority), next(self._sequence), task_id))
+            self._queue_signal.release()
+            logger.info(
+                f"Задача {task_id} пользователя {user_id} поставлена в очередь "
+                f"(позиция {self.get_queue_position(task_id)})"
+            )
+            return task_id
+        
         # Создаем и запускаем asyncio задачу
         async_task = asyncio.create_task(self._run_task(task_id, coro))
         self.running_tasks[task_id] = async_task
@@ -79,6 +320,68 @@ class TaskManager:
         logger.info(f"Создана задача {task_id} для пользователя {user_id}")
         return task_id
     
+    async def _worker_loop(self, index: int):
+        """Обработчик пула: выполняет задачи из очереди по одной"""
+        while True:
+            await self._queue_signal.acquire()
+            # Отмененные задачи удаляются из очереди без уменьшения счетчика
+            if not self._queue:
+                continue
+            
+            _, _, task_id = heapq.heappop(self._queue)
+            coro = self._queued_coros.pop(task_id)
+            async_task = asyncio.create_task(self._run_task(task_id, coro))
+            self.running_tasks[task_id] = async_task
+            try:
+                # wait не пробрасывает отмену самой задачи в обработчик
+                await asyncio.wait([async_task])
+            except asyncio.CancelledError:
+                async_task.cancel()
+                raise
+    
+    def _cancel_queued(self, task_id: str) -> bool:
+        """Отмена задачи, ожидающей в очереди"""
+        coro = self._queued_coros.pop(task_id, None)
+        if coro is None:
+            return False
+        
+        self._queue = [entry for entry in self._queue if entry[2] != task_id]
+        heapq.heapify(self._queue)
+        coro.close()
+        
+        task_info = self.tasks[task_id]
+        task_info.status = TaskStatus.CANCELLED
+        task_info.completed_at = datetime.now()
+        if task_info.kind:
+            self._journal("record_finished", task_id, TaskStatus.CANCELLED.value)
+        self._schedule_expiry(task_info)
+        logger.info(f"Задача {task_id} удалена из очереди")
+        
+        # Callback получает финальный статус, как и при отмене выполняемой задачи
+        callback = self.progress_callbacks.pop(task_id, None)
+        if callback:
+            asyncio.create_task(self._notify_cancelled(task_id, callback, task_info))
+        return True
+    
+    async def _notify_cancelled(self, task_id: str, callback: Callable, task_info: TaskInfo):
+        try:
+            await callback(task_info)
+        except Exception as e:
+            logger.error(f"Ошибка в progress_callback для задачи {task_id}: {e}")
+    
+    def get_queue_position(self, task_id: str) -> Optional[int]:
+        """Позиция задачи в очереди (с 1) или None, если задача не ожидает"""
+        if task_id not in self._queued_coros:
+            return None
+        for position, entry in enumerate(sorted(self._queue), start=1):
+            if entry[2] == task_id:
+                return position
+        return None
+    
+    @property
+    def queue_size(self) -> int:
+        return len(self._queue)
+    
     async def _run_task(self, task_id: str, coro) -> Any:
         """Выполнение задачи"""
         task_info = self.tasks[task_id]
@@ -87,6 +390,9 @@ class TaskManager:
             # Обновляем статус на "выполняется"
             task_info.status = TaskStatus.RUNNING
             task_info.started_at = datetime.now()
+            TASK_QUEUE_WAIT.observe((task_info.started_at - task_info.created_at).total_seconds())
+            if task_info.kind:
+                self._journal("record_started", task_id)
             
             logger.info(f"Запуск задачи {task_id}")
             
@@ -97,6 +403,8 @@ class TaskManager:
             task_info.status = TaskStatus.COMPLETED
             task_info.completed_at = datetime.now()
             task_info.result = result
+            if task_info.kind:
+                self._journal("record_finished", task_id, TaskStatus.COMPLETED.value)
             
             logger.success(f"Задача {task_id} успешно завершена")
             return result
@@ -104,6 +412,9 @@ class TaskManager:
         except asyncio.CancelledError:
             task_info.status = TaskStatus.CANCELLED
             task_info.completed_at = datetime.now()
+            # Задача, прерванная остановкой бота, будет возобновлена
+            if task_info.kind and not self._stopping:
+                self._journal("record_finished", task_id, TaskStatus.CANCELLED.value)
             logger.warning(f"Задача {task_id} была отменена")
             raise
             
@@ -111,6 +422,8 @@ class TaskManager:
             task_info.status = TaskStatus.FAILED
             task_info.completed_at = datetime.now()
             task_info.error = str(e)
+            if task_info.kind:
+                self._journal("record_finished", task_id, TaskStatus.FAILED.value, str(e))
             logger.error(f"Ошибка в задаче {task_id}: {e}")
             raise
             
@@ -118,9 +431,18 @@ class TaskManager:
             # Очищаем ссылки
             if task_id in self.running_tasks:
                 del self.running_tasks[task_id]
+            self._schedule_expiry(task_info)
+            if task_info.started_at and task_info.completed_at:
+                TASK_DURATION.observe(
+                    (task_info.completed_at - task_info.started_at).total_seconds(),
+                    status=task_info.status.value
+                )
             
             # Вызываем callback прогресса с финальным статусом
-            if task_id in self.progress_callbacks:
+            # (при остановке бота пользователь увидит результат после возобновления)
+            if self._stopping:
+                self.progress_callbacks.pop(task_id, None)
+            elif task_id in self.progress_callbacks:
                 try:
                     await self.progress_callbacks[task_id](task_info)
                 except Exception as e:
@@ -140,6 +462,8 @@ class TaskManager:
     
     def cancel_task(self, task_id: str) -> bool:
         """Отмена задачи"""
+        if self._cancel_queued(task_id):
+            return True
         if task_id in self.running_tasks:
             async_task = self.running_tasks[task_id]
             async_task.cancel()
@@ -157,6 +481,9 @@ class TaskManager:
     async def update_progress(self, task_id: str, message: str):
         """Обновление прогресса задачи"""
         if task_id in self.tasks:
+            # Повтор того же текста не требует обновления сообщения
+            if self.tasks[task_id].progress_message == message:
+                return
             self.tasks[task_id].progress_message = message
             
             # Вызываем callback прогресса
@@ -166,30 +493,49 @@ class TaskManager:
                 except Exception as e:
                     logger.error(f"Ошибка в progress_callback для задачи {task_id}: {e}")
     
-    def cleanup_completed_tasks(self, max_age_hours: int = 24):
-        """Очистка завершенных задач старше указанного времени"""
-        current_time = datetime.now()
-        tasks_to_remove = []
+    def _schedule_expiry(self, task_info: TaskInfo) -> None:
+        """Постановка завершенной задачи в очередь на удаление"""
+        if task_info.status not in FINISHED_STATUSES or not task_info.completed_at:
+            return
+        heapq.heappush(self._expiry_heap, (task_info.completed_at, task_info.task_id))
+        if task_info.result is not None:
+            heapq.heappush(self._result_heap, (task_info.completed_at, task_info.task_id))
+    
+    def _expire(self, now: datetime, max_age_hours: Optional[float] = None) -> int:
+        """Удаление задач, завершенных раньше срока хранения; возвращает число удаленных.
         
-        for task_id, task_info in self.tasks.items():
-            if (task_info.status in [TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED] and
-                task_info.completed_at and
-                (current_time - task_info.completed_at).total_seconds() > max_age_hours * 3600):
-                tasks_to_remove.append(task_id)
+        Просматриваются только устаревшие записи кучи: O(k log n) для k удаляемых задач.
+        """
+        result_cutoff = now - self.result_retention
+        while self._result_heap and self._result_heap[0][0] <= result_cutoff:
+            _, task_id = heapq.heappop(self._result_heap)
+            task_info = self.tasks.get(task_id)
+            if task_info:
+                task_info.result = None
         
-        for task_id in tasks_to_remove:
+        retention_hours = self.retention_hours if max_age_hours is None else max_age_hours
+        cutoff = now - timedelta(hours=retention_hours)
+        removed = 0
+        while self._expiry_heap and self._expiry_heap[0][0] <= cutoff:
+            completed_at, task_id = heapq.heappop(self._expiry_heap)
+            task_info = self.tasks.get(task_id)
+            # Запись могла устареть: задача уже удалена или перезапущена с тем же ID
+            if (not task_info or task_info.status not in FINISHED_STATUSES or
+                    task_info.completed_at != completed_at):
+                continue
+            
             del self.tasks[task_id]
-            # Удаляем из user_tasks если это текущая задача пользователя
-            user_id = None
-            for uid, tid in self.user_tasks.items():
-                if tid == task_id:
-                    user_id = uid
-                    break
-            if user_id:
-                del self.user_tasks[user_id]
-        
-        if tasks_to_remove:
-            logger.info(f"Очищено {len(tasks_to_remove)} завершенных задач")
+            # Удаляем из user_tasks, если это текущая задача пользователя
+            if self.user_tasks.get(task_info.user_id) == task_id:
+                del self.user_tasks[task_info.user_id]
+            removed += 1
+        return removed
+    
+    def cleanup_completed_tasks(self, max_age_hours: Optional[float] = None):
+        """Очистка завершенных задач старше указанного времени (по умолчанию TASK_RETENTION_HOURS)"""
+        removed = self._expire(datetime.now(), max_age_hours)
+        if removed:
+            logger.info(f"Очищено {removed} завершенных задач")
     
     def get_stats(self) -> Dict[str, int]:
         """Получение статистики задач"""
@@ -199,7 +545,8 @@ class TaskManager:
             "running": 0,
             "completed": 0,
             "failed": 0,
-            "cancelled": 0
+            "cancelled": 0,
+            "queued": len(self._queue)
         }
         
         for task_info in self.tasks.values():
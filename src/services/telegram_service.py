@@ -1,78 +1,306 @@
 import asyncio
-from typing import Optional, List, Dict, Any
+import hashlib
+import uuid
+from typing import Optional, List, Dict, Any, Callable, Tuple, Set
 from datetime import datetime, timedelta
 from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.error import TelegramError, BadRequest, Forbidden
+from telegram.error import TelegramError, BadRequest, Forbidden, RetryAfter, NetworkError
 from loguru import logger
 
 from config import settings
 from models.report import WeeklyReport
 from models.department import Employee
+from .rate_limiter import TelegramRateLimiter
+from .edit_coalescer import MessageEditCoalescer
+
+# Результаты отправки сообщения
+SEND_OK = "sent"
+SEND_BLOCKED = "blocked"
+SEND_FAILED = "failed"
+SEND_RETRY = "retry"     # временная ошибка не устранена повторами, стоит попробовать позже
+SEND_QUEUED = "pending"  # сообщение осталось в очереди исходящих и будет отправлено позже
+
+# ID сообщения для отчетов, опубликованных в составе сводки (реальный ID появится позже)
+DIGEST_MESSAGE_ID = 0
+# ID сообщения для отчетов, оставшихся в очереди исходящих (реальный ID появится после отправки)
+QUEUED_MESSAGE_ID = -1
+
+# Пауза перед повтором при сетевой ошибке (удваивается с каждой попыткой)
+SEND_RETRY_BASE_DELAY = 1.0
 
 class TelegramService:
     """Сервис для работы с Telegram API"""
     
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: Bot, rate_limiter: Optional[TelegramRateLimiter] = None):
         self.bot = bot
         self.group_chat_id = settings.group_chat_id
         self.thread_id = settings.thread_id
+        self.rate_limiter = rate_limiter or TelegramRateLimiter()
+        self.max_send_attempts = settings.telegram_send_max_attempts
+        # Правки сообщений с прогрессом объединяются и выполняются не чаще заданного интервала
+        self.edit_coalescer = MessageEditCoalescer(bot, self.rate_limiter)
+        # Очередь исходящих сообщений (MessageOutbox), подключается в main.py
+        self.outbox = None
+        # Сводные публикации отчетов (GroupDigest), подключаются в main.py
+        self.group_digest = None
+        # Учет пользователей, заблокировавших бота (DeliveryTracker), подключается в main.py
+        self.delivery_tracker = None
+        # Фоновые отправки уведомлений (не блокируют вызывающий код)
+        self._background_tasks: Set[asyncio.Task] = set()
+    
+    @property
+    def outbox_active(self) -> bool:
+        return self.outbox is not None and self.outbox.is_running
+    
+    @staticmethod
+    def _content_key(kind: str, chat_id: int, text: str) -> str:
+        """Ключ идемпотентности сообщения по его содержимому"""
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+        return f"{kind}:{chat_id}:{digest}"
+    
+    async def deliver_message(self, chat_id: int, text: str,
+                              reply_markup: Optional[InlineKeyboardMarkup] = None,
+                              parse_mode: str = 'HTML',
+                              message_thread_id: Optional[int] = None) -> Tuple[str, Optional[int]]:
+        """Отправка сообщения с учетом лимитов Telegram и повтором временных ошибок.
+        
+        Возвращает статус отправки и ID отправленного сообщения.
+        """
+        for attempt in range(1, self.max_send_attempts + 1):
+            await self.rate_limiter.acquire(chat_id)
+            try:
+                message = await self.bot.send_message(
+                    chat_id=chat_id,
+                    text=text,
+                    reply_markup=reply_markup,
+                    parse_mode=parse_mode,
+                    message_thread_id=message_thread_id
+                )
+                return SEND_OK, message.message_id
+            except Forbidden as e:
+                logger.warning(f"Пользователь {chat_id} заблокировал бота")
+                await self._mark_unreachable(chat_id, str(e))
+                return SEND_BLOCKED, None
+            except BadRequest as e:
+                logger.error(f"Ошибка отправки сообщения пользователю {chat_id}: {e}")
+                if "chat not found" in str(e).lower():
+                    await self._mark_unreachable(chat_id, str(e))
+                    return SEND_BLOCKED, None
+                return SEND_FAILED, None
+            except RetryAfter as e:
+                # Пауза распространяется на все отправки, сообщение повторяется
+                self.rate_limiter.retry_after(e.retry_after)
+                error = e
+            except NetworkError as e:
+                error = e
+                if attempt < self.max_send_attempts:
+                    await asyncio.sleep(SEND_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+            except TelegramError as e:
+                logger.error(f"Telegram ошибка при отправке сообщения {chat_id}: {e}")
+                return SEND_FAILED, None
+            except Exception as e:
+                logger.error(f"Неожиданная ошибка при отправке сообщения {chat_id}: {e}")
+                return SEND_FAILED, None
+            
+            logger.warning(f"Попытка {attempt} отправки сообщения {chat_id} не удалась: {error}")
+        
+        logger.error(f"Сообщение {chat_id} не отправлено за {self.max_send_attempts} попыток")
+        return SEND_RETRY, None
+    
+    async def _mark_unreachable(self, chat_id: int, reason: str) -> None:
+        """Исключение пользователя из рассылок до его следующего обращения к боту"""
+        if not self.delivery_tracker:
+            return
+        try:
+            await self.delivery_tracker.mark_unreachable(chat_id, reason)
+        except Exception as e:
+            logger.error(f"Не удалось отметить недоступного пользователя {chat_id}: {e}")
     
     async def send_message_safe(self, chat_id: int, text: str, 
                                reply_markup: Optional[InlineKeyboardMarkup] = None,
                                parse_mode: str = 'HTML') -> bool:
         """Безопасная отправка сообщения с обработкой ошибок"""
-        try:
-            await self.bot.send_message(
-                chat_id=chat_id,
-                text=text,
-                reply_markup=reply_markup,
-                parse_mode=parse_mode
+        status, _ = await self.deliver_message(chat_id, text, reply_markup, parse_mode)
+        return status == SEND_OK
+    
+    async def send_message_durable(self, key: str, chat_id: int, text: str,
+                                   timeout: Optional[float] = None, **options) -> Tuple[str, Optional[int]]:
+        """Отправка через очередь исходящих сообщений (если она запущена).
+        
+        Сообщение с уже отправленным ключом повторно не отправляется;
+        по истечении timeout сообщение остается в очереди.
+        """
+        if not self.outbox_active:
+            return await self.deliver_message(chat_id, text, **options)
+        return await self.outbox.send(key, chat_id, text, timeout=timeout, **options)
+    
+    async def send_bulk(self, messages: List[Tuple[int, str]],
+                        progress_callback: Optional[Callable[[int, int], Any]] = None,
+                        idempotency_prefix: Optional[str] = None,
+                        result_callback: Optional[Callable[[int, str], Any]] = None) -> Dict[str, int]:
+        """Параллельная массовая рассылка в пределах лимитов Telegram.
+        
+        messages - пары (chat_id, текст); progress_callback(отправлено, всего)
+        вызывается по мере продвижения рассылки (может быть корутиной),
+        result_callback(chat_id, статус) - после отправки каждого сообщения.
+        При запущенной очереди исходящих сообщений вся рассылка сначала
+        записывается в нее (ключ - префикс и chat_id) и продолжится после
+        перезапуска бота.
+        """
+        results = {'sent': 0, 'failed': 0, 'blocked': 0}
+        
+        async def report_result(chat_id: int, status: str):
+            if not result_callback:
+                return
+            try:
+                outcome = result_callback(chat_id, status)
+                if asyncio.iscoroutine(outcome):
+                    await outcome
+            except Exception as e:
+                logger.warning(f"Ошибка обработчика результата рассылки: {e}")
+        
+        # Недоступным пользователям рассылка не отправляется
+        if self.delivery_tracker:
+            reachable = []
+            for chat_id, text in messages:
+                if self.delivery_tracker.is_unreachable(chat_id):
+                    await report_result(chat_id, SEND_BLOCKED)
+                else:
+                    reachable.append((chat_id, text))
+            results['failed'] = results['blocked'] = len(messages) - len(reachable)
+            messages = reachable
+        
+        total = len(messages)
+        if not total:
+            return results
+        
+        use_outbox = self.outbox_active
+        if use_outbox:
+            from .outbox import OutboxPriority
+            prefix = idempotency_prefix or f"bulk:{uuid.uuid4().hex}"
+            # Рассылка уступает очередь интерактивным сообщениям (публикации отчетов и т.п.)
+            self.outbox.enqueue_many(
+                [(f"{prefix}:{chat_id}", chat_id, text, {}) for chat_id, text in messages],
+                priority=OutboxPriority.BULK
             )
-            return True
-        except Forbidden:
-            logger.warning(f"Пользователь {chat_id} заблокировал бота")
-            return False
-        except BadRequest as e:
-            logger.error(f"Ошибка отправки сообщения пользователю {chat_id}: {e}")
-            return False
-        except TelegramError as e:
-            logger.error(f"Telegram ошибка при отправке сообщения {chat_id}: {e}")
-            return False
-        except Exception as e:
-            logger.error(f"Неожиданная ошибка при отправке сообщения {chat_id}: {e}")
-            return False
+        
+        semaphore = asyncio.Semaphore(settings.telegram_bulk_concurrency)
+        progress_step = max(total // 10, 1)
+        done = 0
+        
+        async def send_one(chat_id: int, text: str):
+            nonlocal done
+            if use_outbox:
+                status, _ = await self.outbox.wait(f"{prefix}:{chat_id}")
+            else:
+                async with semaphore:
+                    status, _ = await self.deliver_message(chat_id, text)
+            
+            if status == SEND_OK:
+                results['sent'] += 1
+            else:
+                # Заблокировавшие бота учитываются и как неудачные отправки
+                results['failed'] += 1
+                if status == SEND_BLOCKED:
+                    results['blocked'] += 1
+            await report_result(chat_id, status)
+            
+            done += 1
+            if done % progress_step == 0 or done == total:
+                logger.info(f"Рассылка: {done}/{total}")
+                if progress_callback:
+                    try:
+                        outcome = progress_callback(done, total)
+                        if asyncio.iscoroutine(outcome):
+                            await outcome
+                    except Exception as e:
+                        logger.warning(f"Ошибка обработчика прогресса рассылки: {e}")
+        
+        await asyncio.gather(*(send_one(chat_id, text) for chat_id, text in messages))
+        return results
     
     async def send_report_to_group(self, report: WeeklyReport) -> bool:
         """Отправка отчета в групповой чат"""
+        return await self.post_report_to_group(report) is not None
+    
+    async def post_report_to_group(self, report: WeeklyReport, analysis_pending: bool = False) -> Optional[int]:
+        """Публикация отчета в групповом чате, возвращает ID сообщения.
+        
+        В режиме сводки отчет добавляется в общее сообщение, которое
+        публикуется позже; тогда возвращается DIGEST_MESSAGE_ID. Если
+        отчет не успел уйти из очереди исходящих сообщений, он будет
+        опубликован позже, и возвращается QUEUED_MESSAGE_ID.
+        """
+        if self.group_digest:
+            self.group_digest.add(report, analysis_pending)
+            logger.info(f"Отчет пользователя {report.user_id} добавлен в сводку группы")
+            return DIGEST_MESSAGE_ID
+        
         try:
             # Форматируем отчет для отправки
-            formatted_report = self._format_report_for_group(report)
+            formatted_report = self._format_report_for_group(report, analysis_pending)
             
-            # Отправляем в группу
-            if self.thread_id:
-                # Если указан thread_id, отправляем в тред
-                await self.bot.send_message(
-                    chat_id=self.group_chat_id,
-                    text=formatted_report,
-                    message_thread_id=self.thread_id,
-                    parse_mode='HTML'
-                )
-            else:
-                # Обычное сообщение в группу
-                await self.bot.send_message(
-                    chat_id=self.group_chat_id,
-                    text=formatted_report,
-                    parse_mode='HTML'
-                )
+            # Отправляем в группу (в тред, если указан thread_id).
+            # Повторная публикация того же отчета (например, после перезапуска) не дублируется
+            status, message_id = await self.send_message_durable(
+                self._group_report_key(report), self.group_chat_id, formatted_report,
+                timeout=settings.request_timeout,
+                parse_mode='HTML',
+                message_thread_id=self.thread_id
+            )
+            if status == SEND_QUEUED:
+                logger.warning(f"Отчет пользователя {report.user_id} ожидает отправки в группу в очереди")
+                return QUEUED_MESSAGE_ID
+            if status != SEND_OK:
+                logger.error(f"Отчет пользователя {report.user_id} не отправлен в группу ({status})")
+                return None
             
             logger.info(f"Отчет пользователя {report.user_id} отправлен в группу")
-            return True
+            return message_id
             
         except Exception as e:
             logger.error(f"Ошибка отправки отчета в группу: {e}")
+            return None
+    
+    async def update_report_in_group(self, message_id: int, report: WeeklyReport) -> bool:
+        """Обновление опубликованного отчета после завершения ИИ-анализа"""
+        if self.group_digest and self.group_digest.update(report):
+            return True
+        if message_id == DIGEST_MESSAGE_ID:
+            # Сводка уже вытеснена из памяти (например, после перезапуска)
             return False
+        if message_id == QUEUED_MESSAGE_ID:
+            message_id = await self._wait_group_report(report)
+            if message_id is None:
+                return False
+        
+        updated = await self.edit_message_safe(
+            chat_id=self.group_chat_id,
+            message_id=message_id,
+            text=self._format_report_for_group(report)
+        )
+        if updated:
+            logger.info(f"Отчет пользователя {report.user_id} в группе дополнен ИИ анализом")
+        return updated
+    
+    @staticmethod
+    def _group_report_key(report: WeeklyReport) -> str:
+        """Ключ идемпотентности публикации отчета (не зависит от полей ИИ-анализа)"""
+        return f"group-report:{report.user_id}:{report.content_fingerprint()[:16]}"
+    
+    async def _wait_group_report(self, report: WeeklyReport) -> Optional[int]:
+        """ID публикации отчета, который был поставлен в очередь исходящих сообщений"""
+        if self.outbox is None:
+            return None
+        status, message_id = await self.outbox.wait(
+            self._group_report_key(report), timeout=settings.request_timeout
+        )
+        if status != SEND_OK:
+            logger.warning(f"Отчет пользователя {report.user_id} еще не опубликован в группе ({status})")
+            return None
+        return message_id
     
-    def _format_report_for_group(self, report: WeeklyReport) -> str:
+    def _format_report_for_group(self, report: WeeklyReport, analysis_pending: bool = False) -> str:
         """Форматирование отчета для группового чата"""
         # Эмодзи для украшения
         status_emoji = {
@@ -103,9 +331,24 @@ class TelegramService:
 {self._format_text_block(report.next_week_plans)}
 """
         
+        # Предупреждаем о почти дословном повторе прошлого отчета
+        if report.duplicate_of_week:
+            formatted += (
+                f"\n🔁 <b>Внимание:</b> отчет почти совпадает с отчетом за неделю "
+                f"{report.duplicate_of_week.strftime('%d.%m.%Y')} "
+                f"(сходство {report.duplicate_similarity * 100:.0f}%)\n"
+            )
+        
         # Добавляем ИИ анализ если есть
-        if hasattr(report, 'ai_summary') and report.ai_summary:
-            formatted += f"\n🤖 <b>ИИ Анализ:</b>\n{self._format_text_block(report.ai_summary)}"
+        if report.summary and report.is_processed:
+            formatted += f"\n🤖 <b>ИИ Анализ:</b>\n{self._format_text_block(report.summary)}"
+        elif report.summary:
+            # Автоматическая выжимка без ИИ (Ollama недоступна или перегружена)
+            formatted += f"\n📝 <b>Краткое содержание:</b>\n{self._format_text_block(report.summary)}"
+            if analysis_pending:
+                formatted += "\n🤖 <b>ИИ Анализ:</b> <i>⏳ в очереди на обработку</i>"
+        elif analysis_pending:
+            formatted += "\n🤖 <b>ИИ Анализ:</b> <i>⏳ в очереди на обработку</i>"
         
         # Добавляем время отправки
         submit_time = report.submitted_at or report.created_at
@@ -118,6 +361,27 @@ class TelegramService:
         
         return formatted
     
+    def format_report_digest_entry(self, index: int, report: WeeklyReport, analysis_pending: bool = False) -> str:
+        """Краткая запись об отчете для сводного сообщения"""
+        entry = (
+            f"{index}. 👤 <b>{self._format_text_block(report.full_name, 100)}</b> - "
+            f"{self._format_text_block(report.department or 'Отдел не указан', 100)}\n"
+            f"📋 {self._format_text_block(report.completed_tasks, 250)}\n"
+            f"⚠️ {self._format_text_block(report.problems, 150)}"
+        )
+        
+        if report.duplicate_of_week:
+            entry += f"\n🔁 Повтор отчета за {report.duplicate_of_week.strftime('%d.%m.%Y')}"
+        
+        if report.summary and report.is_processed:
+            entry += f"\n🤖 {self._format_text_block(report.summary, 300)}"
+        elif report.summary:
+            entry += f"\n📝 {self._format_text_block(report.summary, 300)}"
+        if analysis_pending:
+            entry += "\n🤖 <i>⏳ ИИ анализ в очереди</i>"
+        
+        return entry
+    
     def _format_text_block(self, text: str, max_length: int = 500) -> str:
         """Форматирование текстового блока с ограничением длины"""
         if not text or text.strip() == "":
@@ -134,7 +398,11 @@ class TelegramService:
     
     async def send_reminder_to_user(self, user_id: int, user_name: str) -> bool:
         """Отправка напоминания пользователю о необходимости сдать отчет"""
-        reminder_text = f"""🔔 <b>Напоминание о еженедельном отчете</b>
+        return await self.send_message_safe(user_id, self._format_reminder(user_name))
+    
+    def _format_reminder(self, user_name: str) -> str:
+        """Текст напоминания о еженедельном отчете"""
+        return f"""🔔 <b>Напоминание о еженедельном отчете</b>
 
 Привет, {user_name}!
 
@@ -149,22 +417,18 @@ class TelegramService:
 • Планы на следующую неделю
 
 Спасибо за своевременность! 🙏"""
-        
-        return await self.send_message_safe(user_id, reminder_text)
     
-    async def send_bulk_reminders(self, users: List[Employee]) -> Dict[str, int]:
+    async def send_bulk_reminders(self, users: List[Employee],
+                                  progress_callback: Optional[Callable[[int, int], Any]] = None,
+                                  idempotency_prefix: Optional[str] = None,
+                                  result_callback: Optional[Callable[[int, str], Any]] = None) -> Dict[str, int]:
         """Массовая отправка напоминаний"""
-        results = {'sent': 0, 'failed': 0}
-        
-        for user in users:
-            success = await self.send_reminder_to_user(user.user_id, user.full_name)
-            if success:
-                results['sent'] += 1
-            else:
-                results['failed'] += 1
-            
-            # Небольшая задержка между отправками
-            await asyncio.sleep(0.5)
+        results = await self.send_bulk(
+            [(user.user_id, self._format_reminder(user.full_name)) for user in users],
+            progress_callback=progress_callback,
+            idempotency_prefix=idempotency_prefix,
+            result_callback=result_callback
+        )
         
         logger.info(f"Отправлено напоминаний: {results['sent']}, неудачных: {results['failed']}")
         return results
@@ -177,13 +441,7 @@ class TelegramService:
 
 📅 <b>Сформировано:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}"""
         
-        sent_count = 0
-        for admin_id in admin_ids:
-            if await self.send_message_safe(admin_id, summary_text):
-                sent_count += 1
-            await asyncio.sleep(0.3)
-        
-        return sent_count
+        return await self._send_to_admins("weekly-summary", admin_ids, summary_text)
     
     async def send_report_confirmation(self, user_id: int, report: WeeklyReport) -> bool:
         """Отправка подтверждения о получении отчета"""
@@ -225,14 +483,40 @@ class TelegramService:
 
 ⏰ {datetime.now().strftime('%d.%m.%Y %H:%M')}"""
         
+        return await self._send_to_admins("admin", admin_ids, admin_text, timeout=settings.request_timeout)
+    
+    async def _send_to_admins(self, kind: str, admin_ids: List[int], text: str,
+                              timeout: Optional[float] = None) -> int:
+        """Одновременная отправка всем администраторам (лимиты соблюдает rate_limiter)"""
+        results = await asyncio.gather(*(
+            self.send_message_durable(self._content_key(kind, admin_id, text), admin_id, text, timeout=timeout)
+            for admin_id in admin_ids
+        ), return_exceptions=True)
+        
         sent_count = 0
-        for admin_id in admin_ids:
-            if await self.send_message_safe(admin_id, admin_text):
+        for admin_id, result in zip(admin_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Ошибка отправки уведомления администратору {admin_id}: {result}")
+            elif result[0] == SEND_OK:
                 sent_count += 1
-            await asyncio.sleep(0.2)
-        
         return sent_count
     
+    def notify_admins(self, admin_ids: List[int], message: str) -> None:
+        """Фоновая отправка уведомления администраторам без ожидания результата"""
+        if not admin_ids:
+            return
+        task = asyncio.create_task(self.send_admin_notification(admin_ids, message))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    async def drain_background(self, timeout: float = 5.0) -> None:
+        """Ожидание фоновых отправок (при остановке бота), не дольше timeout"""
+        if not self._background_tasks:
+            return
+        _, pending = await asyncio.wait(set(self._background_tasks), timeout=timeout)
+        if pending:
+            logger.warning(f"Не дождались отправки {len(pending)} фоновых уведомлений")
+    
     async def get_chat_member_count(self, chat_id: int) -> Optional[int]:
         """Получение количества участников чата"""
         try:
@@ -303,6 +587,8 @@ class TelegramService:
                                reply_markup: Optional[InlineKeyboardMarkup] = None) -> bool:
         """Безопасное редактирование сообщения"""
         try:
+            # Правки расходуют те же лимиты Telegram, что и новые сообщения
+            await self.rate_limiter.acquire(chat_id)
             await self.bot.edit_message_text(
                 chat_id=chat_id,
                 message_id=message_id,
@@ -313,4 +599,16 @@ class TelegramService:
             return True
         except Exception as e:
             logger.debug(f"Не удалось отредактировать сообщение {message_id} в чате {chat_id}: {e}")
-            return False
\ No newline at end of file
+            return False
+    
+    async def edit_message_coalesced(self, chat_id: int, message_id: int, text: str,
+                                     reply_markup: Optional[InlineKeyboardMarkup] = None,
+                                     wait: bool = False) -> None:
+        """Правка сообщения через объединение правок (для часто меняющегося прогресса).
+        
+        Промежуточные тексты, не успевшие попасть в сообщение, заменяются последним;
+        wait=True дожидается применения правки (например, для финального статуса).
+        """
+        self.edit_coalescer.request(chat_id, message_id, text, reply_markup)
+        if wait:
+            await self.edit_coalescer.flush(chat_id, message_id)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Прием обновлений Telegram через webhook.
+Встроенный aiohttp-сервер принимает POST-запросы Telegram, проверяет
+секретный токен (заголовок X-Telegram-Bot-Api-Secret-Token) и передает
+обновления в очередь приложения python-telegram-bot. В отличие от
+long polling обновления приходят сразу, а в простое бот не держит
+постоянных запросов к Telegram.
+
+Локальная проверка:
+    curl -X POST http://127.0.0.1:8443/telegram/webhook \\
+         -H "X-Telegram-Bot-Api-Secret-Token: <WEBHOOK_SECRET_TOKEN>" \\
+         -H "Content-Type: application/json" -d @update.json
+
+Автор: Telegram Report Bot
+Версия: 1.0.0
+"""
+
+import hmac
+import json
+import secrets
+import ssl
+from pathlib import Path
+from typing import Optional
+
+from aiohttp import web
+from loguru import logger
+from telegram import Update
+from telegram.ext import Application
+
+from config import settings
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """aiohttp-сервер для приема обновлений Telegram"""
+
+    def __init__(self, application: Application, listen: Optional[str] = None, port: Optional[int] = None,
+                 path: Optional[str] = None, secret_token: Optional[str] = None):
+        self.application = application
+        self.listen = listen or settings.webhook_listen
+        self.port = port or settings.webhook_port
+        self.path = "/" + (path or settings.webhook_path).lstrip("/")
+        # Без заданного токена генерируется случайный: он передается Telegram при каждом запуске
+        self.secret_token = secret_token or settings.webhook_secret_token or secrets.token_urlsafe(32)
+        self.cert_path = settings.webhook_cert_path
+        self.key_path = settings.webhook_key_path
+
+        self.app = web.Application()
+        self.app.router.add_post(self.path, self._handle_update)
+        self.app.router.add_get("/healthz", self._handle_health)
+        self._runner: Optional[web.AppRunner] = None
+        self.stats = {"received": 0, "rejected": 0, "invalid": 0}
+
+    @property
+    def webhook_url(self) -> str:
+        """Публичный адрес webhook, сообщаемый Telegram"""
+        return settings.webhook_url.rstrip("/") + self.path
+
+    def _ssl_context(self) -> Optional[ssl.SSLContext]:
+        """TLS на самом сервере (если сертификат не терминируется прокси)"""
+        if not (self.cert_path and self.key_path):
+            return None
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(self.cert_path, self.key_path)
+        return context
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        """Прием обновления от Telegram"""
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token, self.secret_token):
+            self.stats["rejected"] += 1
+            logger.warning(f"Отклонен запрос к webhook без верного секретного токена ({request.remote})")
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.application.bot)
+        except (json.JSONDecodeError, ValueError, TypeError, KeyError) as e:
+            self.stats["invalid"] += 1
+            logger.error(f"Некорректное обновление в webhook: {e}")
+            return web.Response(status=400)
+
+        if update is None:
+            self.stats["invalid"] += 1
+            return web.Response(status=400)
+
+        # Обработка идет в фоне: Telegram получает ответ сразу
+        await self.application.update_queue.put(update)
+        self.stats["received"] += 1
+        return web.Response(status=200)
+
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", **self.stats})
+
+    async def start(self) -> None:
+        """Запуск сервера и регистрация webhook в Telegram"""
+        if not settings.webhook_url:
+            raise ValueError("Для режима webhook нужно указать WEBHOOK_URL")
+
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port, ssl_context=self._ssl_context())
+        await site.start()
+
+        # Самоподписанный сертификат нужно передать Telegram при регистрации
+        certificate = Path(self.cert_path).read_bytes() if self.cert_path else None
+        try:
+            await self.application.bot.set_webhook(
+                url=self.webhook_url,
+                certificate=certificate,
+                secret_token=self.secret_token,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True
+            )
+        except Exception:
+            await self.stop()
+            raise
+        logger.info(f"Webhook запущен: {self.listen}:{self.port}{self.path} -> {self.webhook_url}")
+
+    async def stop(self) -> None:
+        """Остановка сервера (webhook в Telegram сохраняется, обновления дождутся перезапуска)"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+        logger.info("Webhook-сервер остановлен")
@@ -27,6 +27,9 @@ from .text_utils import (
     extract_keywords,
     highlight_keywords,
     generate_summary,
+    split_sentences,
+    rank_sentences,
+    extractive_summary,
     validate_text_length,
     format_user_input,
     create_progress_bar,
@@ -90,6 +93,9 @@ __all__ = [
     'extract_keywords',
     'highlight_keywords',
     'generate_summary',
+    'split_sentences',
+    'rank_sentences',
+    'extractive_summary',
     'validate_text_length',
     'format_user_input',
     'create_progress_bar',
@@ -176,6 +176,19 @@ def convert_from_utc(dt: datetime) -> datetime:
     tz = get_timezone()
     return dt.astimezone(tz)
 
+def deadline_weekday(deadline_day: int) -> int:
+    """День недели дедлайна отдела в формате datetime.weekday().
+    
+    В БД и в REPORT_DEADLINE_DAY день хранится как в ISO: 1=понедельник,
+    5=пятница, 7=воскресенье (0 также считается воскресеньем).
+    
+    >>> deadline_weekday(5)  # пятница
+    4
+    >>> deadline_weekday(1), deadline_weekday(7), deadline_weekday(0)
+    (0, 6, 6)
+    """
+    return (deadline_day - 1) % 7
+
 def get_deadline_datetime() -> datetime:
     """Получение времени дедлайна для отчетов
     
@@ -1,7 +1,24 @@
 import re
 from typing import List, Optional, Dict, Any
+
+import numpy as np
 from loguru import logger
 
+# Стоп-слова русского языка для извлечения ключевых слов и реферирования
+RUSSIAN_STOP_WORDS = frozenset({
+    'и', 'в', 'на', 'с', 'по', 'для', 'от', 'до', 'из', 'к', 'о', 'об', 'при', 'за', 'над', 'под',
+    'что', 'как', 'где', 'когда', 'почему', 'который', 'которая', 'которое', 'которые',
+    'это', 'то', 'та', 'те', 'тот', 'эта', 'этот', 'эти',
+    'я', 'ты', 'он', 'она', 'оно', 'мы', 'вы', 'они',
+    'мой', 'твой', 'его', 'её', 'наш', 'ваш', 'их',
+    'не', 'ни', 'да', 'нет', 'или', 'но', 'а', 'же', 'ли', 'бы',
+    'был', 'была', 'было', 'были', 'есть', 'будет', 'будут'
+})
+
+# Длина основы слова при реферировании: грубая замена стемминга,
+# чтобы "поставка" и "поставки" считались одним термином
+SUMMARY_STEM_LENGTH = 6
+
 def clean_text(text: str) -> str:
     """Очистка текста от лишних символов и пробелов"""
     if not text:
@@ -227,19 +244,9 @@ def extract_keywords(text: str, min_length: int = 3) -> List[str]:
     words = clean_text.split()
     
     # Фильтруем по длине и убираем стоп-слова
-    stop_words = {
-        'и', 'в', 'на', 'с', 'по', 'для', 'от', 'до', 'из', 'к', 'о', 'об', 'при', 'за', 'над', 'под',
-        'что', 'как', 'где', 'когда', 'почему', 'который', 'которая', 'которое', 'которые',
-        'это', 'то', 'та', 'те', 'тот', 'эта', 'этот', 'эти',
-        'я', 'ты', 'он', 'она', 'оно', 'мы', 'вы', 'они',
-        'мой', 'твой', 'его', 'её', 'наш', 'ваш', 'их',
-        'не', 'ни', 'да', 'нет', 'или', 'но', 'а', 'же', 'ли', 'бы',
-        'был', 'была', 'было', 'были', 'есть', 'будет', 'будут'
-    }
-    
     keywords = []
     for word in words:
-        if len(word) >= min_length and word not in stop_words:
+        if len(word) >= min_length and word not in RUSSIAN_STOP_WORDS:
             keywords.append(word)
     
     # Убираем дубликаты, сохраняя порядок
@@ -294,6 +301,84 @@ def generate_summary(text: str, max_sentences: int = 3) -> str:
         selected = [sentences[0], sentences[middle_idx], sentences[-1]]
         return ". ".join(selected) + "."
 
+def split_sentences(text: str) -> List[str]:
+    """Разделение текста на предложения (пункты списков считаются отдельными предложениями)"""
+    if not text:
+        return []
+    
+    sentences = []
+    for line in text.split('\n'):
+        # Убираем маркеры списков: "1.", "-", "•"
+        line = re.sub(r'^\s*(?:\d+[.)]|[-•*])\s*', '', line).strip()
+        sentences.extend(part.strip() for part in re.split(r'(?<=[.!?])\s+', line) if part.strip())
+    return sentences
+
+def _sentence_terms(sentence: str) -> List[str]:
+    """Термины предложения: основы значимых слов"""
+    words = re.findall(r'\w+', sentence.lower())
+    return [
+        word[:SUMMARY_STEM_LENGTH] for word in words
+        if len(word) >= 3 and word not in RUSSIAN_STOP_WORDS and not word.isdigit()
+    ]
+
+def rank_sentences(sentences: List[str], damping: float = 0.85, iterations: int = 50) -> np.ndarray:
+    """Оценка важности предложений (TextRank на косинусном сходстве TF-IDF)"""
+    count = len(sentences)
+    if count == 0:
+        return np.zeros(0)
+    
+    terms = [_sentence_terms(sentence) for sentence in sentences]
+    vocabulary = {term: index for index, term in enumerate(sorted({t for sentence in terms for t in sentence}))}
+    if not vocabulary:
+        return np.full(count, 1.0 / count)
+    
+    # Матрица TF-IDF: строки - предложения, столбцы - термины
+    tf = np.zeros((count, len(vocabulary)))
+    for row, sentence_terms in enumerate(terms):
+        for term in sentence_terms:
+            tf[row, vocabulary[term]] += 1
+    document_frequency = np.count_nonzero(tf, axis=0)
+    idf = np.log((1 + count) / (1 + document_frequency)) + 1
+    tfidf = tf * idf
+    norms = np.linalg.norm(tfidf, axis=1, keepdims=True)
+    tfidf = np.divide(tfidf, norms, out=np.zeros_like(tfidf), where=norms > 0)
+    
+    similarity = tfidf @ tfidf.T
+    np.fill_diagonal(similarity, 0)
+    
+    # Нормировка по строкам; предложения без связей "раздают" вес равномерно
+    row_sums = similarity.sum(axis=1, keepdims=True)
+    transition = np.divide(similarity, row_sums, out=np.full_like(similarity, 1.0 / count), where=row_sums > 0)
+    
+    scores = np.full(count, 1.0 / count)
+    for _ in range(iterations):
+        updated = (1 - damping) / count + damping * (transition.T @ scores)
+        if np.abs(updated - scores).sum() < 1e-6:
+            scores = updated
+            break
+        scores = updated
+    
+    # Предложения без значимых слов ("Нет", "Все по плану") не выбираются
+    informative = np.array([len(sentence_terms) > 0 for sentence_terms in terms])
+    return np.where(informative, scores, 0.0)
+
+def extractive_summary(text: str, max_sentences: int = 3, max_length: Optional[int] = None) -> str:
+    """Извлекающее реферирование: самые важные предложения в исходном порядке"""
+    sentences = split_sentences(text)
+    if len(sentences) <= max_sentences:
+        result = ' '.join(sentences)
+    else:
+        scores = rank_sentences(sentences)
+        selected = sorted(np.argsort(-scores, kind='stable')[:max_sentences])
+        
+        result = ' '.join(
+            sentences[index] if sentences[index][-1] in '.!?' else sentences[index] + '.'
+            for index in selected if scores[index] > 0
+        )
+    if max_length:
+        result = truncate_text(result, max_length)
+    return result
+
 def validate_text_length(text: str, min_length: int = 0, max_length: int = 10000) -> Dict[str, Any]:
     """Валидация длины текста"""
     if not text: